@@ -0,0 +1,228 @@
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import UTRRecord
+
+
+class DuplicateUTR(ValueError):
+    """The UTR is already registered against another order."""
+
+
+class UTRRegistry:
+    """
+    UTRRecord as the single registry of bank UTRs used by orders.
+
+    Every active order with a UTR has one record (kept in sync by the Order
+    signals in master.signals). The unique index on ``UTRRecord.utr`` is what
+    rejects a duplicate: a concurrent second insert fails in the database even
+    when both requests passed the ``exists`` pre-check.
+    """
+
+    # Rows per ``utr__in`` query; stays under SQLite's bound parameter limit
+    CHUNK_SIZE = 500
+    UTR_COLUMNS = ('utr', 'utr no', 'utr number', 'utr_no', 'reference', 'reference no', 'ref no', 'transaction id')
+    AMOUNT_COLUMNS = ('amount', 'credit', 'credit amount', 'deposit', 'deposit amount')
+
+    @staticmethod
+    def normalize(utr):
+        return (utr or '').strip().upper()
+
+    @classmethod
+    def exists(cls, utr, exclude_order=None):
+        utr = cls.normalize(utr)
+        if not utr:
+            return False
+        records = UTRRecord.objects.filter(utr=utr)
+        if exclude_order is not None:
+            records = records.exclude(order=exclude_order)
+        return records.exists()
+
+    @classmethod
+    def register(cls, order, utr, user=None):
+        """
+        Record ``utr`` for ``order``, replacing the order's previous UTR.
+
+        Raises:
+            DuplicateUTR: the UTR belongs to another order
+        """
+        utr = cls.normalize(utr)
+        try:
+            with transaction.atomic():
+                UTRRecord.objects.filter(order=order).exclude(utr=utr).delete()
+                _, created = UTRRecord.objects.get_or_create(order=order, utr=utr, defaults={'captured_by': user, 'creator': user})
+        except IntegrityError:
+            raise DuplicateUTR(f'UTR {utr} already exists')
+        return created
+
+    @staticmethod
+    def release(order):
+        """Free the order's UTR, e.g. when the order is deleted."""
+        UTRRecord.objects.filter(order=order).delete()
+
+    @classmethod
+    def sync(cls, order):
+        if order.is_active and cls.normalize(order.utr):
+            cls.register(order, order.utr, order.creator)
+        else:
+            cls.release(order)
+
+    @classmethod
+    def register_many(cls, orders):
+        """Insert the records of newly created orders; a duplicate fails the whole batch with IntegrityError."""
+        UTRRecord.objects.bulk_create(
+            [
+                UTRRecord(utr=cls.normalize(order.utr), order=order, captured_by_id=order.creator_id, creator_id=order.creator_id)
+                for order in orders
+                if order.is_active and cls.normalize(order.utr)
+            ]
+        )
+
+    @classmethod
+    def lookup_many(cls, utrs):
+        """
+        Registry rows for a batch of UTRs.
+
+        Returns:
+            dict of normalized UTR -> dict with record_id, order_id, order_no, total_amount and verified
+        """
+        utrs = sorted({cls.normalize(utr) for utr in utrs} - {''})
+        found = {}
+        for start in range(0, len(utrs), cls.CHUNK_SIZE):
+            rows = UTRRecord.objects.filter(utr__in=utrs[start:start + cls.CHUNK_SIZE]).values_list(
+                'utr', 'pk', 'order_id', 'order__order_no', 'order__total_amount', 'verified'
+            )
+            for utr, record_id, order_id, order_no, total_amount, verified in rows:
+                found[utr] = {
+                    'record_id': record_id,
+                    'order_id': order_id,
+                    'order_no': order_no,
+                    'total_amount': total_amount,
+                    'verified': verified,
+                }
+        return found
+
+    @classmethod
+    def parse_statement(cls, fileobj):
+        """
+        (utr, amount) pairs from a bank statement CSV.
+
+        The UTR and amount columns are found by header name; without a
+        recognised header the first column is read as the UTR.
+        """
+        content = fileobj.read()
+        if isinstance(content, bytes):
+            content = content.decode('utf-8-sig')
+        rows = list(csv.reader(io.StringIO(content)))
+        if not rows:
+            return []
+
+        header = [cell.strip().lower() for cell in rows[0]]
+        utr_column = next((header.index(name) for name in cls.UTR_COLUMNS if name in header), None)
+        amount_column = next((header.index(name) for name in cls.AMOUNT_COLUMNS if name in header), None)
+        if utr_column is None:
+            utr_column = 0
+        else:
+            rows = rows[1:]
+
+        entries = []
+        for row in rows:
+            if len(row) <= utr_column or not cls.normalize(row[utr_column]):
+                continue
+            amount = None
+            if amount_column is not None and len(row) > amount_column:
+                try:
+                    amount = Decimal(row[amount_column].replace(',', '').strip())
+                except InvalidOperation:
+                    amount = None
+            entries.append((cls.normalize(row[utr_column]), amount))
+        return entries
+
+    @classmethod
+    def reconcile(cls, entries, user=None, mark_verified=False):
+        """
+        Match statement (utr, amount) entries against the registry in one pass.
+
+        Amounts are compared with the order total when the statement has them.
+        With ``mark_verified`` the matched records whose statement amount equals
+        the order total are marked verified by ``user``; entries without an
+        amount (pasted UTRs) are only reported, never verified.
+
+        Returns:
+            dict with matched, amount_mismatch, unmatched and duplicate lists and a summary
+        """
+        registry = cls.lookup_many(utr for utr, amount in entries)
+        matched, mismatched, unmatched, duplicates = [], [], [], []
+        seen = set()
+        for utr, amount in entries:
+            if utr in seen:
+                duplicates.append(utr)
+                continue
+            seen.add(utr)
+            record = registry.get(utr)
+            if record is None:
+                unmatched.append({'utr': utr, 'amount': amount})
+                continue
+            row = {'utr': utr, 'amount': amount, **record}
+            if amount is not None and amount != record['total_amount']:
+                mismatched.append(row)
+            else:
+                matched.append(row)
+
+        newly_verified = 0
+        if mark_verified:
+            record_ids = [row['record_id'] for row in matched if not row['verified'] and row['amount'] is not None]
+            for start in range(0, len(record_ids), cls.CHUNK_SIZE):
+                newly_verified += UTRRecord.objects.filter(pk__in=record_ids[start:start + cls.CHUNK_SIZE]).update(
+                    verified=True, verified_by=user, verified_at=timezone.now()
+                )
+
+        return {
+            'matched': matched,
+            'amount_mismatch': mismatched,
+            'unmatched': unmatched,
+            'duplicates': duplicates,
+            'summary': {
+                'total': len(entries),
+                'matched': len(matched),
+                'amount_mismatch': len(mismatched),
+                'unmatched': len(unmatched),
+                'duplicates': len(duplicates),
+                'newly_verified': newly_verified,
+            },
+        }
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Bring the registry in line with the active orders, keeping the
+        verification of records that are still valid.
+
+        Returns:
+            (created, removed, conflicts) where conflicts lists (utr, order_ids)
+            for UTRs used by several orders; the earliest order keeps the UTR
+        """
+        from master.models import Order
+
+        orders = Order.objects.filter(is_active=True).exclude(utr__isnull=True).exclude(utr='')
+        owners = {}
+        for order_id, utr, creator_id in orders.order_by('created', 'pk').values_list('pk', 'utr', 'creator_id').iterator():
+            owners.setdefault(cls.normalize(utr), []).append((order_id, creator_id))
+        owners.pop('', None)
+        conflicts = [(utr, [order_id for order_id, _ in claims]) for utr, claims in owners.items() if len(claims) > 1]
+
+        existing = dict(UTRRecord.objects.values_list('utr', 'order_id'))
+        stale = [utr for utr, order_id in existing.items() if owners.get(utr, [(None, None)])[0][0] != order_id]
+        with transaction.atomic():
+            for start in range(0, len(stale), cls.CHUNK_SIZE):
+                UTRRecord.objects.filter(utr__in=stale[start:start + cls.CHUNK_SIZE]).delete()
+            missing = [
+                UTRRecord(utr=utr, order_id=claims[0][0], captured_by_id=claims[0][1], creator_id=claims[0][1])
+                for utr, claims in owners.items()
+                if existing.get(utr) != claims[0][0]
+            ]
+            UTRRecord.objects.bulk_create(missing, batch_size=1000)
+        return len(missing), len(stale), conflicts
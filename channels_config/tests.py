@@ -1,3 +1,134 @@
-from django.test import TestCase
+import io
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.forms.models import model_to_dict
+from django.test import RequestFactory
+from django.urls import reverse
+
+from accounts.models import User
+from channels_config.models import UTRRecord
+from channels_config.services import DuplicateUTR, UTRRegistry
+from master.models import Order
+from master.tests import MasterTestCase
+
+
+class UTRRegistryTests(MasterTestCase):
+    def order(self, utr, phone_no='9000000001'):
+        return self.quick_order([{'product_id': self.apple.pk, 'price': '100', 'qty': 1}], phone_no=phone_no, utr=utr)
+
+    def test_duplicates_are_rejected_whatever_their_case(self):
+        order = self.order(' utr001 ')
+        self.assertEqual(UTRRecord.objects.get().order, order)
+        self.assertEqual(UTRRecord.objects.get().utr, 'UTR001')
+
+        with self.assertRaises(DuplicateUTR):
+            self.order('UTR001', phone_no='9000000002')
+        self.assertTrue(UTRRegistry.exists('utr001'))
+        self.assertFalse(UTRRegistry.exists('utr001', exclude_order=order))
+
+    def test_edits_move_or_release_the_utr(self):
+        order = self.order('UTR001')
+        order.utr = 'UTR002'
+        order.save()
+        self.assertEqual(list(UTRRecord.objects.values_list('utr', flat=True)), ['UTR002'])
+
+        # Deactivating the order frees its UTR for another order
+        order.delete()
+        self.assertFalse(UTRRecord.objects.exists())
+        self.order('UTR002', phone_no='9000000002')
+
+    def test_admin_form_rejects_a_duplicate_utr(self):
+        self.order('UTR001')
+        other = self.order('UTR002', phone_no='9000000002')
+        request = RequestFactory().get('/')
+        request.user = self.user
+        form_class = admin.site._registry[Order].get_form(request, other)
+        data = {field: value for field, value in model_to_dict(other, fields=form_class.base_fields).items() if value is not None}
+
+        form = form_class({**data, 'utr': 'utr001'}, instance=other)
+
+        self.assertEqual(list(form.errors), ['utr'])
+        self.assertTrue(form_class({**data, 'utr': 'UTR003'}, instance=other).is_valid())
+
+    def test_update_view_reports_a_utr_taken_after_validation(self):
+        self.order('UTR001')
+        other = self.order('UTR002', phone_no='9000000002')
+        customer = other.customer
+        data = {
+            **{field: value for field, value in model_to_dict(customer).items() if value is not None and field != 'id'},
+            'utr': 'UTR001',
+            'account': other.account_id,
+            'order_by': other.order_by_id,
+            'stage': other.stage,
+            'total_amount': other.total_amount,
+            'Ordersubjects-TOTAL_FORMS': 0,
+            'Ordersubjects-INITIAL_FORMS': 0,
+        }
+        self.client.force_login(self.user)
+
+        # A concurrent request registers the UTR between clean() and save()
+        with mock.patch.object(UTRRegistry, 'exists', return_value=False):
+            response = self.client.post(reverse('master:order_update', args=[other.pk]), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('utr', response.context['form'].errors)
+        other.refresh_from_db()
+        self.assertEqual(other.utr, 'UTR002')
+
+    def test_reconcile_statement(self):
+        self.order('UTR001')
+        self.order('UTR002', phone_no='9000000002')
+        statement = io.BytesIO(b'\xef\xbb\xbfDate,UTR No,Amount\n1/3,utr001,100\n1/3,UTR002,"1,000"\n1/3,UTR009,50\n1/3,UTR001,100\n')
+
+        result = UTRRegistry.reconcile(UTRRegistry.parse_statement(statement), user=self.user, mark_verified=True)
+
+        self.assertEqual([row['utr'] for row in result['matched']], ['UTR001'])
+        self.assertEqual(result['amount_mismatch'][0]['amount'], Decimal('1000'))
+        self.assertEqual((result['unmatched'], result['duplicates']), ([{'utr': 'UTR009', 'amount': Decimal('50')}], ['UTR001']))
+        self.assertEqual(result['summary']['newly_verified'], 1)
+        self.assertEqual(list(UTRRecord.objects.filter(verified=True).values_list('utr', flat=True)), ['UTR001'])
+
+    def test_entries_without_an_amount_are_never_verified(self):
+        self.order('UTR001')
+
+        result = UTRRegistry.reconcile([('UTR001', None)], user=self.user, mark_verified=True)
+
+        self.assertEqual([row['utr'] for row in result['matched']], ['UTR001'])
+        self.assertEqual(result['summary']['newly_verified'], 0)
+        self.assertFalse(UTRRecord.objects.filter(verified=True).exists())
+
+    def test_only_admins_can_verify_statements(self):
+        self.order('UTR001')
+        statement = io.BytesIO(b'UTR No,Amount\nUTR001,100\n')
+        statement.name = 'statement.csv'
+        staff = User.objects.create_user('staff', 'staff@example.com', 'staff', usertype='Staff')
+        self.client.force_login(staff)
+
+        response = self.client.post(reverse('channels_config:verify_utr_statement'), {'statement': statement, 'mark_verified': '1'})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(UTRRecord.objects.filter(verified=True).exists())
+
+        statement.seek(0)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('channels_config:verify_utr_statement'), {'statement': statement, 'mark_verified': '1'})
+
+        self.assertEqual(response.json()['summary']['newly_verified'], 1)
+
+    def test_rebuild_keeps_the_earliest_order(self):
+        first = self.order('UTR001')
+        second = self.order(None, phone_no='9000000002')
+        # Queryset updates bypass the signals, as rows written before the registry existed
+        Order.objects.filter(pk=second.pk).update(utr='utr001')
+        Order.objects.filter(pk=first.pk).update(utr='UTR003')
+
+        created, removed, conflicts = UTRRegistry.rebuild()
+
+        self.assertEqual((created, removed), (2, 1))
+        self.assertEqual(conflicts, [])
+        self.assertEqual(dict(UTRRecord.objects.values_list('utr', 'order_id')), {'UTR001': second.pk, 'UTR003': first.pk})
+
+        Order.objects.filter(pk=first.pk).update(utr='UTR001')
+        self.assertEqual(UTRRegistry.rebuild()[2], [('UTR001', [first.pk, second.pk])])
@@ -19,5 +19,6 @@ urlpatterns = [
     
     # API endpoints
     path('api/validate-utr/', views.validate_utr, name='validate_utr'),
+    path('api/verify-utrs/', views.verify_utr_statement, name='verify_utr_statement'),
     path('api/channel-fields/', views.get_channel_fields, name='channel_fields'),
 ]
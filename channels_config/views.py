@@ -3,7 +3,8 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from core import mixins
-from .models import DynamicChannel, ChannelFormField, UTRRecord
+from .models import DynamicChannel, ChannelFormField
+from .services import UTRRegistry
 from .tables import DynamicChannelTable, ChannelFormFieldTable
 from .forms import DynamicChannelForm, ChannelFormFieldForm
 
@@ -112,15 +113,32 @@ def validate_utr(request):
     if not utr:
         return JsonResponse({'valid': False, 'message': 'UTR is required'})
     
-    # Check if UTR already exists
-    exists = UTRRecord.objects.filter(utr=utr).exists()
-    
-    if exists:
+    if UTRRegistry.exists(utr):
         return JsonResponse({'valid': False, 'message': 'This UTR already exists'})
     
     return JsonResponse({'valid': True, 'message': 'UTR is unique'})
 
 
+@login_required
+@require_http_methods(["POST"])
+def verify_utr_statement(request):
+    """Reconcile a bank statement CSV (or pasted UTRs) against the UTR registry (admins only)."""
+    if not mixins.check_access(request, ["Admin", "Superadmin"]):
+        return JsonResponse({'error': 'Only admins can verify UTRs'}, status=403)
+    
+    statement = request.FILES.get('statement')
+    if statement:
+        entries = UTRRegistry.parse_statement(statement)
+    else:
+        entries = [(UTRRegistry.normalize(utr), None) for utr in request.POST.get('utrs', '').split()]
+    
+    if not entries:
+        return JsonResponse({'error': 'Upload a statement CSV or paste UTRs'}, status=400)
+    
+    result = UTRRegistry.reconcile(entries, user=request.user, mark_verified=request.POST.get('mark_verified') == '1')
+    return JsonResponse(result)
+
+
 @login_required
 @require_http_methods(["GET"])
 def get_channel_fields(request):
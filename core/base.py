@@ -5,6 +5,7 @@ from import_export.admin import ImportExportModelAdmin
 
 from core.actions import mark_active, mark_inactive
 from core.choices import BOOL_CHOICES
+from core.pagination import EstimatedCountPaginator
 
 from .functions import generate_fields
 
@@ -35,6 +36,9 @@ class BaseAdmin(ImportExportModelAdmin):
     actions = [mark_active, mark_inactive]
     readonly_fields = ("creator", "pk")
     search_fields = ("pk",)
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) behind "N total"
+    show_full_result_count = False
 
     def render_change_form(self, request, context, add=False, change=False, form_url="", obj=None):
         context.update({"show_save_and_continue": False, "show_save_and_add_another": True})
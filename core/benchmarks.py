@@ -0,0 +1,221 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+
+import django
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from core.middleware import QueryRecorder
+
+
+class Rollback(Exception):
+    """Raised inside a case to undo its writes."""
+
+
+class BenchmarkSuite:
+    """
+    Times the hot paths against the current database.
+
+    Each case runs ``repeat`` times (after one warm-up run) and reports the
+    min, median and max wall time and the queries of the last run. Cases
+    that write run inside a transaction that is rolled back, so repeated
+    runs see the same data. ``run`` returns a JSON-serialisable dict;
+    ``compare`` diffs two such dicts.
+    """
+
+    API_ENDPOINTS = ["order", "customer", "product", "shipment", "carrier", "stock-level", "customer-profile"]
+    ALLOCATION_SAMPLE = 200
+
+    def __init__(self, repeat=3, only=None, skip=None, stdout=None):
+        self.repeat = repeat
+        self.only = set(only or ())
+        self.skip = set(skip or ())
+        self.stdout = stdout
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    # Setup ------------------------------------------------------------------
+
+    def setup(self):
+        from accounts.models import User
+        from master.models import Account, Channel, Order, Product
+
+        if not getattr(self, "test_environment", False):
+            # Lets the test Client reach the views whatever ALLOWED_HOSTS says
+            setup_test_environment()
+            self.test_environment = True
+        self.user = User.objects.filter(is_superuser=True).order_by("pk").first()
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.channel = Channel.objects.filter(is_active=True).order_by("pk").first()
+        self.account = Account.objects.filter(is_active=True).order_by("pk").first()
+        self.product = Product.objects.filter(is_active=True).order_by("pk").first()
+        self.sample_orders = list(Order.objects.select_related("channel").order_by("-pk")[: self.ALLOCATION_SAMPLE])
+
+    # Cases ------------------------------------------------------------------
+
+    def get(self, url):
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise AssertionError(f"GET {url} returned {response.status_code}")
+        return response
+
+    def case_home_view(self):
+        self.get(reverse("core:home"))
+
+    def case_order_list_view(self):
+        self.get(reverse("master:order_list"))
+
+    def case_order_list_search(self):
+        self.get(reverse("master:order_list") + "?q=Kumar")
+
+    def case_quick_order_save(self):
+        self.counter = getattr(self, "counter", 0) + 1
+        response = self.client.post(
+            reverse("master:quick_order_save"),
+            {
+                "channel_id": self.channel.pk,
+                "phone_no": f"3{self.counter:09d}",
+                "customer_name": "Benchmark Customer",
+                "pincode": "600001",
+                "city": "Chennai",
+                "state": "Tamil Nadu",
+                "address": "1, Benchmark Street",
+                "items_json": json.dumps([{"product_id": self.product.pk, "qty": 2, "price": str(self.product.price)}]),
+                "account": self.account.pk,
+                "order_by": self.user.pk,
+            },
+        )
+        if not json.loads(response.content).get("success"):
+            raise AssertionError(f"quick_order_save failed: {response.content[:200]!r}")
+        raise Rollback
+
+    def case_allocate_carrier(self):
+        from logistics.services import ShippingRuleEngine
+
+        for order in self.sample_orders:
+            ShippingRuleEngine.allocate_carrier(order)
+
+    def case_allocate_many(self):
+        from logistics.services import ShippingRuleEngine
+
+        ShippingRuleEngine.allocate_many(self.sample_orders)
+
+    def case_compute_all_profiles(self):
+        from segmentation.services import SegmentationService
+
+        SegmentationService.compute_all_profiles()
+        raise Rollback
+
+    def case_compute_cohort_analysis(self):
+        from segmentation.services import SegmentationService
+
+        SegmentationService.compute_cohort_analysis()
+        raise Rollback
+
+    def case_compute_geo_stats(self):
+        from marketing.services import MarketInsightsService
+
+        MarketInsightsService.compute_geo_stats()
+        raise Rollback
+
+    def api_case(self, basename):
+        def case():
+            self.get(reverse(f"api:{basename}-list"))
+
+        return case
+
+    def cases(self):
+        cases = {name[len("case_"):]: getattr(self, name) for name in dir(self) if name.startswith("case_")}
+        for basename in self.API_ENDPOINTS:
+            cases[f"api_{basename.replace('-', '_')}_list"] = self.api_case(basename)
+        return {
+            name: case
+            for name, case in sorted(cases.items())
+            if (not self.only or name in self.only) and name not in self.skip
+        }
+
+    # Running ----------------------------------------------------------------
+
+    @staticmethod
+    def call(case):
+        """Run ``case`` once; returns (seconds, queries)."""
+        recorders = [QueryRecorder(db.alias) for db in connections.all()]
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for db, recorder in zip(connections.all(), recorders):
+                stack.enter_context(db.execute_wrapper(recorder))
+            try:
+                with transaction.atomic():
+                    case()
+            except Rollback:
+                pass
+        return time.perf_counter() - start, sum(len(recorder.queries) for recorder in recorders)
+
+    def time_case(self, case):
+        self.call(case)
+        runs = [self.call(case) for _ in range(self.repeat)]
+        times = [seconds * 1000 for seconds, queries in runs]
+        return {
+            "runs": self.repeat,
+            "min_ms": round(min(times), 2),
+            "median_ms": round(statistics.median(times), 2),
+            "max_ms": round(max(times), 2),
+            "queries": runs[-1][1],
+        }
+
+    @staticmethod
+    def metadata():
+        from master.models import Customer, Order
+
+        try:
+            commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=False).stdout.strip()
+        except OSError:
+            commit = ""
+        return {
+            "time": timezone.now().isoformat(),
+            "commit": commit,
+            "database": connection.vendor,
+            "django": django.get_version(),
+            "python": platform.python_version(),
+            "orders": Order.objects.count(),
+            "customers": Customer.objects.count(),
+        }
+
+    def run(self):
+        self.setup()
+        results = {}
+        for name, case in self.cases().items():
+            try:
+                results[name] = self.time_case(case)
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+                self.log(f"  {name}: {results[name]['error']}")
+                continue
+            self.log(f"  {name}: {results[name]['median_ms']} ms, {results[name]['queries']} queries")
+        return {"meta": self.metadata(), "results": results}
+
+    @staticmethod
+    def compare(previous, current):
+        """
+        Per case change between two ``run`` results.
+
+        Returns:
+            list of (case, previous median ms, current median ms, change %)
+        """
+        rows = []
+        for name, result in current["results"].items():
+            before = previous.get("results", {}).get(name, {}).get("median_ms")
+            after = result.get("median_ms")
+            if before and after is not None:
+                rows.append((name, before, after, round((after - before) / before * 100, 1)))
+        return rows
@@ -0,0 +1,198 @@
+import csv
+import gzip
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.template.loader import get_template
+from django.utils.encoding import force_str
+from django.utils.html import strip_tags
+from django_tables2 import columns
+from django_tables2.utils import Accessor
+
+# "{{ record.customer.phone_no }}" and "{{ 10 }}" column templates
+RECORD_TEMPLATE = re.compile(r"^\s*\{\{\s*record\.([\w.]+)\s*\}\}\s*$")
+LITERAL_TEMPLATE = re.compile(r"^\s*\{\{\s*(-?\d+(?:\.\d+)?)\s*\}\}\s*$")
+
+
+class Echo:
+    """File-like object that hands each written line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+class TableStreamExporter:
+    """
+    Writes a django-tables2 table row by row without building it in memory.
+
+    Each column is compiled once into an extractor: simple ``{{ record.x.y }}``
+    templates become attribute lookups, constant templates become literals,
+    and only complex templates are rendered (from a precompiled template).
+    Rows are read with ``QuerySet.iterator`` so memory use stays flat no
+    matter how many rows are exported.
+    """
+
+    FORMATS = ("csv", "xlsx")
+    CHUNK_SIZE = 2000
+
+    def __init__(self, table, queryset, exclude_columns=()):
+        self.table = table
+        self.queryset = queryset
+        self.columns = [
+            column for column in table.columns.iterall() if not (column.column.exclude_from_export or column.name in exclude_columns)
+        ]
+        self.extractors = [self.compile_column(column) for column in self.columns]
+
+    @staticmethod
+    def _text(value):
+        return "None" if value is None else force_str(value)
+
+    def compile_column(self, bound_column):
+        column = bound_column.column
+        table = self.table
+
+        if isinstance(column, columns.DateTimeColumn):
+            accessor = Accessor(bound_column.accessor)
+
+            def extract(record):
+                value = accessor.resolve(record, quiet=True)
+                return value.isoformat(sep=" ") if isinstance(value, datetime) else ""
+
+            return extract
+
+        if isinstance(column, columns.TemplateColumn):
+            code = column.template_code or ""
+            match = RECORD_TEMPLATE.match(code)
+            if match:
+                accessor = Accessor(match.group(1))
+                return lambda record: self._text(accessor.resolve(record, quiet=True))
+            match = LITERAL_TEMPLATE.match(code)
+            if match:
+                return lambda record: match.group(1)
+
+            template = Template(code) if column.template_code else get_template(column.template_name).template
+            extra_context = column.extra_context
+
+            def extract(record):
+                context = Context({"record": record, "table": table, "default": bound_column.default, **extra_context})
+                return strip_tags(template.render(context)).strip()
+
+            return extract
+
+        accessor = Accessor(bound_column.accessor)
+
+        def extract(record):
+            value = accessor.resolve(record, quiet=True)
+            if value in column.empty_values:
+                return ""
+            return force_str(column.value(value=value, record=record, column=column, bound_column=bound_column, table=table), strings_only=True)
+
+        return extract
+
+    def headers(self):
+        return [force_str(column.header, strings_only=True) for column in self.columns]
+
+    def rows(self):
+        yield self.headers()
+        for record in self.queryset.iterator(chunk_size=self.CHUNK_SIZE):
+            yield [extract(record) for extract in self.extractors]
+
+    def iter_csv(self):
+        writer = csv.writer(Echo())
+        for row in self.rows():
+            yield writer.writerow(row)
+
+    def write_csv(self, fileobj):
+        writer = csv.writer(fileobj)
+        for row in self.rows():
+            writer.writerow(row)
+
+    def write_xlsx(self, path):
+        from openpyxl import Workbook
+
+        # Write-only workbooks stream rows to disk instead of keeping cells in memory
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for row in self.rows():
+            sheet.append(row)
+        workbook.save(path)
+
+    def response(self, export_format, filename):
+        if export_format == "xlsx":
+            fileobj = tempfile.TemporaryFile()
+            self.write_xlsx(fileobj)
+            fileobj.seek(0)
+            return FileResponse(
+                fileobj, as_attachment=True, filename=filename, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        response = StreamingHttpResponse(self.iter_csv(), content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    def save(self, export_format, path):
+        """Write the export to ``path``; CSV files are gzipped. Returns the path."""
+        if export_format == "xlsx":
+            self.write_xlsx(path)
+        else:
+            with gzip.open(path, "wt", newline="") as fileobj:
+                self.write_csv(fileobj)
+        return path
+
+
+class ExportStore:
+    """
+    Files written by core.tasks.export_table_task, kept per user under
+    ``EXPORT_ROOT`` (outside MEDIA_ROOT, so only core:export_download serves
+    them). An export's directory holds a ``.pending`` marker until its file
+    is complete; a failed export leaves nothing behind.
+    """
+
+    PENDING = ".pending"
+    CONTENT_TYPES = {"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "gz": "application/gzip"}
+
+    @staticmethod
+    def directory(user_pk, export_id):
+        from django.conf import settings
+
+        return os.path.join(getattr(settings, "EXPORT_ROOT", os.path.join(settings.BASE_DIR, "exports")), str(user_pk), str(export_id))
+
+    @classmethod
+    def start(cls, user_pk, export_id):
+        directory = cls.directory(user_pk, export_id)
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, cls.PENDING), "w").close()
+
+    @classmethod
+    def write(cls, user_pk, export_id, exporter, export_format, filename):
+        """Save ``exporter``'s output as ``filename``; the file only appears once complete."""
+        directory = cls.directory(user_pk, export_id)
+        try:
+            exporter.save(export_format, os.path.join(directory, f"{filename}.part"))
+            os.replace(os.path.join(directory, f"{filename}.part"), os.path.join(directory, filename))
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        os.remove(os.path.join(directory, cls.PENDING))
+        return os.path.join(directory, filename)
+
+    @classmethod
+    def find(cls, user_pk, export_id):
+        """(path of the finished file or None, whether the export is still running)."""
+        directory = cls.directory(user_pk, export_id)
+        if not os.path.isdir(directory):
+            return None, False
+        names = os.listdir(directory)
+        if cls.PENDING in names:
+            return None, True
+        names = [name for name in names if not name.endswith(".part")]
+        return (os.path.join(directory, names[0]) if names else None), False
+
+    @classmethod
+    def response(cls, path):
+        name = os.path.basename(path)
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=name, content_type=cls.CONTENT_TYPES.get(name.rsplit(".", 1)[-1]))
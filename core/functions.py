@@ -1,3 +1,4 @@
+from django.db.models import Aggregate, CharField, Count, Func, Max
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
@@ -13,6 +14,18 @@ def send_email(subject, message, recipient_list, from_email=None, fail_silently=
     return email.send(fail_silently=fail_silently)
 
 
+def data_version(queryset, *conditions):
+    """
+    Fingerprint of a BaseModel queryset for per-process caches, in one query:
+    its row count, latest ``updated`` and the number of rows matching each
+    Q in ``conditions`` (for fields changed by queryset ``update()`` calls,
+    which leave ``updated`` alone).
+    """
+    aggregates = {"rows": Count("pk"), "updated": Max("updated")}
+    aggregates.update({f"matching_{i}": Count("pk", filter=condition) for i, condition in enumerate(conditions)})
+    return tuple(queryset.order_by().aggregate(**aggregates).values())
+
+
 def get_value(model, pk, default=None):
     try:
         return model.objects.get(pk=pk)
@@ -87,4 +100,36 @@ def generate_fields(self):
     return [(field.verbose_name.title(), generate_value(self, field)) for field in self._meta.fields]
 
 
+class GroupConcat(Aggregate):
+    """Join the values of a group with ``separator`` (GROUP_CONCAT / STRING_AGG)."""
+
+    function = "GROUP_CONCAT"
+    output_field = CharField()
+
+    def __init__(self, expression, separator=", ", **extra):
+        super().__init__(expression, separator=separator, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        separator = self.extra["separator"].replace("'", "''")
+        return super().as_sql(compiler, connection, template=f"%(function)s(%(expressions)s, '{separator}')", **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        separator = self.extra["separator"].replace("'", "''")
+        return super().as_sql(compiler, connection, template=f"%(function)s(%(expressions)s SEPARATOR '{separator}')", **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function="STRING_AGG", **extra_context)
+
+
+class DecimalText(Func):
+    """Text of a two place decimal, as ``str(Decimal)`` prints it ("500.00")."""
+
+    template = "CAST(%(expressions)s AS CHAR)"
+    output_field = CharField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite stores decimals as numbers and would print 500 for 500.00
+        return self.as_sql(compiler, connection, template="printf('%%%%.2f', %(expressions)s)", **extra_context)
 
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="CAST(%(expressions)s AS TEXT)", **extra_context)
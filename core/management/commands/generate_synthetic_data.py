@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.synthetic import SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = "Grow the deterministic benchmark dataset (customers, orders, items, shipments, tracking, leads, stock movements) to N orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=10000, help="Total number of synthetic orders to reach")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--days", type=int, default=365, help="Spread orders over the last N days")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        generator = SyntheticDataGenerator(seed=options["seed"], days=options["days"], stdout=self.stdout)
+        added = generator.run(options["orders"])
+        self.stdout.write(self.style.SUCCESS(f"Added {added} orders in {time.perf_counter() - started:.1f}s."))
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import BenchmarkSuite
+from core.synthetic import SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot paths and write the results as JSON. With --scales the synthetic dataset is grown "
+        "to each order count in turn (e.g. 10000,100000,1000000) and the suite runs at every scale."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="benchmark.json", help="JSON file to write")
+        parser.add_argument("--compare", help="Earlier JSON result to compare against")
+        parser.add_argument("--scales", help="Comma separated synthetic order counts to benchmark at")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--only", help="Comma separated case names")
+        parser.add_argument("--skip", help="Comma separated case names")
+        parser.add_argument("--seed", type=int, default=42)
+
+    @staticmethod
+    def names(value):
+        return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+    def handle(self, *args, **options):
+        suite = BenchmarkSuite(options["repeat"], self.names(options["only"]), self.names(options["skip"]), stdout=self.stdout)
+        scales = [int(scale) for scale in self.names(options["scales"])]
+        if scales:
+            runs = []
+            for scale in sorted(scales):
+                self.stdout.write(f"Growing the synthetic dataset to {scale} orders")
+                SyntheticDataGenerator(seed=options["seed"], stdout=self.stdout).run(scale)
+                self.stdout.write(f"Benchmarking at {scale} orders")
+                runs.append({"scale": scale, **suite.run()})
+            result = {"scales": runs}
+        else:
+            result = suite.run()
+
+        with open(options["output"], "w") as fileobj:
+            json.dump(result, fileobj, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as fileobj:
+                    previous = json.load(fileobj)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+            pairs = zip(previous.get("scales", [previous]), result.get("scales", [result]))
+            for before, after in pairs:
+                self.stdout.write(f"Compared with {options['compare']} ({after['meta']['orders']} orders):")
+                for name, previous_ms, current_ms, change in suite.compare(before, after):
+                    self.stdout.write(f"  {name}: {previous_ms} -> {current_ms} ms ({change:+}%)")
@@ -0,0 +1,155 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Literals and placeholder lists that vary between otherwise identical statements
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+def fingerprint(sql):
+    """Statement shape with literals and IN (...) lists collapsed, for spotting repeated queries."""
+    sql = LITERALS.sub("?", sql)
+    sql = PLACEHOLDER_LIST.sub("(...)", sql)
+    return " ".join(sql.split())
+
+
+def view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    return match.view_name or match._func_path
+
+
+def view_budget(match):
+    """``query_budget`` declared on the view class (or function) of a ResolverMatch."""
+    if match is None:
+        return None
+    func = match.func
+    return getattr(getattr(func, "view_class", func), "query_budget", None)
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` that keeps (alias, sql, seconds) for every statement."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((self.alias, sql, time.perf_counter() - start))
+
+
+class QueryReportBuffer:
+    """Last ``size`` request reports, shared by the threads of one process."""
+
+    def __init__(self, size):
+        self.reports = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, report):
+        with self.lock:
+            self.reports.append(report)
+
+    def recent(self):
+        with self.lock:
+            return list(self.reports)
+
+    def clear(self):
+        with self.lock:
+            self.reports.clear()
+
+    def by_view(self):
+        """Per view request count, average and maximum queries and SQL time."""
+        views = {}
+        for report in self.recent():
+            row = views.setdefault(report["view"], {"view": report["view"], "requests": 0, "queries": 0, "max_queries": 0, "sql_ms": 0, "max_sql_ms": 0})
+            row["requests"] += 1
+            row["queries"] += report["queries"]
+            row["max_queries"] = max(row["max_queries"], report["queries"])
+            row["sql_ms"] += report["sql_ms"]
+            row["max_sql_ms"] = max(row["max_sql_ms"], report["sql_ms"])
+        for row in views.values():
+            row["avg_queries"] = round(row.pop("queries") / row["requests"], 1)
+            row["avg_sql_ms"] = round(row.pop("sql_ms") / row["requests"], 2)
+        return sorted(views.values(), key=lambda row: row["avg_queries"], reverse=True)
+
+
+reports = QueryReportBuffer(getattr(settings, "QUERY_INSTRUMENTATION_BUFFER", 200))
+
+
+def build_report(queries, request=None, status=None, top=5):
+    """
+    Summary of the statements recorded for one request (or test block).
+
+    Returns:
+        dict with view, path, queries, sql_ms, duplicate_queries, duplicates
+        (the most repeated statement shapes with their count) and slowest
+        (the ``top`` slowest statements)
+    """
+    shapes = Counter(fingerprint(sql) for alias, sql, seconds in queries)
+    slowest = sorted(queries, key=lambda query: query[2], reverse=True)[:top]
+    return {
+        "view": view_name(request) if request is not None else None,
+        "path": request.path if request is not None else None,
+        "method": request.method if request is not None else None,
+        "status": status,
+        "time": timezone.now().isoformat(),
+        "queries": len(queries),
+        "sql_ms": round(sum(seconds for alias, sql, seconds in queries) * 1000, 2),
+        "duplicate_queries": sum(count - 1 for count in shapes.values()),
+        "duplicates": [{"sql": sql, "count": count} for sql, count in shapes.most_common(top) if count > 1],
+        "slowest": [{"sql": sql, "ms": round(seconds * 1000, 2), "db": alias} for alias, sql, seconds in slowest],
+    }
+
+
+class QueryBudgetMiddleware:
+    """
+    Records the queries each request runs (enable with QUERY_INSTRUMENTATION).
+
+    The totals go out as X-Query-Count, X-Query-Time-Ms and X-Query-Duplicates
+    headers and the full report into ``reports``, which staff read at
+    core:query_report. Views may declare a ``query_budget``; requests over it
+    are logged. Queries run while a streaming response is consumed are not
+    counted.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "QUERY_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorders = [QueryRecorder(connection.alias) for connection in connections.all()]
+        with ExitStack() as stack:
+            for connection, recorder in zip(connections.all(), recorders):
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        queries = [query for recorder in recorders for query in recorder.queries]
+        report = build_report(queries, request, response.status_code)
+        reports.add(report)
+
+        response["X-Query-Count"] = report["queries"]
+        response["X-Query-Time-Ms"] = report["sql_ms"]
+        response["X-Query-Duplicates"] = report["duplicate_queries"]
+        budget = view_budget(getattr(request, "resolver_match", None))
+        if budget is not None:
+            response["X-Query-Budget"] = budget
+            if report["queries"] > budget:
+                logger.warning("%s ran %s queries, over its budget of %s", report["view"], report["queries"], budget)
+        return response
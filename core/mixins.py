@@ -1,11 +1,14 @@
 import operator
 import re
+import uuid
 from functools import reduce
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.exceptions import FieldError
 from django.db.models import Q
+from django.http import JsonResponse
+from django.urls import reverse
 from django.forms import models as model_forms
 from django.views.generic import DetailView, View
 from django.views.generic.base import TemplateView
@@ -15,6 +18,9 @@ from django_filters.views import FilterView
 from django_tables2.export.views import ExportMixin
 from django_tables2.views import SingleTableMixin
 
+from core.exports import ExportStore, TableStreamExporter
+from core.pagination import EstimatedCountPaginator, KeysetPaginator
+
 
 def convert_to_spaces(text):
     result = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
@@ -120,23 +126,105 @@ class HybridDeleteView(CustomLoginRequiredMixin, DeleteView):
 class HybridListView(CustomLoginRequiredMixin, ExportMixin, SingleTableMixin, FilterView, ListView):
     template_name = "app/common/object_list.html"
     table_pagination = {"per_page": 500}
+    # Large tables show an estimated total instead of running COUNT(*) on every page
+    paginator_class = EstimatedCountPaginator
+    # Relations the table renders per row, loaded up front
+    list_select_related = ()
+    list_prefetch_related = ()
+    # Opt-in cursor pagination (?cursor=) over keyset_ordering instead of ?page= offsets
+    keyset_pagination = False
+    keyset_ordering = ("-created", "-id")
+    # CSV/XLSX exports are streamed from the database; add ?_async=1 to build them in Celery
+    streaming_export = True
+    export_async_param = "_async"
+    # Most queries a page may run; enforced by core.testing and logged by core.middleware
+    query_budget = None
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        search_fields = getattr(self, "search_fields", None)
-        if search_fields:
-            query = self.request.GET.get("q")
-            if query:
-                q_list = [Q(**{f"{field}__icontains": query}) for field in search_fields]
-                queryset = queryset.filter(reduce(operator.or_, q_list))
+        query = self.request.GET.get("q")
+        if query:
+            queryset = self.filter_search(queryset, query)
+        if self.list_select_related:
+            queryset = queryset.select_related(*self.list_select_related)
+        if self.list_prefetch_related:
+            queryset = queryset.prefetch_related(*self.list_prefetch_related)
         try:
             queryset.filter(is_active=True)
             return queryset.filter(is_active=True)
         except FieldError:
             return queryset
 
+    def filter_search(self, queryset, query):
+        search_fields = getattr(self, "search_fields", None)
+        if not search_fields:
+            return queryset
+        q_list = [Q(**{f"{field}__icontains": query}) for field in search_fields]
+        return queryset.filter(reduce(operator.or_, q_list))
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get(self.export_trigger_param)
+        if self.streaming_export and export_format in TableStreamExporter.FORMATS:
+            return self.create_streaming_export(export_format)
+        return super().get(request, *args, **kwargs)
+
+    def get_export_queryset(self):
+        # Same filtering as FilterView.get, without building the page context
+        self.filterset = self.get_filterset(self.get_filterset_class())
+        if not self.filterset.is_bound or self.filterset.is_valid() or not self.get_strict():
+            return self.filterset.qs
+        return self.filterset.queryset.none()
+
+    def get_export_exporter(self):
+        self.object_list = self.get_export_queryset()
+        table = self.get_table(**self.get_table_kwargs())
+        return TableStreamExporter(table, table.data.data, self.exclude_columns)
+
+    def create_streaming_export(self, export_format):
+        extension = "xlsx" if export_format == "xlsx" else "csv"
+
+        if self.request.GET.get(self.export_async_param):
+            from core.tasks import export_table_task
+
+            # The task rebuilds this view from its URL and query string; querysets never go through the broker
+            export_id = uuid.uuid4()
+            ExportStore.start(self.request.user.pk, export_id)
+            result = export_table_task.delay(self.request.path, self.request.GET.urlencode(), self.request.user.pk, export_format, str(export_id))
+            return JsonResponse({"task_id": result.id, "download_url": reverse("core:export_download", args=[export_id])})
+
+        return self.get_export_exporter().response(export_format, f"{self.export_name}.{extension}")
+
+    def use_keyset_pagination(self):
+        # Column sorting and exports need the whole ordered queryset
+        if not self.keyset_pagination or self.request.GET.get("sort") or self.request.GET.get(self.export_trigger_param):
+            return False
+        ordering = tuple(getattr(self.object_list, "query", None) and self.object_list.query.order_by or ())
+        return not ordering or ordering[0] == self.keyset_ordering[0]
+
+    def get_table_data(self):
+        data = super().get_table_data()
+        if self.use_keyset_pagination():
+            per_page = (self.table_pagination or {}).get("per_page", 25)
+            self.keyset_page = KeysetPaginator(data, per_page, self.keyset_ordering).page(self.request.GET.get("cursor"))
+            return self.keyset_page.object_list
+        return data
+
+    def get_table_pagination(self, table):
+        if getattr(self, "keyset_page", None) is not None or self.request.GET.get(self.export_trigger_param):
+            return False
+        return super().get_table_pagination(table)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        keyset_page = getattr(self, "keyset_page", None)
+        if keyset_page is not None:
+            params = self.request.GET.copy()
+            params.pop("cursor", None)
+            context["keyset_page"] = keyset_page
+            context["first_page_url"] = f"?{params.urlencode()}"
+            if keyset_page.has_next:
+                params["cursor"] = keyset_page.next_cursor
+                context["next_page_url"] = f"?{params.urlencode()}"
         context["title"] = self.model._meta.verbose_name_plural
         context["can_add"] = False
         context["new_link"] = self.model.get_create_url() if hasattr(self.model, "get_create_url") else None
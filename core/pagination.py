@@ -1,3 +1,13 @@
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 from rest_framework import pagination
 from rest_framework.response import Response
 
@@ -5,3 +15,203 @@ from rest_framework.response import Response
 class CustomPagination(pagination.PageNumberPagination):
     def get_paginated_response(self, data):
         return Response(data)
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return bool(self.cursor)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a fixed ordering such as ("-created", "-id").
+
+    Each page continues from the last row of the previous one with an index
+    range filter, so deep pages cost the same as the first (no OFFSET).
+    """
+
+    def __init__(self, queryset, per_page, ordering=("-created", "-id")):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [field.lstrip("-") for field in ordering]
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field) for field in self.fields]
+        values = [value.isoformat() if hasattr(value, "isoformat") else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Cursor values in field order, or None for a missing or malformed cursor."""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (AttributeError, ValueError, TypeError):
+            return None
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            return None
+        model = self.queryset.model
+        decoded = []
+        for field, value in zip(self.fields, values):
+            if model._meta.get_field(field).get_internal_type() == "DateTimeField":
+                value = parse_datetime(value) if isinstance(value, str) else None
+                if value is None:
+                    return None
+            decoded.append(value)
+        return decoded
+
+    def _after(self, values):
+        # (a, b) after (x, y) means a > x OR (a = x AND b > y), with < for descending fields
+        condition = Q()
+        for i, (ordering, field) in enumerate(zip(self.ordering, self.fields)):
+            lookup = "lt" if ordering.startswith("-") else "gt"
+            step = Q(**{f"{field}__{lookup}": values[i]})
+            for previous, value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        values = self.decode_cursor(cursor) if cursor else None
+        if values is not None:
+            queryset = queryset.filter(self._after(values))
+        rows = list(queryset[: self.per_page + 1])
+        next_cursor = self.encode_cursor(rows[self.per_page - 1]) if len(rows) > self.per_page else None
+        return KeysetPage(rows[: self.per_page], next_cursor, cursor if values is not None else None)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that stops running an exact ``COUNT(*)`` once a table is large.
+
+    The table size comes from the database's statistics
+    (``pg_class.reltuples``, MySQL's ``information_schema.TABLES`` or SQLite's
+    ``sqlite_stat1`` once ``ANALYZE`` has run), never from a count. Below
+    ``THRESHOLD`` rows, or without statistics, the count is exact. Above it
+    an unfiltered total is the table size, and a filtered one the PostgreSQL
+    ``EXPLAIN`` row estimate (the exact count when that is under the
+    threshold) or, on other databases, a count cached for ``CACHE_TTL``
+    seconds. ``is_estimate`` tells templates to show the total as "about N".
+
+    Works with django-tables2 (``paginator_class``) and as ``ModelAdmin.paginator``.
+    """
+
+    THRESHOLD = 10000
+    CACHE_KEY = "core:pagination:count"
+    CACHE_TTL = 300
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page, **kwargs)
+        self.is_estimate = False
+
+    def get_queryset(self):
+        """The queryset behind object_list; django-tables2 wraps it in BoundRows and TableQuerysetData."""
+        data = self.object_list
+        data = getattr(getattr(data, "data", None), "data", data)
+        return data if isinstance(data, QuerySet) else None
+
+    @classmethod
+    def cached_count(cls, queryset):
+        sql, params = queryset.query.sql_with_params()
+        key = f"{cls.CACHE_KEY}:{hashlib.md5(f'{queryset.db}:{sql}:{params!r}'.encode()).hexdigest()}"
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, cls.CACHE_TTL)
+        return count
+
+    @staticmethod
+    def planner_estimate(queryset):
+        """Planner row estimate of a filtered ``queryset`` on PostgreSQL, None elsewhere."""
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        try:
+            with connection.cursor() as cursor:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+        except DatabaseError:
+            return None
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @staticmethod
+    def table_size(queryset):
+        """Row count of ``queryset``'s table from the database statistics, None when it has none."""
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == "postgresql":
+            sql, params = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table]
+        elif connection.vendor == "mysql":
+            sql, params = "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [table]
+        elif connection.vendor == "sqlite":
+            sql, params = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table]
+        else:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+        except DatabaseError:
+            # sqlite_stat1 only exists once ANALYZE has run
+            return None
+        if not row or row[0] is None:
+            return None
+        # sqlite_stat1.stat starts with the row count; reltuples is -1 until the table is first analyzed
+        size = int(str(row[0]).split()[0]) if connection.vendor == "sqlite" else int(row[0])
+        return size if size >= 0 else None
+
+    @cached_property
+    def count(self):
+        queryset = self.get_queryset()
+        if queryset is None:
+            return super().count
+        size = self.table_size(queryset)
+        if size is None or size < self.THRESHOLD:
+            return super().count
+        if not queryset.query.where:
+            self.is_estimate = True
+            return size
+        queryset = queryset.order_by()
+        estimate = self.planner_estimate(queryset)
+        if estimate is None:
+            count = self.cached_count(queryset)
+        elif estimate < self.THRESHOLD:
+            return queryset.count()
+        else:
+            count = estimate
+        self.is_estimate = True
+        return count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # An estimated total can fall short of the real one, so later pages are still served
+            if self.is_estimate and int(number) > 1:
+                return int(number)
+            raise
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.is_estimate:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
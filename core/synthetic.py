@@ -0,0 +1,361 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import User
+from inventory.models import StockMovement, Warehouse
+from logistics.models import Carrier, PincodeRule, Shipment, ShipmentTracking, ShippingRule
+from marketing.models import Lead, PincodeMaster
+from master.models import Account, Channel, Customer, Order, OrderItem, Product
+from master.services import AccountLedgerService, OrderNumberAllocator, OrderSearchService, OrderStatService, StockLedgerService
+
+# (state, city, first three pincode digits)
+LOCATIONS = [
+    ("Tamil Nadu", "Chennai", "600"),
+    ("Tamil Nadu", "Coimbatore", "641"),
+    ("Tamil Nadu", "Madurai", "625"),
+    ("Karnataka", "Bengaluru", "560"),
+    ("Karnataka", "Mysuru", "570"),
+    ("Kerala", "Kochi", "682"),
+    ("Kerala", "Thiruvananthapuram", "695"),
+    ("Maharashtra", "Mumbai", "400"),
+    ("Maharashtra", "Pune", "411"),
+    ("Delhi", "New Delhi", "110"),
+    ("Telangana", "Hyderabad", "500"),
+    ("West Bengal", "Kolkata", "700"),
+    ("Gujarat", "Ahmedabad", "380"),
+    ("Rajasthan", "Jaipur", "302"),
+    ("Uttar Pradesh", "Lucknow", "226"),
+    ("Andhra Pradesh", "Visakhapatnam", "530"),
+]
+FIRST_NAMES = ["Arun", "Priya", "Karthik", "Divya", "Rahul", "Sneha", "Vijay", "Anitha", "Suresh", "Meena", "Ravi", "Lakshmi", "Ajay", "Kavya", "Manoj", "Deepa"]
+LAST_NAMES = ["Kumar", "Sharma", "Reddy", "Nair", "Iyer", "Patel", "Singh", "Das", "Rao", "Menon", "Gupta", "Joshi"]
+TRACKING_FLOW = [("manifested", "Manifested"), ("picked_up", "Picked up"), ("in_transit", "In transit"), ("out_for_delivery", "Out for delivery"), ("delivered", "Delivered")]
+
+
+@contextmanager
+def explicit_created(*models):
+    """Let bulk_create keep the ``created`` values set on the objects instead of auto_now_add."""
+    fields = [model._meta.get_field("created") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class SyntheticDataGenerator:
+    """
+    Deterministic benchmark dataset, written with ``bulk_create``.
+
+    Every row derives from ``seed`` and the row's position, so two runs with
+    the same arguments produce the same data, and growing a dataset (10k,
+    then up to 100k orders) adds the same rows a single large run would.
+    Synthetic rows are recognisable by the ``SYN`` prefixes and codes and
+    by phone numbers starting with 4 (leads) or 5 (customers).
+    Signal-maintained tables (rollups and ledgers) are rebuilt at the end
+    with the existing rebuild services. Orders carry no UTR, so the UTR
+    registry is left alone.
+    """
+
+    PREFIX = "SYN"
+    BATCH_SIZE = 5000
+    PRODUCTS = 40
+    ACCOUNTS = 5
+    CHANNEL_TYPES = ["WhatsApp", "WhatsApp_COD", "Swiggy", "Wholesale", "Counter"]
+    CARRIERS = ["delhivery", "bluedart", "dtdc"]
+    # Real Indian mobile numbers start with 6-9, so these never collide with live data
+    CUSTOMER_PHONE_PREFIX = "5"
+    LEAD_PHONE_PREFIX = "4"
+
+    def __init__(self, seed=42, days=365, customers_per_order=0.35, shipment_rate=0.6, lead_rate=0.3, movement_rate=0.2, stdout=None):
+        self.seed = seed
+        self.days = days
+        self.customers_per_order = customers_per_order
+        self.shipment_rate = shipment_rate
+        self.lead_rate = lead_rate
+        self.movement_rate = movement_rate
+        self.stdout = stdout
+        self.now = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def rng(self, *key):
+        return random.Random(f"{self.seed}:{':'.join(map(str, key))}")
+
+    @staticmethod
+    def pincode(rng):
+        state, city, prefix = rng.choice(LOCATIONS)
+        return state, city, f"{prefix}{rng.randrange(1, 40):03d}"
+
+    # Reference data ---------------------------------------------------------
+
+    def setup(self):
+        """Users, channels, accounts, products, carriers, rules and the warehouse (idempotent)."""
+        self.user = User.objects.filter(is_superuser=True).order_by("pk").first()
+        if self.user is None:
+            self.user, _ = User.objects.get_or_create(username=f"{self.PREFIX.lower()}-admin", defaults={"is_staff": True, "is_superuser": True})
+        self.channels = [
+            Channel.objects.get_or_create(prefix=f"{self.PREFIX}{index}", defaults={"channel_type": channel_type, "creator": self.user})[0]
+            for index, channel_type in enumerate(self.CHANNEL_TYPES)
+        ]
+        self.accounts = [
+            Account.objects.get_or_create(code=f"{self.PREFIX}-ACC{index}", defaults={"name": f"Account {index}", "opening_balance": 0, "creator": self.user})[0]
+            for index in range(self.ACCOUNTS)
+        ]
+        rng = self.rng("products")
+        self.products = [
+            Product.objects.get_or_create(
+                product_code=f"{self.PREFIX}-P{index:03d}",
+                defaults={"product_name": f"Product {index}", "size": rng.choice(["250g", "500g", "1kg"]), "price": Decimal(rng.randrange(50, 1500, 10)), "creator": self.user},
+            )[0]
+            for index in range(self.PRODUCTS)
+        ]
+        self.carriers = [
+            Carrier.objects.get_or_create(
+                code=f"{self.PREFIX.lower()}-{code}", defaults={"name": f"{code.title()} ({self.PREFIX})", "priority": len(self.CARRIERS) - index, "creator": self.user}
+            )[0]
+            for index, code in enumerate(self.CARRIERS)
+        ]
+        self.warehouse = Warehouse.objects.get_or_create(
+            code=f"{self.PREFIX}-WH", defaults={"name": "Synthetic warehouse", "address": "-", "city": "Chennai", "state": "Tamil Nadu", "pincode": "600001", "creator": self.user}
+        )[0]
+
+        states = sorted({state for state, city, prefix in LOCATIONS})
+        rules = [
+            ("state", "in_list", states[: len(states) // 2], self.carriers[0]),
+            ("total_amount", "greater_than", 2000, self.carriers[1]),
+            ("channel", "equals", "WhatsApp_COD", self.carriers[2]),
+            ("pincode", "starts_with", "6", self.carriers[0]),
+            ("city", "contains", "pur", self.carriers[2]),
+        ]
+        for priority, (field, operator, value, carrier) in enumerate(rules):
+            ShippingRule.objects.get_or_create(
+                name=f"{self.PREFIX} rule {priority}",
+                defaults={
+                    "rule_type": "pincode" if field == "pincode" else "zone",
+                    "priority": priority,
+                    "condition_field": field,
+                    "condition_operator": operator,
+                    "condition_value": value,
+                    "assigned_carrier": carrier,
+                    "creator": self.user,
+                },
+            )
+
+        pincodes, rules = [], []
+        for state, city, prefix in LOCATIONS:
+            for suffix in range(1, 40):
+                pincode = f"{prefix}{suffix:03d}"
+                pincodes.append(PincodeMaster(pincode=pincode, city=city, district=city, state=state, creator=self.user))
+                rules.append(PincodeRule(pincode=pincode, carrier=self.carriers[suffix % len(self.carriers)], priority=suffix % 3, delivery_days=2 + suffix % 5, creator=self.user))
+        PincodeMaster.objects.bulk_create(pincodes, ignore_conflicts=True)
+        PincodeRule.objects.bulk_create(rules, ignore_conflicts=True)
+
+    # Rows -------------------------------------------------------------------
+
+    def customer(self, index):
+        rng = self.rng("customer", index)
+        state, city, pincode = self.pincode(rng)
+        return Customer(
+            phone_no=f"{self.CUSTOMER_PHONE_PREFIX}{index:09d}",
+            customer_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            pincode=pincode,
+            address=f"{rng.randrange(1, 300)}, Street {rng.randrange(1, 80)}",
+            city=city,
+            state=state,
+            country="India",
+            created=self.now - timedelta(days=self.days),
+            creator=self.user,
+        )
+
+    def ensure_customers(self, count):
+        customers = Customer.objects.filter(phone_no__startswith=self.CUSTOMER_PHONE_PREFIX)
+        with explicit_created(Customer):
+            for start in range(customers.count(), count, self.BATCH_SIZE):
+                Customer.objects.bulk_create([self.customer(index) for index in range(start, min(start + self.BATCH_SIZE, count))])
+        self.customer_ids = list(customers.order_by("phone_no").values_list("pk", flat=True)[:count])
+
+    def order_rows(self, start, stop):
+        """(Order, [(product, quantity)]) for order positions ``start`` to ``stop``."""
+        rows = []
+        for index in range(start, stop):
+            rng = self.rng("order", index)
+            channel = rng.choice(self.channels)
+            # Recent days get more orders, like a growing shop
+            created = self.now - timedelta(days=int(self.days * rng.random() ** 2), hours=rng.randrange(24), minutes=rng.randrange(60))
+            lines = [(product, rng.randrange(1, 4)) for product in rng.sample(self.products, rng.randrange(1, 4))]
+            items_amount = sum(product.price * quantity for product, quantity in lines)
+            cod_charge = Decimal(50) if "COD" in channel.channel_type else Decimal(0)
+            state, city, pincode = self.pincode(rng)
+            order = Order(
+                channel=channel,
+                # Drawn from the customers a dataset of this size has, so growing a dataset picks what a single run would
+                customer_id=self.customer_ids[rng.randrange(max(1, int((index + 1) * self.customers_per_order)))],
+                account=rng.choice(self.accounts),
+                order_by=self.user,
+                cod_charge=cod_charge,
+                total_amount=items_amount + cod_charge,
+                items_amount=items_amount,
+                items_quantity=sum(quantity for product, quantity in lines),
+                stage=rng.choice(["Pending", "Booked", "Shipped", "Delivered", "Delivered", "Cancelled"]),
+                pincode=pincode,
+                city=city,
+                state=state,
+                country="India",
+                created=created,
+                business_date=Order.business_date_for(created),
+                creator=self.user,
+            )
+            rows.append((order, lines))
+        return rows
+
+    def write_orders(self, start, stop):
+        rows = self.order_rows(start, stop)
+        by_prefix = {}
+        for order, lines in rows:
+            by_prefix.setdefault(order.channel.prefix, []).append(order)
+        for prefix, orders in by_prefix.items():
+            for order, order_no in zip(orders, OrderNumberAllocator.reserve_order_nos(prefix, len(orders))):
+                order.order_no = order_no
+
+        with explicit_created(Order, OrderItem, Shipment, ShipmentTracking, StockMovement, Lead):
+            orders = Order.objects.bulk_create([order for order, lines in rows])
+            if any(order.pk is None for order in orders):
+                by_no = Order.objects.in_bulk([order.order_no for order in orders], field_name="order_no")
+                orders = [by_no[order.order_no] for order in orders]
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order, product=product, price=product.price, quantity=quantity, amount=product.price * quantity, created=order.created, creator=self.user)
+                    for order, (_, lines) in zip(orders, rows)
+                    for product, quantity in lines
+                ]
+            )
+            customers = Customer.objects.in_bulk({order.customer_id for order in orders})
+            for order in orders:
+                order.customer = customers[order.customer_id]
+            OrderSearchService.index_orders(orders, replace=False)
+            self.write_shipments(start, orders)
+            self.write_movements(start, orders, rows)
+            self.write_leads(start, orders)
+
+    def write_shipments(self, start, orders):
+        shipments, events = [], []
+        for index, order in enumerate(orders, start):
+            rng = self.rng("shipment", index)
+            if order.stage == "Pending" or rng.random() > self.shipment_rate:
+                continue
+            steps = rng.randrange(1, len(TRACKING_FLOW) + 1)
+            shipment = Shipment(
+                order=order,
+                carrier=rng.choice(self.carriers),
+                tracking_number=f"{self.PREFIX}{index:012d}",
+                status=TRACKING_FLOW[steps - 1][0],
+                weight=Decimal("0.5") * order.items_quantity,
+                is_cod="COD" in order.channel.channel_type,
+                cod_amount=order.total_amount if "COD" in order.channel.channel_type else 0,
+                delivery_address={"city": order.city, "state": order.state, "pincode": order.pincode},
+                assignment_method="bulk",
+                created=order.created + timedelta(hours=2),
+                creator=self.user,
+            )
+            shipments.append(shipment)
+            for step, (status, description) in enumerate(TRACKING_FLOW[:steps]):
+                event_time = order.created + timedelta(hours=6 + 18 * step)
+                events.append(
+                    ShipmentTracking(
+                        shipment=shipment, status=status, status_description=description, location=order.city, event_time=event_time, created=event_time, creator=self.user
+                    )
+                )
+        Shipment.objects.bulk_create(shipments)
+        ShipmentTracking.objects.bulk_create(events)
+
+    def write_movements(self, start, orders, rows):
+        movements = []
+        for index, (order, (_, lines)) in enumerate(zip(orders, rows), start):
+            if self.rng("movement", index).random() > self.movement_rate:
+                continue
+            for product, quantity in lines:
+                movements.append(
+                    StockMovement(
+                        product=product,
+                        warehouse=self.warehouse,
+                        movement_type="sale",
+                        quantity=-quantity,
+                        reference_type="Order",
+                        reference_id=order.order_no,
+                        performed_by=self.user,
+                        created=order.created,
+                        creator=self.user,
+                    )
+                )
+        StockMovement.objects.bulk_create(movements)
+
+    def write_leads(self, start, orders):
+        leads = []
+        for index, order in enumerate(orders, start):
+            rng = self.rng("lead", index)
+            if rng.random() > self.lead_rate:
+                continue
+            state, city, pincode = self.pincode(rng)
+            converted = rng.random() < 0.3
+            leads.append(
+                Lead(
+                    phone_no=f"{self.LEAD_PHONE_PREFIX}{index:09d}",
+                    phone_normalized=f"+91{self.LEAD_PHONE_PREFIX}{index:09d}",
+                    name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    lead_source=rng.choice(["manual", "whatsapp_vcf_import", "shopify_abandoned_checkout", "website_form"]),
+                    pincode=pincode,
+                    city=city,
+                    state=state,
+                    location_status="enriched",
+                    match_status="converted" if converted else rng.choice(["pending", "loss"]),
+                    converted_order=order if converted else None,
+                    lead_status="converted" if converted else rng.choice(["new", "contacted", "follow_up"]),
+                    cart_value=Decimal(rng.randrange(200, 4000)),
+                    created=order.created - timedelta(days=rng.randrange(1, 10)),
+                    creator=self.user,
+                )
+            )
+        Lead.objects.bulk_create(leads)
+
+    # Driver -----------------------------------------------------------------
+
+    def synthetic_orders(self):
+        return Order.objects.filter(channel__prefix__startswith=self.PREFIX)
+
+    def run(self, orders):
+        """
+        Grow the synthetic dataset to ``orders`` orders.
+
+        Returns:
+            number of orders added
+        """
+        self.setup()
+        existing = self.synthetic_orders().count()
+        if existing >= orders:
+            self.log(f"{existing} synthetic orders already exist.")
+            return 0
+        self.ensure_customers(max(1, int(orders * self.customers_per_order)))
+        for start in range(existing, orders, self.BATCH_SIZE):
+            stop = min(start + self.BATCH_SIZE, orders)
+            with transaction.atomic():
+                self.write_orders(start, stop)
+            self.log(f"  orders {stop}/{orders}")
+        self.rebuild()
+        return orders - existing
+
+    def rebuild(self):
+        """Tables normally kept current by signals, which bulk_create skips; search tokens are written per batch."""
+        self.log("Rebuilding the order rollup and the account and stock ledgers")
+        OrderStatService.rebuild()
+        AccountLedgerService.rebuild_all()
+        StockLedgerService.rebuild_all()
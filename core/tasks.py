@@ -0,0 +1,28 @@
+from celery import shared_task
+
+
+@shared_task
+def export_table_task(path, query_string, user_pk, export_format, export_id):
+    """
+    Build the export of the list view at ``path`` for ``query_string`` as
+    the user ``user_pk`` would see it, into core.exports.ExportStore.
+    Returns the URL it is downloaded from.
+    """
+    from django.contrib.auth import get_user_model
+    from django.http import HttpRequest, QueryDict
+    from django.urls import resolve, reverse
+
+    from core.exports import ExportStore
+
+    match = resolve(path)
+    request = HttpRequest()
+    request.method = "GET"
+    request.path = request.path_info = path
+    request.GET = QueryDict(query_string)
+    request.user = get_user_model().objects.get(pk=user_pk)
+
+    view = match.func.view_class(**match.func.view_initkwargs)
+    view.setup(request, *match.args, **match.kwargs)
+    extension = "xlsx" if export_format == "xlsx" else "csv.gz"
+    ExportStore.write(user_pk, export_id, view.get_export_exporter(), export_format, f"{view.export_name}.{extension}")
+    return reverse("core:export_download", args=[export_id])
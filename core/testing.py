@@ -0,0 +1,53 @@
+from contextlib import ExitStack, contextmanager
+from urllib.parse import urlsplit
+
+from django.db import connections
+from django.urls import resolve
+
+from core.middleware import QueryRecorder, build_report, view_budget
+
+
+def format_report(report):
+    lines = [f"{report['queries']} queries, {report['sql_ms']} ms of SQL"]
+    lines += [f"  {row['count']}x {row['sql']}" for row in report["duplicates"]]
+    return "\n".join(lines)
+
+
+@contextmanager
+def query_budget(max_queries, label="block"):
+    """
+    Fail with AssertionError when the block runs more than ``max_queries``
+    statements (on every database). The report of build_report is yielded
+    as a dict and filled in when the block exits.
+    """
+    report = {}
+    recorders = [QueryRecorder(connection.alias) for connection in connections.all()]
+    with ExitStack() as stack:
+        for connection, recorder in zip(connections.all(), recorders):
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield report
+    report.update(build_report([query for recorder in recorders for query in recorder.queries]))
+    if report["queries"] > max_queries:
+        raise AssertionError(f"{label} is over its query budget of {max_queries}: {format_report(report)}")
+
+
+class QueryBudgetTestMixin:
+    """
+    For django.test.TestCase: requests a URL and fails when its view runs more
+    queries than the ``query_budget`` declared on the view::
+
+        class HomeViewTest(QueryBudgetTestMixin, TestCase):
+            def test_budget(self):
+                self.client.force_login(self.user)
+                self.assertWithinQueryBudget(reverse("core:home"))
+    """
+
+    def assertWithinQueryBudget(self, url, budget=None, method="get", data=None, client=None):
+        if budget is None:
+            budget = view_budget(resolve(urlsplit(url).path))
+        if budget is None:
+            self.fail(f"The view of {url} declares no query_budget")
+        client = client or self.client
+        with query_budget(budget, label=url):
+            response = getattr(client, method)(url, data)
+        return response
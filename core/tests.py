@@ -1 +1,322 @@
+import gzip
+import io
+import json
+import shutil
+import tempfile
+from unittest import mock
 
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from core.benchmarks import BenchmarkSuite
+from core.middleware import fingerprint, reports
+from core.pagination import EstimatedCountPaginator, KeysetPaginator
+from core.tasks import export_table_task
+from core.synthetic import SyntheticDataGenerator
+from core.testing import QueryBudgetTestMixin
+from core.views import HomeView
+from master.models import Account, Channel, OrderHourlyStat
+from master.services import AccountLedgerService, OrderBuilder, OrderStatService, StockLedgerService
+from master.tests import MasterTestCase
+from master.views import OrderListView
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Channel.objects.bulk_create([Channel(channel_type=f"Channel {i}", prefix=f"C{i}") for i in range(3)])
+
+    def set_table_stats(self, rows):
+        if connection.vendor != "sqlite":
+            self.skipTest("writes sqlite_stat1")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            cursor.execute("UPDATE sqlite_stat1 SET stat = %s WHERE tbl = %s", [f"{rows} 1", Channel._meta.db_table])
+
+    def test_small_table_is_counted_exactly(self):
+        paginator = EstimatedCountPaginator(Channel.objects.order_by("pk"), 2)
+
+        self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.is_estimate)
+
+    def test_table_without_statistics_is_not_counted_twice(self):
+        paginator = EstimatedCountPaginator(Channel.objects.order_by("pk"), 2)
+
+        # The statistics lookup, then the page's own COUNT(*)
+        with self.assertNumQueries(2):
+            self.assertEqual(paginator.count, 3)
+
+    def test_large_table_uses_the_statistics(self):
+        self.set_table_stats(50000)
+        paginator = EstimatedCountPaginator(Channel.objects.order_by("pk"), 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 50000)
+        self.assertTrue(paginator.is_estimate)
+        self.assertEqual(len(paginator.page(2).object_list), 1)
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Channel.objects.bulk_create([Channel(channel_type=f"Channel {i}", prefix=f"C{i}") for i in range(7)])
+        # Ties on created are broken by id
+        Channel.objects.filter(pk__lte=4).update(created=Channel.objects.order_by("pk").first().created)
+
+    def walk(self, paginator):
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([channel.pk for channel in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once(self):
+        pages = self.walk(KeysetPaginator(Channel.objects.all(), 3))
+
+        expected = list(Channel.objects.order_by("-created", "-id").values_list("pk", flat=True))
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+
+    def test_pages_are_range_filters_not_offsets(self):
+        paginator = KeysetPaginator(Channel.objects.all(), 3)
+        cursor = paginator.page().next_cursor
+
+        with self.assertNumQueries(1) as queries:
+            paginator.page(cursor).object_list
+        self.assertNotIn("OFFSET", queries.captured_queries[0]["sql"])
+
+    def test_malformed_cursor_is_the_first_page(self):
+        paginator = KeysetPaginator(Channel.objects.all(), 3)
+
+        for cursor in ("not-base64!", "WzFd", "WyJ4IiwgMV0="):
+            page = paginator.page(cursor)
+            self.assertFalse(page.has_previous)
+            self.assertEqual([channel.pk for channel in page], [channel.pk for channel in paginator.page()])
+
+
+class OrderListKeysetTests(MasterTestCase):
+    def test_next_page_links_walk_the_orders(self):
+        orders = [self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}], phone_no=f"90000000{i:02d}") for i in range(5)]
+        self.client.force_login(self.user)
+
+        seen, url = [], reverse("master:order_list")
+        with mock.patch.object(OrderListView, "table_pagination", {"per_page": 2}):
+            while url:
+                response = self.client.get(url if url.startswith("/") else reverse("master:order_list") + url)
+                seen += [order.pk for order in response.context["keyset_page"]]
+                url = response.context.get("next_page_url")
+
+        self.assertEqual(sorted(seen), sorted(order.pk for order in orders))
+        self.assertEqual(len(seen), 5)
+
+
+class ViewQueryBudgetTests(QueryBudgetTestMixin, MasterTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_account = Account.objects.create(name="Cash", code="C1", opening_balance=0)
+        cls.staff = User.objects.create_user("staff", "staff@example.com", "staff", usertype="Staff")
+        for i in range(12):
+            OrderBuilder.create_quick_order(
+                cls.user if i % 2 else cls.staff, (cls.channel if i % 3 else cls.cod_channel).pk,
+                {"phone_no": f"90000000{i:02d}", "customer_name": f"Customer {i}", "pincode": f"6000{i:02d}", "city": f"City {i % 4}",
+                 "state": "Tamil Nadu", "address": "1, Test Street", "country": "India", "alternate_phone_no": ""},
+                [{"product_id": cls.apple.pk, "price": "100", "qty": 1}, {"product_id": cls.mango.pk, "price": "200", "qty": i % 3 + 1}],
+                (cls.account if i % 2 else cls.other_account).pk, (cls.user if i % 2 else cls.staff).pk,
+            )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_home(self):
+        self.assertWithinQueryBudget(reverse("core:home"))
+
+    def test_report(self):
+        self.assertWithinQueryBudget(reverse("core:report"))
+
+    def test_order_list(self):
+        self.assertWithinQueryBudget(reverse("master:order_list"))
+
+    def test_customer_list(self):
+        self.assertWithinQueryBudget(reverse("master:customer_list"))
+
+    def test_quick_order_entry(self):
+        self.assertWithinQueryBudget(reverse("master:quick_order_entry"))
+
+
+class QueryBudgetMiddlewareTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        reports.clear()
+        self.addCleanup(reports.clear)
+        self.client.force_login(self.user)
+
+    def test_fingerprint_collapses_literals_and_lists(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 'x''y' AND b IN (%s, %s,%s) AND c > 10.5"),
+            fingerprint("SELECT *  FROM t WHERE a = 'z' AND b IN (%s, %s) AND c > 3"),
+        )
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse("core:home"))
+
+        self.assertNotIn("X-Query-Count", response)
+        self.assertEqual(reports.recent(), [])
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_requests_are_reported(self):
+        response = self.client.get(reverse("core:home"))
+
+        self.assertEqual(response["X-Query-Budget"], str(HomeView.query_budget))
+        self.assertGreater(int(response["X-Query-Count"]), 0)
+        report = self.client.get(reverse("core:query_report")).json()
+        self.assertEqual([row["view"] for row in report["views"]], ["core:home"])
+        self.assertEqual(report["requests"][0]["queries"], int(response["X-Query-Count"]))
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_requests_over_budget_are_logged(self):
+        with mock.patch.object(HomeView, "query_budget", 1), self.assertLogs("core.middleware", "WARNING") as logs:
+            self.client.get(reverse("core:home"))
+
+        self.assertIn("over its budget of 1", logs.output[0])
+
+
+class AsyncExportTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_root, ignore_errors=True)
+        patcher = override_settings(EXPORT_ROOT=export_root)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}], phone_no="9000000001")
+        self.quick_order([{"product_id": self.mango.pk, "price": "200", "qty": 1}], phone_no="9000000002", channel=self.cod_channel)
+        self.client.force_login(self.user)
+
+    def queue_export(self, query):
+        with mock.patch.object(export_table_task, "delay", return_value=mock.Mock(id="task")) as delay:
+            response = self.client.get(f"{reverse('master:order_list')}?{query}&_export=csv&_async=1")
+        return response.json()["download_url"], delay.call_args.args
+
+    def test_export_is_queued_as_json_and_served_privately(self):
+        url, args = self.queue_export(f"channel__channel_type={self.channel.channel_type}")
+        # Nothing but plain values goes through the broker
+        self.assertEqual(json.loads(json.dumps(args)), list(args))
+        self.assertEqual(self.client.get(url).status_code, 202)
+
+        self.assertEqual(export_table_task(*args), url)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        rows = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertIn("9000000001", rows[1])
+
+    def test_other_users_cannot_download(self):
+        url, args = self.queue_export("")
+        export_table_task(*args)
+        other = User.objects.create_user("other", "other@example.com", "other", usertype="Admin")
+        self.client.force_login(other)
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_failed_export_is_not_found(self):
+        url, args = self.queue_export("")
+        with mock.patch("core.exports.TableStreamExporter.save", side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                export_table_task(*args)
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class StreamingExportTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def export(self, export_format):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{reverse('master:order_list')}?_export={export_format}")
+            content = b"".join(response.streaming_content)
+        return response, content, len(queries)
+
+    def test_csv_queries_do_not_grow_with_rows(self):
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}], phone_no="9000000001")
+        # The first request also fills the per-process caches
+        self.export("csv")
+        response, content, few = self.export("csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        for i in range(2, 7):
+            self.quick_order([{"product_id": self.mango.pk, "price": "200", "qty": 1}], phone_no=f"900000000{i}")
+
+        response, content, many = self.export("csv")
+
+        self.assertEqual(len(content.decode().splitlines()), 7)
+        self.assertEqual(many, few)
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}], phone_no="9000000001")
+
+        response, content, queries = self.export("xlsx")
+
+        rows = list(load_workbook(io.BytesIO(content)).active.values)
+        self.assertEqual(len(rows), 2)
+        self.assertIn("9000000001", [str(value) for value in rows[1]])
+
+
+class SyntheticDataTests(MasterTestCase):
+    def rollup(self):
+        return sorted(OrderHourlyStat.objects.values_list("business_date", "hour", "channel", "account", "order_count", "total_amount"))
+
+    def orders(self, generator):
+        return list(generator.synthetic_orders().order_by("order_no").values_list("order_no", "created", "customer__phone_no", "total_amount"))
+
+    def test_growing_the_dataset_adds_the_rows_of_a_single_run(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            generator = SyntheticDataGenerator(seed=7, days=30)
+            self.assertEqual(generator.run(30), 30)
+            single_run = self.orders(generator)
+            raise RuntimeError
+
+        generator = SyntheticDataGenerator(seed=7, days=30)
+        self.assertEqual(generator.run(20), 20)
+        self.assertEqual(generator.run(20), 0)
+        self.assertEqual(generator.run(30), 10)
+
+        self.assertEqual(self.orders(generator), single_run)
+
+    def test_signal_maintained_tables_match_the_rows(self):
+        SyntheticDataGenerator(seed=7, days=30).run(25)
+        rollup = self.rollup()
+
+        OrderStatService.rebuild()
+
+        self.assertEqual(self.rollup(), rollup)
+        self.assertEqual(StockLedgerService.rebuild_all(verify_only=True), [])
+        self.assertEqual(AccountLedgerService.rebuild_all(verify_only=True), [])
+
+
+class BenchmarkSuiteTests(MasterTestCase):
+    def test_cases_run_and_compare(self):
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+        suite = BenchmarkSuite(repeat=1, only=["home_view", "order_list_search", "quick_order_save"])
+        # The test runner has already set the test environment up
+        suite.test_environment = True
+
+        result = suite.run()
+
+        self.assertEqual(sorted(result["results"]), ["home_view", "order_list_search", "quick_order_save"])
+        self.assertTrue(all("median_ms" in case for case in result["results"].values()), result["results"])
+        self.assertEqual(result["meta"]["orders"], 1)
+        previous = {"results": {"home_view": {"median_ms": result["results"]["home_view"]["median_ms"] * 2}}}
+        self.assertEqual(BenchmarkSuite.compare(previous, result)[0][3], -50.0)
@@ -8,4 +8,6 @@ urlpatterns = [
     path("", views.HomeView.as_view(), name="home"),
     path("report/", views.ReportView.as_view(), name="report"),
     path("channel_report/", views.ChannelReportView.as_view(), name="channel_report"),
+    path("debug/queries/", views.query_report, name="query_report"),
+    path("exports/<uuid:export_id>/", views.export_download, name="export_download"),
 ]
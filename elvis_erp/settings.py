@@ -70,6 +70,7 @@ INSTALLED_APPS = INSTALLED_PLUGINS + DJANGO_APPS + MODULES
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "core.middleware.QueryBudgetMiddleware",
     "user_sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -79,6 +80,10 @@ MIDDLEWARE = [
     "django.middleware.locale.LocaleMiddleware",
 ]
 
+# Per request query counts in X-Query-* headers and at core:query_report (staff only)
+QUERY_INSTRUMENTATION = config("QUERY_INSTRUMENTATION", default=False, cast=bool)
+QUERY_INSTRUMENTATION_BUFFER = config("QUERY_INSTRUMENTATION_BUFFER", default=200, cast=int)
+
 ROOT_URLCONF = "elvis_erp.urls"
 
 THUMBNAIL_ALIASES = {"": {"avatar": {"size": (50, 50), "crop": True}}}
@@ -160,6 +165,8 @@ SHORT_DATE_FORMAT = "d/m/Y"
 # Static files (CSS, JavaScript, Images)
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Async table exports; not public, served per user by core:export_download
+EXPORT_ROOT = config("EXPORT_ROOT", default=BASE_DIR / "exports")
 STATIC_URL = "/static/"
 STATIC_FILE_ROOT = BASE_DIR / "static"
 STATICFILES_DIRS = ((BASE_DIR / "static"),)
@@ -247,6 +254,9 @@ CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
+# Order numbers reserved per worker process; 1 keeps numbering gapless
+ORDER_NUMBER_BLOCK_SIZE = config("ORDER_NUMBER_BLOCK_SIZE", default=1, cast=int)
+
 
 
 # =============================================================================
@@ -278,6 +288,27 @@ FEATURE_FLAGS = {
 # These are used only if database credentials are not configured
 # In production, use the admin panel to configure CarrierCredential
 
+# AWB booking: worker threads per allocation run and bookings in flight per carrier
+# (a credential's additional_config "max_concurrency" overrides the latter)
+SHIPMENT_BOOKING_WORKERS = config('SHIPMENT_BOOKING_WORKERS', default=16, cast=int)
+SHIPMENT_CARRIER_CONCURRENCY = config('SHIPMENT_CARRIER_CONCURRENCY', default=4, cast=int)
+
+# Carrier API calls: retries for idempotent calls, and the circuit breaker that
+# stops calling a carrier after consecutive failed or slow calls
+COURIER_HTTP_RETRIES = config('COURIER_HTTP_RETRIES', default=2, cast=int)
+COURIER_BREAKER_FAILURES = config('COURIER_BREAKER_FAILURES', default=5, cast=int)
+COURIER_BREAKER_RESET_SECONDS = config('COURIER_BREAKER_RESET_SECONDS', default=30, cast=int)
+COURIER_SLOW_CALL_SECONDS = config('COURIER_SLOW_CALL_SECONDS', default=10, cast=int)
+
+# Carrier API logs are queued and written in batches: 'buffer' (a thread in each
+# process), 'celery' (handed to a task) or 'sync' (written on every call)
+CARRIER_API_LOG_MODE = config('CARRIER_API_LOG_MODE', default='buffer')
+CARRIER_API_LOG_BATCH_SIZE = config('CARRIER_API_LOG_BATCH_SIZE', default=200, cast=int)
+CARRIER_API_LOG_FLUSH_SECONDS = config('CARRIER_API_LOG_FLUSH_SECONDS', default=5, cast=int)
+
+# Seconds a live serviceability answer is cached for pincodes the matrix does not know
+SERVICEABILITY_LIVE_TTL = config('SERVICEABILITY_LIVE_TTL', default=86400, cast=int)
+
 # Delhivery
 DELHIVERY_API_TOKEN = config('DELHIVERY_API_TOKEN', default='')
 DELHIVERY_PICKUP_NAME = config('DELHIVERY_PICKUP_NAME', default='Elvis co')
@@ -5,3 +5,6 @@ class LogisticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'logistics'
     verbose_name = 'Logistics Management'
+
+    def ready(self):
+        from . import signals  # noqa: F401
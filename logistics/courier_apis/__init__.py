@@ -1,14 +1,133 @@
 """Courier API Service Registry and Base Classes."""
 import requests
+import random
+import threading
 import time
 import logging
 from abc import ABC, abstractmethod
+from django.conf import settings
 from django.utils import timezone
-from .models import CarrierAPILog, Carrier
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
 
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling a carrier whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per carrier breaker shared by the threads of one process.
+
+    A call fails if it raises, returns a 5xx / 429 or takes longer than
+    ``slow_call_seconds`` (or the call's own threshold, for long running
+    calls). ``failure_threshold`` consecutive failures open the breaker:
+    calls are refused for ``reset_seconds``, after which one trial call is
+    let through (half open) and its outcome closes or reopens it. A success
+    that arrives while the breaker is open came from a call started before
+    it opened and is ignored.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    _breakers = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, name, failure_threshold=None, reset_seconds=None, slow_call_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, 'COURIER_BREAKER_FAILURES', 5)
+        self.reset_seconds = reset_seconds or getattr(settings, 'COURIER_BREAKER_RESET_SECONDS', 30)
+        self.slow_call_seconds = slow_call_seconds or getattr(settings, 'COURIER_SLOW_CALL_SECONDS', 10)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_carrier(cls, carrier):
+        key = str(carrier.pk)
+        breaker = cls._breakers.get(key)
+        if breaker is None:
+            with cls._registry_lock:
+                breaker = cls._breakers.setdefault(key, cls(carrier.code))
+        return breaker
+
+    @classmethod
+    def is_open(cls, carrier):
+        """True while calls to ``carrier`` would be refused."""
+        breaker = cls._breakers.get(str(carrier.pk))
+        return breaker is not None and not breaker.would_allow()
+
+    def would_allow(self):
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return self.state == self.CLOSED
+
+    def allow(self):
+        """Whether a call may go out now; moves an expired open breaker to half open."""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                return True
+            # Open, or half open with the trial call still in flight
+            return False
+
+    def record(self, success, seconds, slow_call_seconds=None):
+        with self.lock:
+            if success and seconds <= (slow_call_seconds or self.slow_call_seconds):
+                if self.state == self.OPEN:
+                    # Started before the breaker opened; only the half open trial may close it
+                    return
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit breaker for %s opened after %s failed or slow calls", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+
+class CarrierSessions:
+    """One keep-alive ``requests.Session`` per carrier per process."""
+
+    POOL_SIZE = 20
+
+    _sessions = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, carrier):
+        key = str(carrier.pk)
+        session = cls._sessions.get(key)
+        if session is None:
+            with cls._lock:
+                session = cls._sessions.get(key)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=getattr(settings, 'COURIER_HTTP_POOL_SIZE', cls.POOL_SIZE))
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    cls._sessions[key] = session
+        return session
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
+
+
 class CourierAPIBase(ABC):
     """Base class for all courier API integrations."""
     
@@ -21,13 +140,15 @@ class CourierAPIBase(ABC):
     
     def log_api_call(self, log_type, url, method, headers, body, response_status, 
                      response_body, response_time_ms, is_success, error_message=None, reference_id=None):
-        """Log API call to database."""
+        """Queue the API call's log row; CarrierAPILogBuffer writes it and the carrier counters in batches."""
+        from ..services import api_logs
+        
         try:
             # Mask sensitive data in headers
             safe_headers = {k: '***' if 'key' in k.lower() or 'token' in k.lower() or 'auth' in k.lower() 
                            else v for k, v in headers.items()}
             
-            CarrierAPILog.objects.create(
+            api_logs.add(
                 carrier=self.carrier,
                 log_type=log_type,
                 request_url=url,
@@ -41,39 +162,91 @@ class CourierAPIBase(ABC):
                 error_message=error_message,
                 reference_id=reference_id
             )
-            
-            # Update carrier API stats
-            self.carrier.total_api_calls += 1
-            if is_success:
-                self.carrier.successful_api_calls += 1
-            else:
-                self.carrier.failed_api_calls += 1
-            self.carrier.last_api_check = timezone.now()
-            self.carrier.save(update_fields=['total_api_calls', 'successful_api_calls', 
-                                             'failed_api_calls', 'last_api_check'])
         except Exception as e:
             logger.error(f"Error logging API call: {e}")
     
+    # Read only, so safe to repeat; PUT/DELETE may still book or cancel at the carrier
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    # Read-only lookups some carriers serve over POST
+    IDEMPOTENT_LOG_TYPES = ('serviceability', 'track', 'rate_check')
+    RETRY_STATUSES = (429, 502, 503, 504)
+    CONNECT_TIMEOUT = 5
+
+    def is_idempotent(self, method, log_type):
+        return method.upper() in self.IDEMPOTENT_METHODS or log_type in self.IDEMPOTENT_LOG_TYPES
+
+    def backoff(self, attempt):
+        """Full jitter: a random wait of up to base x 2^attempt seconds."""
+        base = getattr(settings, 'COURIER_RETRY_BACKOFF_SECONDS', 0.5)
+        time.sleep(random.uniform(0, base * 2 ** attempt))
+
     def make_request(self, method, url, headers=None, data=None, json_data=None, 
-                     log_type='other', reference_id=None, timeout=30):
-        """Make HTTP request with logging."""
+                     log_type='other', reference_id=None, timeout=30, slow_call_seconds=None):
+        """
+        Make HTTP request with logging.
+        
+        Requests go through the carrier's pooled session. Idempotent calls are
+        retried (``COURIER_HTTP_RETRIES`` times, with jittered backoff) on
+        connection errors, timeouts and 429/502/503/504. While the carrier's
+        circuit breaker is open CircuitOpenError is raised without calling
+        out. Calls expected to be slow (bulk downloads) pass their own
+        ``slow_call_seconds`` so they do not count against the breaker.
+        """
         headers = headers or {}
-        start_time = time.time()
+        breaker = CircuitBreaker.for_carrier(self.carrier)
+        session = CarrierSessions.get(self.carrier)
+        retries = getattr(settings, 'COURIER_HTTP_RETRIES', 2) if self.is_idempotent(method, log_type) else 0
         
-        try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                data=data,
-                json=json_data,
-                timeout=timeout
-            )
-            response_time_ms = int((time.time() - start_time) * 1000)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"{self.carrier.name} API is unavailable (circuit breaker open)")
+            
+            start_time = time.time()
+            carrier_ok = False
+            error = None
+            try:
+                response = session.request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    data=data,
+                    json=json_data,
+                    timeout=(min(self.CONNECT_TIMEOUT, timeout), timeout)
+                )
+                # Client errors are the request's fault, not the carrier's
+                carrier_ok = response.status_code < 500 and response.status_code != 429
+            except requests.exceptions.RequestException as e:
+                error = e
+            finally:
+                # Recorded whatever happened, so a half open trial that raises
+                # anything at all still reopens the breaker
+                elapsed = time.time() - start_time
+                breaker.record(carrier_ok, elapsed, slow_call_seconds)
+
+            if error is not None:
+                self.log_api_call(
+                    log_type=log_type,
+                    url=url,
+                    method=method,
+                    headers=headers,
+                    body=json_data or data or {},
+                    response_status=None,
+                    response_body={},
+                    response_time_ms=int(elapsed * 1000),
+                    is_success=False,
+                    error_message=str(error),
+                    reference_id=reference_id
+                )
+                if attempt < retries and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                    attempt += 1
+                    self.backoff(attempt)
+                    continue
+                raise error
             
             try:
                 response_body = response.json()
-            except:
+            except ValueError:
                 response_body = {'text': response.text[:1000]}
             
             is_success = 200 <= response.status_code < 300
@@ -86,29 +259,16 @@ class CourierAPIBase(ABC):
                 body=json_data or data or {},
                 response_status=response.status_code,
                 response_body=response_body,
-                response_time_ms=response_time_ms,
+                response_time_ms=int(elapsed * 1000),
                 is_success=is_success,
                 reference_id=reference_id
             )
             
+            if attempt < retries and response.status_code in self.RETRY_STATUSES:
+                attempt += 1
+                self.backoff(attempt)
+                continue
             return response
-            
-        except requests.exceptions.RequestException as e:
-            response_time_ms = int((time.time() - start_time) * 1000)
-            self.log_api_call(
-                log_type=log_type,
-                url=url,
-                method=method,
-                headers=headers,
-                body=json_data or data or {},
-                response_status=None,
-                response_body={},
-                response_time_ms=response_time_ms,
-                is_success=False,
-                error_message=str(e),
-                reference_id=reference_id
-            )
-            raise
     
     @abstractmethod
     def check_serviceability(self, pickup_pincode, delivery_pincode, is_cod=False):
@@ -172,6 +332,26 @@ class CourierAPIBase(ABC):
         """
         pass
     
+    # Waybills per get_tracking_statuses call; carriers with a multi-AWB endpoint raise it
+    TRACKING_BATCH_SIZE = 1
+    
+    def get_tracking_statuses(self, awb_numbers):
+        """Tracking for several AWBs (optional override for carriers with a multi-AWB endpoint).
+        
+        Returns:
+            dict: awb_number -> get_tracking_status result
+        """
+        return {awb: self.get_tracking_status(awb) for awb in awb_numbers}
+    
+    def get_serviceable_pincodes(self):
+        """Full list of serviceable pincodes, for carriers with a bulk endpoint (optional override).
+        
+        Returns:
+            list of (pincode, prepaid_available, cod_available, delivery_days),
+            or None when the carrier has no bulk list
+        """
+        return None
+    
     def generate_label(self, awb_number):
         """Generate shipping label (optional override)."""
         return {'success': False, 'message': 'Not implemented'}
@@ -267,3 +447,6 @@ class CourierAPIRegistry:
 
 # Register the mock API as default
 CourierAPIRegistry.register('mock', MockCourierAPI)
+
+# Carrier adapters register themselves on import
+from . import delhivery, dtdc, ecom_express, ekart, india_post, professional_couriers  # noqa: E402,F401
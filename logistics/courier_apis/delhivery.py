@@ -16,13 +16,10 @@ class DelhiveryAPI(CourierAPIBase):
         """Check pincode serviceability via Delhivery API."""
         try:
             url = f"{self.base_url}/c/api/pin-codes/json/"
-            params = {
-                'filter_codes': delivery_pincode
-            }
             
             response = self.make_request(
                 method='GET',
-                url=url,
+                url=f"{url}?filter_codes={delivery_pincode}",
                 headers=self.get_headers(),
                 log_type='serviceability',
                 reference_id=delivery_pincode
@@ -67,6 +64,31 @@ class DelhiveryAPI(CourierAPIBase):
                 'message': str(e)
             }
     
+    def get_serviceable_pincodes(self):
+        """All Delhivery pincodes: the pin-codes endpoint without a filter."""
+        response = self.make_request(
+            method='GET',
+            url=f"{self.base_url}/c/api/pin-codes/json/",
+            headers=self.get_headers(),
+            log_type='serviceability',
+            timeout=120,
+            # The full list takes well over the breaker's usual slow call limit
+            slow_call_seconds=120
+        )
+        if response.status_code != 200:
+            return None
+        
+        pincodes = []
+        for code in response.json().get('delivery_codes', []):
+            info = code.get('postal_code', {})
+            pincodes.append((
+                str(info.get('pin', '')),
+                info.get('pre_paid', 'N') == 'Y',
+                info.get('cod', 'N') == 'Y',
+                info.get('max_time')
+            ))
+        return pincodes
+    
     def create_shipment(self, order_data):
         """Create shipment and generate AWB via Delhivery API."""
         try:
@@ -196,65 +218,80 @@ class DelhiveryAPI(CourierAPIBase):
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @staticmethod
+    def parse_tracking(shipment_data):
+        """Tracking result for one ``ShipmentData[].Shipment`` entry."""
+        status = shipment_data.get('Status', {}).get('Status', 'Unknown')
+        scans = shipment_data.get('Scans', [])
+        
+        events = []
+        for scan in scans:
+            scan_detail = scan.get('ScanDetail', {})
+            events.append({
+                'status': scan_detail.get('Scan', ''),
+                'location': scan_detail.get('ScannedLocation', ''),
+                'timestamp': scan_detail.get('ScanDateTime', ''),
+                'description': scan_detail.get('Instructions', '')
+            })
+        
+        return {
+            'success': True,
+            'status': status,
+            'status_code': shipment_data.get('Status', {}).get('StatusCode', ''),
+            'location': shipment_data.get('Status', {}).get('StatusLocation', ''),
+            'events': events,
+            'message': 'Tracking retrieved'
+        }
+    
     def get_tracking_status(self, awb_number):
         """Get tracking status via Delhivery API."""
+        return self.get_tracking_statuses([awb_number])[awb_number]
+    
+    # The packages endpoint takes a comma separated list of waybills
+    TRACKING_BATCH_SIZE = 50
+    
+    def get_tracking_statuses(self, awb_numbers):
+        """Track up to TRACKING_BATCH_SIZE waybills in one Delhivery call."""
         try:
             url = f"{self.base_url}/api/v1/packages/json/"
-            params = {'waybill': awb_number}
+            waybills = ','.join(awb_numbers)
             
             response = self.make_request(
                 method='GET',
-                url=f"{url}?waybill={awb_number}",
+                url=f"{url}?waybill={waybills}",
                 headers=self.get_headers(),
                 log_type='track',
-                reference_id=awb_number
+                reference_id=waybills[:100]
             )
             
             if response.status_code == 200:
                 data = response.json()
-                shipment_data = data.get('ShipmentData', [{}])[0].get('Shipment', {})
-                
-                status = shipment_data.get('Status', {}).get('Status', 'Unknown')
-                scans = shipment_data.get('Scans', [])
-                
-                events = []
-                for scan in scans:
-                    scan_detail = scan.get('ScanDetail', {})
-                    events.append({
-                        'status': scan_detail.get('Scan', ''),
-                        'location': scan_detail.get('ScannedLocation', ''),
-                        'timestamp': scan_detail.get('ScanDateTime', ''),
-                        'description': scan_detail.get('Instructions', '')
-                    })
-                
-                return {
-                    'success': True,
-                    'status': status,
-                    'status_code': shipment_data.get('Status', {}).get('StatusCode', ''),
-                    'location': shipment_data.get('Status', {}).get('StatusLocation', ''),
-                    'events': events,
-                    'message': 'Tracking retrieved'
-                }
+                results = {}
+                for entry in data.get('ShipmentData', []):
+                    shipment_data = entry.get('Shipment', {})
+                    results[str(shipment_data.get('AWB', ''))] = self.parse_tracking(shipment_data)
+                # A single waybill may come back without its AWB echoed
+                if len(awb_numbers) == 1 and len(results) == 1 and awb_numbers[0] not in results:
+                    results = {awb_numbers[0]: next(iter(results.values()))}
+                missing = {'success': False, 'status': None, 'status_code': None, 'location': None, 'events': [], 'message': 'Waybill not found'}
+                return {awb: results.get(awb, missing) for awb in awb_numbers}
             else:
-                return {
-                    'success': False,
-                    'status': None,
-                    'status_code': None,
-                    'location': None,
-                    'events': [],
-                    'message': f'API error: {response.status_code}'
-                }
+                message = f'API error: {response.status_code}'
                 
         except Exception as e:
-            return {
+            message = str(e)
+        
+        return {
+            awb: {
                 'success': False,
                 'status': None,
                 'status_code': None,
                 'location': None,
                 'events': [],
-                'message': str(e)
+                'message': message
             }
-
+            for awb in awb_numbers
+        }
 
 # Register the API
 CourierAPIRegistry.register('delhivery', DelhiveryAPI)
@@ -131,6 +131,21 @@ class CarrierAPILog(BaseModel):
         return f"{self.carrier.name} - {self.log_type} - {self.created}"
 
 
+class CarrierPincodeList(BaseModel):
+    """A carrier's bulk serviceable pincode download, packed by logistics.services.ServiceabilityMatrix."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    carrier = models.OneToOneField(Carrier, on_delete=models.CASCADE, related_name='pincode_list')
+    data = models.BinaryField(help_text="zlib compressed matrix row")
+    pincode_count = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Carrier Pincode List"
+        verbose_name_plural = "Carrier Pincode Lists"
+    
+    def __str__(self):
+        return f"{self.carrier.name}: {self.pincode_count} pincodes"
+
+
 class PincodeRule(BaseModel):
     """Manual pincode-to-carrier mapping with fallback logic."""
     RULE_TYPES = [
@@ -393,6 +408,7 @@ class Shipment(BaseModel):
     pickup_date = models.DateTimeField(null=True, blank=True)
     expected_delivery_date = models.DateField(null=True, blank=True)
     actual_delivery_date = models.DateTimeField(null=True, blank=True)
+    tracking_checked_at = models.DateTimeField(null=True, blank=True, help_text="Last tracking poll")
     
     # Addresses
     pickup_address = models.JSONField(default=dict)
@@ -419,6 +435,8 @@ class Shipment(BaseModel):
         verbose_name = "Shipment"
         verbose_name_plural = "Shipments"
         ordering = ['-created']
+        # Due shipments for the tracking refresh
+        indexes = [models.Index(fields=['status', 'tracking_checked_at'])]
     
     def __str__(self):
         return f"{self.tracking_number} - {self.order.order_no}"
@@ -5,13 +5,138 @@ This module provides shipping services that read credentials from the database
 instead of hardcoded values. It serves as a bridge between the old courier_partner.py
 and the new CarrierCredential model.
 """
+import atexit
 import json
+import logging
+import os
+import threading
 import time
+import zlib
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When, prefetch_related_objects
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.conf import settings
-from .models import Carrier, CarrierCredential, CarrierAPILog, ShippingRule, Shipment, ShippingSettings
+from core.functions import data_version
+from master.models import Order
+from .models import Carrier, CarrierCredential, CarrierAPILog, ShippingRule, Shipment, ShipmentTracking, ShippingSettings
+
+logger = logging.getLogger(__name__)
+
+
+class CarrierAPILogBuffer:
+    """
+    In-process queue of CarrierAPILog rows.
+
+    ``add`` only appends to a list. A daemon thread writes the waiting rows
+    with one bulk_create, and bumps the carrier counters with a single
+    UPDATE of F-expressions, once ``max_size`` rows are waiting or every
+    ``flush_seconds``. CARRIER_API_LOG_MODE picks where batches go:
+    'buffer' (this thread), 'celery' (write_carrier_api_logs_task) or 'sync'
+    (every row written at once, for shells and tests). A row's ``created``
+    is the time its batch was written, up to one interval after the call;
+    ``last_api_check`` gets the call time. Rows still queued when the
+    process exits normally are flushed; a killed process loses at most one
+    interval of logs.
+    """
+
+    def __init__(self, max_size=None, flush_seconds=None, mode=None):
+        self.max_size = max_size or getattr(settings, 'CARRIER_API_LOG_BATCH_SIZE', 200)
+        self.flush_seconds = flush_seconds or getattr(settings, 'CARRIER_API_LOG_FLUSH_SECONDS', 5)
+        self.mode = mode or getattr(settings, 'CARRIER_API_LOG_MODE', 'buffer')
+        self.entries = []
+        self.condition = threading.Condition()
+        self.pid = None
+        atexit.register(self.flush)
+
+    def add(self, **entry):
+        """Queue one log row (CarrierAPILog field values, with ``carrier`` or ``carrier_id``)."""
+        if 'carrier' in entry:
+            entry['carrier_id'] = entry.pop('carrier').pk
+        entry.setdefault('called_at', timezone.now())
+        if self.mode == 'sync':
+            self.write([entry])
+            return
+        with self.condition:
+            if self.pid != os.getpid():
+                # First row in this process (or in a forked child): start its writer
+                self.pid = os.getpid()
+                self.entries = []
+                threading.Thread(target=self.run, name='carrier-api-log', daemon=True).start()
+            self.entries.append(entry)
+            if len(self.entries) >= self.max_size:
+                self.condition.notify()
+
+    def take(self):
+        with self.condition:
+            batch, self.entries = self.entries, []
+        return batch
+
+    def flush(self):
+        batch = self.take()
+        if not batch:
+            return
+        if self.mode == 'celery':
+            from .tasks import write_carrier_api_logs_task
+
+            write_carrier_api_logs_task.delay([
+                {**entry, 'carrier_id': str(entry['carrier_id']), 'called_at': entry['called_at'].isoformat()}
+                for entry in batch
+            ])
+        else:
+            self.write(batch)
+
+    def run(self):
+        from django.db import connections
+
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.entries) >= self.max_size, timeout=self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing carrier API logs: {e}")
+            finally:
+                connections.close_all()
+
+    @staticmethod
+    def write(entries):
+        """Insert ``entries`` and add their totals to the carrier counters in one UPDATE."""
+        from django.utils.dateparse import parse_datetime
+
+        logs = []
+        totals = {}
+        for entry in entries:
+            entry = dict(entry)
+            called_at = entry.pop('called_at')
+            if isinstance(called_at, str):
+                called_at = parse_datetime(called_at)
+            logs.append(CarrierAPILog(**entry))
+            calls, successes, last = totals.get(str(entry['carrier_id']), (0, 0, called_at))
+            totals[str(entry['carrier_id'])] = (calls + 1, successes + bool(entry['is_success']), max(last, called_at))
+
+        def per_carrier(values, default):
+            return Case(
+                *[When(pk=pk, then=Value(value)) for pk, value in values.items()],
+                default=default,
+            )
+
+        with transaction.atomic():
+            CarrierAPILog.objects.bulk_create(logs)
+            Carrier.objects.filter(pk__in=list(totals)).update(
+                total_api_calls=F('total_api_calls') + per_carrier({pk: calls for pk, (calls, successes, last) in totals.items()}, Value(0)),
+                successful_api_calls=F('successful_api_calls') + per_carrier({pk: successes for pk, (calls, successes, last) in totals.items()}, Value(0)),
+                failed_api_calls=F('failed_api_calls') + per_carrier({pk: calls - successes for pk, (calls, successes, last) in totals.items()}, Value(0)),
+                last_api_check=per_carrier({pk: last for pk, (calls, successes, last) in totals.items()}, F('last_api_check')),
+            )
+
+
+api_logs = CarrierAPILogBuffer()
 
 
 class CarrierService:
@@ -53,12 +178,12 @@ class CarrierService:
     def log_api_call(carrier, log_type, request_url, request_method, request_headers,
                      request_body, response_status, response_body, response_time_ms,
                      is_success, error_message=None, reference_id=None):
-        """Log an API call to a carrier."""
+        """Queue a log row for an API call to a carrier (see CarrierAPILogBuffer)."""
         # Mask sensitive data in headers
         safe_headers = {k: '***' if 'auth' in k.lower() or 'token' in k.lower() else v 
                        for k, v in request_headers.items()}
         
-        return CarrierAPILog.objects.create(
+        api_logs.add(
             carrier=carrier,
             log_type=log_type,
             request_url=request_url,
@@ -111,12 +236,14 @@ class DelhiveryService:
             }
         
         carrier = CarrierService.get_carrier_by_code(cls.CARRIER_CODE)
+        # Item totals and description in one query (with_amounts) instead of per item
+        amounts = order if hasattr(order, 'actual_total') else Order.objects.with_amounts().get(pk=order.pk)
         payment_mode = "COD" if hasattr(order, 'channel') and 'COD' in str(order.channel.channel_type) else "Prepaid"
         
         cod_amount = ""
         if payment_mode == 'COD':
             cod_charge = 50 if getattr(order, 'cod_charge', 0) == 0 else 0
-            amt = order.get_shipping_amount() + cod_charge
+            amt = amounts.get_shipping_amount() + cod_charge
             cod_amount = str(amt)
         
         shipment = {
@@ -129,9 +256,9 @@ class DelhiveryService:
             "phone": order.phone or order.mobile,
             "order": order.order_no,
             "payment_mode": payment_mode,
-            "products_desc": order.get_products_desc(),
+            "products_desc": amounts.get_products_desc(),
             "cod_amount": cod_amount,
-            "total_amount": str(order.get_shipping_amount()),
+            "total_amount": str(amounts.get_shipping_amount()),
             "shipment_width": "10",
             "shipment_height": "10",
             "weight": "0.5",
@@ -266,11 +393,134 @@ class BlueDartService:
         return data.get("JWTToken")
 
 
+class CompiledRule:
+    """
+    A ShippingRule with its operand parsed once.
+
+    ``matches`` gives the same answer as ``ShippingRule.evaluate`` for the
+    same order data; rules whose operand cannot be parsed (a non-numeric
+    greater_than value, say) never match instead of raising on every order.
+    """
+
+    __slots__ = ('rule', 'field', 'operator', 'operand', 'position')
+
+    def __init__(self, rule, position):
+        self.rule = rule
+        self.field = rule.condition_field
+        self.operator = rule.condition_operator
+        self.position = position
+        value = rule.condition_value
+        if self.operator in ('greater_than', 'less_than'):
+            try:
+                self.operand = float(value)
+            except (TypeError, ValueError):
+                self.operator = None
+        elif self.operator in ('in_list', 'not_in_list'):
+            values = value if isinstance(value, list) else [value]
+            self.operand = frozenset(str(v) for v in values)
+        elif self.operator == 'contains':
+            self.operand = str(value).lower()
+        else:
+            self.operand = str(value)
+
+    @property
+    def indexable(self):
+        """Equality rules can be looked up by value instead of scanned."""
+        return self.operator in ('equals', 'in_list')
+
+    def matches(self, order_data):
+        field_value = order_data.get(self.field)
+        if field_value is None:
+            return False
+        operator = self.operator
+        if operator == 'equals':
+            return str(field_value) == self.operand
+        if operator == 'not_equals':
+            return str(field_value) != self.operand
+        if operator == 'greater_than':
+            try:
+                return float(field_value) > self.operand
+            except (TypeError, ValueError):
+                return False
+        if operator == 'less_than':
+            try:
+                return float(field_value) < self.operand
+            except (TypeError, ValueError):
+                return False
+        if operator == 'in_list':
+            return str(field_value) in self.operand
+        if operator == 'not_in_list':
+            return str(field_value) not in self.operand
+        if operator == 'contains':
+            return self.operand in str(field_value).lower()
+        if operator == 'starts_with':
+            return str(field_value).startswith(self.operand)
+        return False
+
+
+class CompiledRuleSet:
+    """
+    Enabled shipping rules in evaluation order, indexed for allocation.
+
+    equals / in_list rules go into a per condition_field dict of value ->
+    earliest rule position, so they cost one lookup per field whatever their
+    number; the other rules are scanned in priority order, but only up to the
+    best indexed hit.
+    """
+
+    def __init__(self, rules, primary_carrier, version=None):
+        self.version = version
+        self.rules = [CompiledRule(rule, position) for position, rule in enumerate(rules)]
+        self.primary_carrier = primary_carrier
+        self.index = {}
+        self.scanned = []
+        for compiled in self.rules:
+            if not compiled.indexable:
+                self.scanned.append(compiled)
+                continue
+            values = self.index.setdefault(compiled.field, {})
+            keys = compiled.operand if compiled.operator == 'in_list' else (compiled.operand,)
+            for key in keys:
+                values.setdefault(key, compiled)
+
+    def match(self, order_data):
+        """First rule, in priority order, that matches ``order_data`` (or None)."""
+        best = None
+        for field, values in self.index.items():
+            field_value = order_data.get(field)
+            if field_value is None:
+                continue
+            compiled = values.get(str(field_value))
+            if compiled is not None and (best is None or compiled.position < best.position):
+                best = compiled
+        for compiled in self.scanned:
+            if best is not None and compiled.position > best.position:
+                break
+            if compiled.matches(order_data):
+                return compiled.rule
+        return best.rule if best is not None else None
+
+
 class ShippingRuleEngine:
     """
     Engine for automatic carrier allocation based on rules.
+
+    The enabled rules (with their carriers) and the primary carrier are
+    compiled once per process into a CompiledRuleSet. At most every
+    ``CHECK_INTERVAL`` seconds each process reads a version of the rule,
+    carrier and shipping settings tables from the database (row counts,
+    latest ``updated``, enabled rules and active carriers) and recompiles
+    when it has moved, so edits reach every process without a shared cache.
+    The signals in logistics.signals make the process that saved a change
+    check on its next allocation.
     """
-    
+
+    CHECK_INTERVAL = 30
+
+    _lock = threading.Lock()
+    _compiled = None
+    _checked_at = 0
+
     @staticmethod
     def get_order_data(order):
         """Extract order data for rule evaluation."""
@@ -283,7 +533,59 @@ class ShippingRuleEngine:
             'channel': order.channel.channel_type if hasattr(order.channel, 'channel_type') else str(order.channel),
             'payment_type': 'cod' if 'COD' in str(order.channel.channel_type) else 'prepaid',
         }
-    
+
+    @classmethod
+    def compile(cls, version=None):
+        rules = (
+            ShippingRule.objects.filter(is_enabled=True, is_active=True)
+            .select_related('assigned_carrier', 'fallback_carrier')
+            .order_by('-priority', 'created')
+        )
+        settings_obj = ShippingSettings.get_settings()
+        return CompiledRuleSet(list(rules), settings_obj.primary_carrier, version)
+
+    @staticmethod
+    def _version():
+        return (
+            data_version(ShippingRule.objects.all(), Q(is_enabled=True, is_active=True)),
+            data_version(Carrier.objects.all(), Q(status='active', is_active=True)),
+            data_version(ShippingSettings.objects.all()),
+        )
+
+    @classmethod
+    def invalidate(cls):
+        # This process checks the version on its next allocation without waiting for CHECK_INTERVAL
+        cls._checked_at = 0
+
+    @classmethod
+    def get_rules(cls):
+        compiled = cls._compiled
+        if compiled is not None and time.monotonic() - cls._checked_at < cls.CHECK_INTERVAL:
+            return compiled
+        version = cls._version()
+        if compiled is None or compiled.version != version:
+            with cls._lock:
+                compiled = cls._compiled
+                if compiled is None or compiled.version != version:
+                    compiled = cls._compiled = cls.compile(version)
+        cls._checked_at = time.monotonic()
+        return compiled
+
+    @classmethod
+    def allocate(cls, order, rules=None):
+        """
+        Carrier and matching rule for an order.
+
+        Returns:
+            (Carrier or None, ShippingRule or None); the rule is None when the
+            primary carrier was used as the fallback
+        """
+        rules = rules or cls.get_rules()
+        rule = rules.match(cls.get_order_data(order))
+        if rule is not None:
+            return rule.assigned_carrier, rule
+        return rules.primary_carrier, None
+
     @classmethod
     def allocate_carrier(cls, order):
         """
@@ -298,15 +600,924 @@ class ShippingRuleEngine:
         if use_legacy_shipping():
             return None
         
-        order_data = cls.get_order_data(order)
-        
-        # Get all enabled rules, sorted by priority
-        rules = ShippingRule.objects.filter(is_enabled=True, is_active=True).order_by('-priority')
-        
-        for rule in rules:
-            if rule.evaluate(order_data):
-                return rule.assigned_carrier
-        
-        # Fallback to primary carrier
-        settings_obj = ShippingSettings.get_settings()
-        return settings_obj.primary_carrier
+        return cls.allocate(order)[0]
+
+    @classmethod
+    def allocate_many(cls, orders):
+        """
+        Allocate carriers to many orders against one compiled rule set.
+
+        Channels not already loaded are fetched in a single query; no other
+        query runs per order.
+
+        Returns:
+            dict of order pk -> (Carrier or None, ShippingRule or None)
+        """
+        from core.feature_flags import use_legacy_shipping
+
+        orders = list(orders)
+        if use_legacy_shipping():
+            return {order.pk: (None, None) for order in orders}
+
+        prefetch_related_objects(orders, 'channel')
+        rules = cls.get_rules()
+        return {order.pk: cls.allocate(order, rules) for order in orders}
+
+
+class ServiceabilityMatrix:
+    """
+    In-process carrier x pincode serviceability.
+
+    Every carrier gets a ``bytearray`` with one byte per six-digit pincode
+    (about 900 KB): bit 0 marks a known pincode, bit 1 prepaid, bit 2 COD
+    and the top five bits hold the delivery days (0 when unknown). It is
+    filled, later sources winning, from CarrierZone pincode lists (single
+    pincodes, "110001-110099" ranges or prefixes such as "11"), the
+    carriers' bulk pincode downloads and PincodeRule rows in priority order.
+    A carrier with a download is authoritative: pincodes missing from it
+    are not serviceable; for the others a missing pincode is unknown.
+
+    refresh_serviceability_task stores the downloads as CarrierPincodeList
+    rows. At most every ``CHECK_INTERVAL`` seconds each process reads a
+    version of the carrier, zone, rule and download tables from the
+    database and rebuilds when it has moved; the signals in
+    logistics.signals make the saving process check straight away.
+    ``check`` falls back to a live adapter call on a miss; those answers are
+    kept in the (per process) cache for ``LIVE_TTL`` seconds.
+    """
+
+    LIVE_KEY = 'logistics:serviceability:live:%s:%s'
+    CHECK_INTERVAL = 60
+    LIVE_TTL = 24 * 60 * 60
+    NEGATIVE_TTL = 15 * 60
+
+    FIRST = 100000
+    SIZE = 900000
+    KNOWN, PREPAID, COD = 1, 2, 4
+
+    _lock = threading.Lock()
+    _matrix = None  # (version, {carrier pk: bytearray}, authoritative carrier pks)
+    _checked_at = 0
+
+    @classmethod
+    def slot(cls, pincode):
+        pincode = str(pincode).strip() if pincode is not None else ''
+        if len(pincode) != 6 or not pincode.isdigit() or pincode[0] == '0':
+            return None
+        return int(pincode) - cls.FIRST
+
+    @classmethod
+    def encode(cls, prepaid, cod, delivery_days=None):
+        try:
+            days = min(max(int(delivery_days or 0), 0), 31)
+        except (TypeError, ValueError):
+            days = 0
+        return cls.KNOWN | (cls.PREPAID if prepaid else 0) | (cls.COD if cod else 0) | days << 3
+
+    @classmethod
+    def zone_ranges(cls, entries):
+        """(first slot, last slot) pairs for CarrierZone.pincodes entries; malformed ones are skipped."""
+        for entry in entries if isinstance(entries, list) else [entries]:
+            entry = str(entry).strip()
+            first, _, last = entry.partition('-')
+            first, last = first.strip(), (last.strip() or first.strip())
+            if not (first.isdigit() and last.isdigit()) or len(first) != len(last) or not 1 <= len(first) <= 6:
+                continue
+            # Shorter entries are prefixes: "11" covers 110000-119999
+            padding = 6 - len(first)
+            low = max(int(first) * 10 ** padding, cls.FIRST)
+            high = min((int(last) + 1) * 10 ** padding - 1, cls.FIRST + cls.SIZE - 1)
+            if low <= high:
+                yield low - cls.FIRST, high - cls.FIRST
+
+    @classmethod
+    def build(cls, version=None):
+        from .models import CarrierPincodeList, CarrierZone, PincodeRule
+
+        carriers = {
+            str(pk): (prepaid, cod)
+            for pk, prepaid, cod in Carrier.objects.filter(is_active=True).values_list('pk', 'supports_prepaid', 'supports_cod')
+        }
+        rows = {pk: bytearray(cls.SIZE) for pk in carriers}
+
+        zones = CarrierZone.objects.filter(is_active=True, carrier__is_active=True).values_list('carrier_id', 'pincodes')
+        for carrier_pk, entries in zones.iterator():
+            carrier_pk = str(carrier_pk)
+            value = cls.encode(*carriers[carrier_pk])
+            row = rows[carrier_pk]
+            for low, high in cls.zone_ranges(entries):
+                row[low:high + 1] = bytes([value]) * (high - low + 1)
+
+        authoritative = set()
+        for carrier_pk, download in CarrierPincodeList.objects.filter(carrier__is_active=True, is_active=True).values_list('carrier_id', 'data').iterator():
+            row = rows.get(str(carrier_pk))
+            download = zlib.decompress(download)
+            if row is not None and len(download) == cls.SIZE:
+                # The carrier's own list replaces its zones
+                row[:] = download
+                authoritative.add(str(carrier_pk))
+
+        rules = (
+            PincodeRule.objects.filter(is_active=True, carrier__is_active=True)
+            .values_list('carrier_id', 'pincode', 'supports_prepaid', 'supports_cod', 'delivery_days')
+            .order_by('priority')
+        )
+        for carrier_pk, pincode, prepaid, cod, days in rules.iterator(chunk_size=5000):
+            slot = cls.slot(pincode)
+            if slot is not None:
+                rows[str(carrier_pk)][slot] = cls.encode(prepaid, cod, days)
+        return version, rows, authoritative
+
+    @staticmethod
+    def _version():
+        from .models import CarrierPincodeList, CarrierZone, PincodeRule
+
+        return (
+            data_version(Carrier.objects.all(), Q(is_active=True)),
+            data_version(CarrierZone.objects.all(), Q(is_active=True)),
+            data_version(PincodeRule.objects.all(), Q(is_active=True)),
+            data_version(CarrierPincodeList.objects.all()),
+        )
+
+    @classmethod
+    def invalidate(cls):
+        # This process checks the version on its next lookup without waiting for CHECK_INTERVAL
+        cls._checked_at = 0
+
+    @classmethod
+    def get_matrix(cls):
+        matrix = cls._matrix
+        if matrix is not None and time.monotonic() - cls._checked_at < cls.CHECK_INTERVAL:
+            return matrix
+        version = cls._version()
+        if matrix is None or matrix[0] != version:
+            with cls._lock:
+                matrix = cls._matrix
+                if matrix is None or matrix[0] != version:
+                    matrix = cls._matrix = cls.build(version)
+        cls._checked_at = time.monotonic()
+        return matrix
+
+    @classmethod
+    def lookup(cls, carrier, pincode):
+        """
+        Stored serviceability of ``pincode`` for ``carrier``.
+
+        Returns:
+            dict with serviceable, prepaid_available, cod_available and
+            delivery_days, or None when nothing is known
+        """
+        slot = cls.slot(pincode)
+        if slot is None:
+            return None
+        version, rows, authoritative = cls.get_matrix()
+        carrier_pk = str(carrier.pk)
+        row = rows.get(carrier_pk)
+        value = row[slot] if row is not None else 0
+        if not value & cls.KNOWN:
+            if carrier_pk not in authoritative:
+                return None
+            return {'serviceable': False, 'prepaid_available': False, 'cod_available': False, 'delivery_days': None}
+        prepaid, cod = bool(value & cls.PREPAID), bool(value & cls.COD)
+        return {
+            'serviceable': prepaid or cod,
+            'prepaid_available': prepaid,
+            'cod_available': cod,
+            'delivery_days': value >> 3 or None,
+        }
+
+    @classmethod
+    def serves(cls, carrier, pincode, is_cod=False):
+        """True / False from the matrix or a cached live check, None when neither knows."""
+        info = cls.lookup(carrier, pincode)
+        if info is None:
+            info = cache.get(cls.LIVE_KEY % (carrier.pk, pincode))
+        if info is None:
+            return None
+        return bool(info['cod_available'] if is_cod else info['prepaid_available'])
+
+    @classmethod
+    def check(cls, carrier, pincode, is_cod=False, pickup_pincode=None):
+        """
+        Serviceability with a live ``check_serviceability`` call on a miss.
+
+        Returns:
+            the adapter's result dict plus ``source`` ('matrix', 'cache' or 'api')
+        """
+        info = cls.lookup(carrier, pincode)
+        if info is not None:
+            return {**info, 'message': 'From serviceability matrix', 'source': 'matrix'}
+        key = cls.LIVE_KEY % (carrier.pk, pincode)
+        info = cache.get(key)
+        if info is not None:
+            return {**info, 'source': 'cache'}
+
+        from .courier_apis import CourierAPIRegistry
+
+        if pickup_pincode is None:
+            pickup_pincode = ShipmentAllocationService.pickup_details().get('pickup_pincode', '')
+        info = CourierAPIRegistry.get_api(carrier).check_serviceability(pickup_pincode, pincode, is_cod)
+        # API errors come back as "not serviceable", so negative answers expire sooner
+        cache.set(key, info, getattr(settings, 'SERVICEABILITY_LIVE_TTL', cls.LIVE_TTL) if info.get('serviceable') else cls.NEGATIVE_TTL)
+        return {**info, 'source': 'api'}
+
+    @classmethod
+    def refresh(cls):
+        """
+        Download the full pincode lists of carriers whose adapter offers one and rebuild.
+
+        Returns:
+            dict of carrier code -> pincodes downloaded (None where the
+            carrier has no bulk list or the download failed)
+        """
+        from .courier_apis import CourierAPIRegistry
+        from .models import CarrierPincodeList
+
+        summary = {}
+        for carrier in Carrier.objects.filter(is_active=True, status='active'):
+            try:
+                pincodes = CourierAPIRegistry.get_api(carrier).get_serviceable_pincodes()
+            except Exception as e:
+                logger.error(f"Serviceability download failed for {carrier.code}: {e}")
+                pincodes = None
+            summary[carrier.code] = None
+            if pincodes is None:
+                continue
+            row = bytearray(cls.SIZE)
+            for pincode, prepaid, cod, days in pincodes:
+                slot = cls.slot(pincode)
+                if slot is not None:
+                    row[slot] = cls.encode(prepaid, cod, days)
+            CarrierPincodeList.objects.update_or_create(
+                carrier=carrier, defaults={'data': zlib.compress(bytes(row)), 'pincode_count': len(pincodes), 'is_active': True}
+            )
+            summary[carrier.code] = len(pincodes)
+        cls.invalidate()
+        return summary
+
+
+class ShipmentAllocationService:
+    """
+    Books AWBs for orders and keeps the resulting shipments up to date.
+
+    Orders are allocated in one pass through the ShippingRuleEngine, grouped
+    by carrier and booked through the CourierAPIRegistry adapters on a
+    bounded thread pool. Each carrier gets at most ``carrier_concurrency``
+    bookings in flight (``max_concurrency`` in the credential's
+    additional_config overrides it), so one slow carrier cannot take every
+    worker. A carrier whose circuit breaker is open, or which the
+    ServiceabilityMatrix says does not serve the pincode (when the shipping
+    settings ask for serviceability checks), is treated as unavailable and
+    its orders go to the rule's fallback carrier. Each carrier's shipments
+    are written with one bulk_create as soon as its bookings are back.
+    """
+
+    # Orders holding one of these are not booked again unless forced
+    ACTIVE_STATUSES = ('manifested', 'picked_up', 'in_transit', 'out_for_delivery', 'delivered')
+    BATCH_SIZE = 500
+
+    # Carrier status text (lowercased) -> Shipment status, for what is not already a status code
+    STATUS_ALIASES = {
+        'booked': 'manifested',
+        'pickup scheduled': 'manifested',
+        'not picked': 'manifested',
+        'picked': 'picked_up',
+        'pending': 'in_transit',
+        'dispatched': 'out_for_delivery',
+        'out for delivery': 'out_for_delivery',
+        'rto': 'rto_initiated',
+        'returned': 'rto_delivered',
+        'rto delivered': 'rto_delivered',
+        'canceled': 'cancelled',
+    }
+
+    def __init__(self, max_workers=None, carrier_concurrency=None):
+        self.max_workers = max_workers or getattr(settings, 'SHIPMENT_BOOKING_WORKERS', 16)
+        self.carrier_concurrency = carrier_concurrency or getattr(settings, 'SHIPMENT_CARRIER_CONCURRENCY', 4)
+        self.check_serviceability = False
+        # Single bookings may ask the carrier about pincodes the matrix does not know
+        self.live_serviceability = False
+        self._apis = {}
+
+    # Helpers ----------------------------------------------------------------
+
+    def get_api(self, carrier):
+        """Adapter for ``carrier``, created (and its credentials read) once per service."""
+        from .courier_apis import CourierAPIRegistry
+
+        api = self._apis.get(carrier.pk)
+        if api is None:
+            api = self._apis[carrier.pk] = CourierAPIRegistry.get_api(carrier)
+        return api
+
+    def concurrency_for(self, api):
+        config = getattr(api.credentials, 'additional_config', None) or {}
+        try:
+            return max(1, int(config.get('max_concurrency', self.carrier_concurrency)))
+        except (TypeError, ValueError):
+            return self.carrier_concurrency
+
+    @staticmethod
+    def pickup_details():
+        """Pickup fields for the adapters from the primary warehouse."""
+        from inventory.models import Warehouse
+
+        warehouse = Warehouse.objects.filter(is_active=True).order_by('-is_primary', 'name').first()
+        if warehouse is None:
+            return {}
+        return {
+            'pickup_name': warehouse.name,
+            'pickup_address': warehouse.address,
+            'pickup_city': warehouse.city,
+            'pickup_state': warehouse.state,
+            'pickup_pincode': warehouse.pincode,
+            'pickup_phone': warehouse.contact_phone or '',
+        }
+
+    def is_available(self, carrier, is_cod, pincode=None):
+        from .courier_apis import CircuitBreaker
+
+        if carrier is None or carrier.status != 'active' or not carrier.is_active:
+            return False
+        if CircuitBreaker.is_open(carrier):
+            return False
+        if not (carrier.supports_cod if is_cod else carrier.supports_prepaid):
+            return False
+        if self.check_serviceability and pincode:
+            if self.live_serviceability:
+                try:
+                    info = ServiceabilityMatrix.check(carrier, pincode, is_cod)
+                    return bool(info.get('cod_available' if is_cod else 'prepaid_available'))
+                except Exception as e:
+                    logger.warning(f"Live serviceability check failed for {carrier.code} {pincode}: {e}")
+            # Only stored answers here; a pincode nobody knows about is left to the booking call
+            return ServiceabilityMatrix.serves(carrier, pincode, is_cod) is not False
+        return True
+
+    @staticmethod
+    def order_data(order, pickup, weight):
+        """Adapter payload for an order loaded with ``with_amounts``."""
+        is_cod = 'COD' in str(order.channel.channel_type)
+        return {
+            'order_no': order.order_no,
+            'order_date': timezone.localtime(order.created).strftime('%Y-%m-%d %H:%M:%S') if order.created else '',
+            'customer_name': order.name or order.customer.customer_name,
+            'address': order.address or order.customer.address,
+            'pincode': order.pincode or order.customer.pincode,
+            'city': order.city or order.customer.city,
+            'state': order.state or order.customer.state,
+            'phone': order.phone or order.mobile or order.customer.phone_no,
+            'is_cod': is_cod,
+            'cod_amount': order.get_shipping_cod_amount() if is_cod else 0,
+            'total_amount': order.get_shipping_amount(),
+            'product_description': order.get_products_desc() or 'Products',
+            'quantity': order.get_total_quantity() or 1,
+            'weight': float(weight),
+            **pickup,
+        }
+
+    @classmethod
+    def normalize_status(cls, status):
+        """Shipment status for a carrier's status text, or None if it is not recognised."""
+        if not status:
+            return None
+        text = ' '.join(str(status).lower().replace('_', ' ').replace('-', ' ').split())
+        code = text.replace(' ', '_')
+        if code in dict(Shipment.SHIPMENT_STATUS):
+            return code
+        return cls.STATUS_ALIASES.get(text)
+
+    @staticmethod
+    def parse_event_time(value):
+        from django.utils.dateparse import parse_datetime
+
+        moment = parse_datetime(value) if isinstance(value, str) and value else None
+        if moment is None:
+            return None
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    # Booking ----------------------------------------------------------------
+
+    def plan(self, orders, carrier=None, method='manual'):
+        """
+        Carrier for each order.
+
+        Returns:
+            list of (order, carrier, rule, assignment method, error); carrier
+            is None when there is nothing to book with
+        """
+        if carrier is not None:
+            allocations = {order.pk: (carrier, None) for order in orders}
+        else:
+            allocations = ShippingRuleEngine.allocate_many(orders)
+
+        plan = []
+        for order in orders:
+            chosen, rule = allocations[order.pk]
+            is_cod = 'COD' in str(order.channel.channel_type)
+            pincode = order.pincode or order.customer.pincode
+            if not self.is_available(chosen, is_cod, pincode) and rule is not None and self.is_available(rule.fallback_carrier, is_cod, pincode):
+                chosen = rule.fallback_carrier
+            if chosen is None:
+                plan.append((order, None, rule, method, 'No carrier available for this order'))
+            elif not self.is_available(chosen, is_cod, pincode):
+                plan.append((order, None, rule, method, f'{chosen.name} cannot take {"COD" if is_cod else "prepaid"} orders to {pincode} right now'))
+            else:
+                plan.append((order, chosen, rule, 'manual' if carrier is not None else ('rule_based' if rule else method), None))
+        return plan
+
+    def book(self, jobs, on_carrier_done=None):
+        """
+        Call ``create_shipment`` for each (order, carrier, order data) job.
+
+        Jobs are submitted carrier by carrier in turn so that a carrier with
+        many orders does not queue ahead of the others. Once all of a
+        carrier's jobs are back, ``on_carrier_done`` is called (in this
+        thread) with their (position, result) pairs, so bookings can be
+        saved without waiting for slower carriers.
+
+        Returns:
+            list of adapter results, in job order
+        """
+        from django.db import connections
+
+        limits = {}
+        by_carrier = {}
+        for position, (order, carrier, data) in enumerate(jobs):
+            api = self.get_api(carrier)
+            if carrier.pk not in limits:
+                limits[carrier.pk] = threading.BoundedSemaphore(self.concurrency_for(api))
+            by_carrier.setdefault(carrier.pk, []).append((position, api, data))
+        pending = {carrier_pk: len(queue) for carrier_pk, queue in by_carrier.items()}
+        done = {carrier_pk: [] for carrier_pk in by_carrier}
+
+        def call(api, data, limit):
+            try:
+                with limit:
+                    return api.create_shipment(data)
+            except Exception as e:
+                return {'success': False, 'message': str(e)}
+            finally:
+                # Adapters log to the database from this worker thread
+                connections.close_all()
+
+        queues = list(by_carrier.items())
+        interleaved = []
+        while queues:
+            for carrier_pk, queue in queues:
+                interleaved.append((carrier_pk, queue.pop(0)))
+            queues = [(carrier_pk, queue) for carrier_pk, queue in queues if queue]
+
+        results = [None] * len(jobs)
+        workers = max(1, min(self.max_workers, len(jobs)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='awb-booking') as pool:
+            futures = {
+                pool.submit(call, api, data, limits[carrier_pk]): (carrier_pk, position)
+                for carrier_pk, (position, api, data) in interleaved
+            }
+            for future in as_completed(futures):
+                carrier_pk, position = futures[future]
+                results[position] = future.result()
+                done[carrier_pk].append((position, results[position]))
+                pending[carrier_pk] -= 1
+                if not pending[carrier_pk] and on_carrier_done:
+                    on_carrier_done(done[carrier_pk])
+        return results
+
+    def allocate(self, orders, carrier=None, user=None, force=False, method='manual'):
+        """
+        Allocate carriers to ``orders``, book their AWBs and save the shipments.
+
+        Orders that already have a tracking id (booked here or through the
+        old courier_partner flow) or an active shipment are skipped unless
+        ``force`` is set.
+
+        Returns:
+            list of (order, success, Shipment or error message)
+        """
+        outcomes = []
+        orders = list(orders)
+        for start in range(0, len(orders), self.BATCH_SIZE):
+            outcomes.extend(self._allocate_batch(orders[start:start + self.BATCH_SIZE], carrier, user, force, method))
+        return outcomes
+
+    @staticmethod
+    def unbooked(orders):
+        """``orders`` (a queryset) without a tracking id."""
+        return orders.filter(Q(tracking_id__isnull=True) | Q(tracking_id=''))
+
+    def _allocate_batch(self, orders, carrier, user, force, method):
+        pks = [order.pk for order in orders]
+        loaded = Order.objects.with_amounts().select_related('channel', 'customer').in_bulk(pks)
+        orders = [loaded[pk] for pk in pks if pk in loaded]
+        outcomes = {pk: (None, False, 'Order not found') for pk in pks if pk not in loaded}
+
+        if not force:
+            booked = set(
+                Shipment.objects.filter(order__in=orders, status__in=self.ACTIVE_STATUSES, is_active=True)
+                .values_list('order_id', flat=True)
+            )
+            for order in orders:
+                if order.pk in booked:
+                    outcomes[order.pk] = (order, False, 'Order already has an active shipment')
+                elif order.tracking_id:
+                    outcomes[order.pk] = (order, False, f'Order is already booked ({order.tracking_id})')
+            orders = [order for order in orders if order.pk not in outcomes]
+
+        shipping_settings = ShippingSettings.get_settings()
+        self.check_serviceability = shipping_settings.check_serviceability_before_allocation
+        pickup = self.pickup_details()
+        jobs, planned = [], []
+        for order, chosen, rule, assignment, error in self.plan(orders, carrier, method):
+            if error:
+                outcomes[order.pk] = (order, False, error)
+                continue
+            data = self.order_data(order, pickup, shipping_settings.default_weight_kg)
+            jobs.append((order, chosen, data))
+            planned.append((rule, assignment))
+
+        def save(jobs, planned):
+            return lambda done: outcomes.update(self.save_bookings(
+                [(jobs[position], planned[position], result) for position, result in done], user, shipping_settings.default_weight_kg
+            ))
+
+        results = self.book(jobs, save(jobs, planned)) if jobs else []
+
+        # Orders whose carrier's breaker opened during the run go once to their rule's fallback carrier
+        retry = [
+            position for position, ((order, chosen, data), (rule, assignment), result) in enumerate(zip(jobs, planned, results))
+            if not result.get('success') and rule is not None and rule.fallback_carrier_id not in (None, chosen.pk)
+            and not self.is_available(chosen, data['is_cod']) and self.is_available(rule.fallback_carrier, data['is_cod'], data['pincode'])
+        ]
+        if retry:
+            retry_jobs = [(jobs[position][0], planned[position][0].fallback_carrier, jobs[position][2]) for position in retry]
+            self.book(retry_jobs, save(retry_jobs, [planned[position] for position in retry]))
+        return [outcomes[pk] for pk in pks]
+
+    def save_bookings(self, bookings, user, weight):
+        """
+        Save the shipments of one carrier's (job, (rule, assignment), result)
+        bookings and mark their orders booked.
+
+        Rows go in with one bulk_create that skips conflicts, so an AWB that
+        clashes with an existing tracking number fails only its own order
+        (and is logged with the AWB) instead of rolling back the batch.
+
+        Returns:
+            dict of order pk -> (order, success, Shipment or error message)
+        """
+        outcomes = {}
+        awbs = [result.get('tracking_number') or result.get('awb_number') for job, plan, result in bookings if result.get('success')]
+        taken = set(Shipment.objects.filter(tracking_number__in=awbs).values_list('tracking_number', flat=True))
+        now = timezone.now()
+        shipments = []
+        for (order, chosen, data), (rule, assignment), result in bookings:
+            awb = result.get('awb_number')
+            tracking_number = result.get('tracking_number') or awb
+            if not result.get('success') or not tracking_number:
+                outcomes[order.pk] = (order, False, result.get('message') or 'Booking failed')
+                continue
+            if tracking_number in taken:
+                logger.error(f"{chosen.name} booked AWB {tracking_number} for order {order.order_no}, but the tracking number is already in use")
+                outcomes[order.pk] = (order, False, f'{chosen.name} booked AWB {tracking_number}, but that tracking number is already in use')
+                continue
+            taken.add(tracking_number)
+            raw = result.get('raw_response')
+            shipments.append(Shipment(
+                order=order,
+                carrier=chosen,
+                tracking_number=tracking_number,
+                awb_number=awb,
+                status='manifested',
+                manifest_date=now,
+                weight=weight,
+                is_cod=data['is_cod'],
+                cod_amount=data['cod_amount'] or 0,
+                pickup_address={key: value for key, value in data.items() if key.startswith('pickup_')},
+                delivery_address={key: data[key] for key in ('customer_name', 'address', 'city', 'state', 'pincode', 'phone')},
+                carrier_response=raw if isinstance(raw, dict) else {'text': str(raw or '')[:1000]},
+                label_url=result.get('label_url'),
+                assigned_by=user,
+                assignment_method=assignment,
+                rule_used=rule,
+                creator=user,
+            ))
+
+        with transaction.atomic():
+            Shipment.objects.bulk_create(shipments, ignore_conflicts=True)
+            # Rows lost to a concurrent booking of the same tracking number are not there
+            saved = set(Shipment.objects.filter(pk__in=[shipment.pk for shipment in shipments]).values_list('pk', flat=True))
+            booked_orders = []
+            for shipment in shipments:
+                order = shipment.order
+                if shipment.pk not in saved:
+                    logger.error(f"{shipment.carrier.name} booked AWB {shipment.tracking_number} for order {order.order_no}, but the tracking number is already in use")
+                    outcomes[order.pk] = (order, False, f'{shipment.carrier.name} booked AWB {shipment.tracking_number}, but that tracking number is already in use')
+                    continue
+                order.tracking_id = shipment.tracking_number
+                order.last_tracking_status = 'Booked'
+                order.booked_date = now
+                order.tracking_last_checked = now
+                booked_orders.append(order)
+                outcomes[order.pk] = (order, True, shipment)
+            Order.objects.bulk_update(booked_orders, ['tracking_id', 'last_tracking_status', 'booked_date', 'tracking_last_checked'])
+            # Stage moves in the database so a stage set meanwhile (e.g. Cancelled) is kept
+            Order.objects.filter(pk__in=[order.pk for order in booked_orders], stage='Pending').update(stage='Booked')
+        for order in booked_orders:
+            if order.stage == 'Pending':
+                order.stage = 'Booked'
+        return outcomes
+
+    def create_shipment(self, order, carrier=None, user=None, force=False):
+        """
+        Book one order. Pincodes missing from the serviceability matrix are
+        checked with the carrier (ServiceabilityMatrix.check) first.
+
+        Returns:
+            (True, Shipment) or (False, error message)
+        """
+        self.live_serviceability = True
+        try:
+            order, success, result = self.allocate([order], carrier=carrier, user=user, force=force)[0]
+        finally:
+            self.live_serviceability = False
+        return success, result
+
+    def bulk_allocate(self, orders, user=None, carrier=None):
+        """
+        Book every order in ``orders``.
+
+        Returns:
+            dict with success, total, success_count, failed_count and per
+            order results (order_id, order_no, success, awb and carrier or error)
+        """
+        results = []
+        for order, success, result in self.allocate(orders, carrier=carrier, user=user, method='bulk'):
+            row = {'order_id': str(order.pk) if order else None, 'order_no': order.order_no if order else None, 'success': success}
+            if success:
+                row.update(awb=result.awb_number, carrier=result.carrier.name)
+            else:
+                row['error'] = result
+            results.append(row)
+        success_count = sum(1 for row in results if row['success'])
+        return {
+            'success': True,
+            'total': len(results),
+            'success_count': success_count,
+            'failed_count': len(results) - success_count,
+            'results': results,
+        }
+
+    # After booking ----------------------------------------------------------
+
+    def apply_tracking(self, shipment, result):
+        """
+        Tracking events and status from a ``get_tracking_status`` result.
+
+        Returns:
+            (list of unsaved ShipmentTracking rows that are not stored yet,
+            list of changed Shipment fields); ``shipment`` is updated in place
+        """
+        known = getattr(shipment, '_known_events', None)
+        if known is None:
+            known = set(shipment.tracking_events.values_list('status', 'event_time'))
+        now = timezone.now()
+        events = []
+        for event in result.get('events') or []:
+            event_time = self.parse_event_time(event.get('timestamp')) or now
+            status = (event.get('status') or '')[:100]
+            if not status or (status, event_time) in known:
+                continue
+            known.add((status, event_time))
+            events.append(ShipmentTracking(
+                shipment=shipment,
+                status=status,
+                status_code=self.normalize_status(status),
+                status_description=(event.get('description') or '')[:500] or None,
+                location=(event.get('location') or '')[:200] or None,
+                event_time=event_time,
+                carrier_scan_time=self.parse_event_time(event.get('timestamp')),
+                raw_data=event,
+            ))
+
+        changed = []
+        status = self.normalize_status(result.get('status'))
+        if status and status != shipment.status:
+            shipment.status = status
+            changed.append('status')
+            if status == 'picked_up' and not shipment.pickup_date:
+                shipment.pickup_date = now
+                changed.append('pickup_date')
+            if status == 'delivered' and not shipment.actual_delivery_date:
+                shipment.actual_delivery_date = now
+                changed.append('actual_delivery_date')
+        return events, changed
+
+    def update_tracking(self, shipment):
+        """
+        Fetch the carrier's tracking for one shipment.
+
+        Returns:
+            (success, message)
+        """
+        if not shipment.awb_number and not shipment.tracking_number:
+            return False, 'Shipment has no AWB'
+        result = self.get_api(shipment.carrier).get_tracking_status(shipment.awb_number or shipment.tracking_number)
+        if not result.get('success'):
+            return False, result.get('message') or 'Tracking failed'
+
+        Shipment.objects.filter(pk=shipment.pk).update(tracking_checked_at=timezone.now())
+        tracked, changed, events = TrackingRefreshService(self).apply([shipment], {shipment.pk: result})
+        return True, f"{shipment.get_status_display()}: {events} new event{'s' if events != 1 else ''}"
+
+    def cancel_shipment(self, shipment):
+        """
+        Cancel a shipment with its carrier.
+
+        Returns:
+            (success, message)
+        """
+        if shipment.status in ('delivered', 'cancelled', 'rto_delivered'):
+            return False, f'Shipment is already {shipment.get_status_display().lower()}'
+        if shipment.awb_number or shipment.tracking_number:
+            result = self.get_api(shipment.carrier).cancel_shipment(shipment.awb_number or shipment.tracking_number)
+            if not result.get('success'):
+                return False, result.get('message') or 'Cancellation failed'
+        shipment.status = 'cancelled'
+        shipment.save(update_fields=['status', 'updated'])
+        return True, 'Shipment cancelled'
+
+
+class TrackingRefreshService:
+    """
+    Periodic tracking refresh for in-flight shipments.
+
+    How often a shipment is polled depends on its status (``INTERVALS``);
+    statuses without an interval, such as delivered, are never polled. A run
+    claims the due shipments by stamping ``tracking_checked_at`` (skipping
+    rows another worker has locked, where the database supports it), so
+    several workers can share the backlog. AWBs are tracked per carrier in
+    batches of the adapter's TRACKING_BATCH_SIZE on a bounded thread pool;
+    new ShipmentTracking rows are bulk created and changed shipments bulk
+    updated. Order stages are moved with filtered UPDATEs that leave
+    orders already in a final stage alone, whatever the loaded copy says.
+    """
+
+    INTERVALS = {
+        'out_for_delivery': timedelta(minutes=30),
+        'picked_up': timedelta(hours=2),
+        'in_transit': timedelta(hours=2),
+        'rto_initiated': timedelta(hours=4),
+        'rto_in_transit': timedelta(hours=4),
+        'manifested': timedelta(hours=6),
+        'pending': timedelta(hours=12),
+    }
+    BATCH_SIZE = 500
+
+    # Shipment status -> Order stage, for the statuses that settle an order
+    ORDER_STAGES = {
+        'delivered': 'Delivered',
+        'rto_delivered': 'Returned',
+    }
+    # Order stages tracking never moves an order out of
+    FINAL_STAGES = ('Delivered', 'Cancelled', 'Returned')
+
+    def __init__(self, allocation=None):
+        # Shares the allocation service's adapters, concurrency limits and status mapping
+        self.allocation = allocation or ShipmentAllocationService()
+
+    def due(self, now=None):
+        now = now or timezone.now()
+        condition = Q()
+        for status, interval in self.INTERVALS.items():
+            checked = Q(tracking_checked_at__lte=now - interval) | Q(tracking_checked_at__isnull=True, created__lte=now - interval)
+            condition |= Q(checked, status=status)
+        return Shipment.objects.filter(condition, is_active=True).exclude(tracking_number='')
+
+    def claim(self, limit):
+        """Stamp and return up to ``limit`` due shipments, oldest poll first."""
+        now = timezone.now()
+        with transaction.atomic():
+            pks = list(
+                self.due(now)
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by(F('tracking_checked_at').asc(nulls_first=True), 'created')
+                .values_list('pk', flat=True)[:limit]
+            )
+            Shipment.objects.filter(pk__in=pks).update(tracking_checked_at=now)
+        return list(Shipment.objects.filter(pk__in=pks).select_related('carrier', 'order'))
+
+    def fetch(self, shipments):
+        """
+        Tracking results for ``shipments``, one adapter call per carrier batch.
+
+        Returns:
+            dict of shipment pk -> get_tracking_status result
+        """
+        from django.db import connections
+
+        jobs, limits = [], {}
+        by_carrier = {}
+        for shipment in shipments:
+            by_carrier.setdefault(shipment.carrier_id, []).append(shipment)
+        for carrier_pk, group in by_carrier.items():
+            api = self.allocation.get_api(group[0].carrier)
+            limits[carrier_pk] = threading.BoundedSemaphore(self.allocation.concurrency_for(api))
+            size = max(1, getattr(api, 'TRACKING_BATCH_SIZE', 1))
+            for start in range(0, len(group), size):
+                jobs.append((carrier_pk, api, group[start:start + size]))
+
+        def call(api, group, limit):
+            awbs = {shipment.awb_number or shipment.tracking_number: shipment.pk for shipment in group}
+            try:
+                with limit:
+                    results = api.get_tracking_statuses(list(awbs))
+            except Exception as e:
+                results = {awb: {'success': False, 'message': str(e)} for awb in awbs}
+            finally:
+                connections.close_all()
+            return {pk: results.get(awb) or {'success': False} for awb, pk in awbs.items()}
+
+        results = {}
+        if not jobs:
+            return results
+        workers = max(1, min(self.allocation.max_workers, len(jobs)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tracking') as pool:
+            for future in as_completed([pool.submit(call, api, group, limits[carrier_pk]) for carrier_pk, api, group in jobs]):
+                results.update(future.result())
+        return results
+
+    def apply(self, shipments, results):
+        """
+        Store tracking results.
+
+        Returns:
+            (shipments tracked, shipments whose status changed, new events)
+        """
+        known = {}
+        for shipment_pk, status, event_time in ShipmentTracking.objects.filter(shipment__in=shipments).values_list('shipment_id', 'status', 'event_time'):
+            known.setdefault(shipment_pk, set()).add((status, event_time))
+
+        now = timezone.now()
+        events, changed_shipments, orders = [], [], []
+        settled = {}
+        tracked = 0
+        fields = {'status', 'updated'}
+        for shipment in shipments:
+            result = results.get(shipment.pk) or {}
+            if not result.get('success'):
+                continue
+            tracked += 1
+            shipment._known_events = known.get(shipment.pk, set())
+            new_events, changed = self.allocation.apply_tracking(shipment, result)
+            events.extend(new_events)
+            if changed:
+                shipment.updated = now
+                fields.update(changed)
+                changed_shipments.append(shipment)
+
+            order = shipment.order
+            order.last_tracking_status = (result.get('status') or order.last_tracking_status or '')[:100] or None
+            order.tracking_last_checked = now
+            orders.append(order)
+            stage = self.ORDER_STAGES.get(shipment.status)
+            if stage:
+                settled.setdefault(stage, {})[order.pk] = shipment.actual_delivery_date or now
+
+        with transaction.atomic():
+            ShipmentTracking.objects.bulk_create(events, batch_size=1000)
+            Shipment.objects.bulk_update(changed_shipments, sorted(fields), batch_size=500)
+            Order.objects.bulk_update(orders, ['last_tracking_status', 'tracking_last_checked'], batch_size=500)
+            for stage, dates in settled.items():
+                # Decided in the database, so a stage set since the orders were loaded (e.g. Cancelled) wins
+                changes = {'stage': stage}
+                if stage == 'Delivered':
+                    changes['delivered_date'] = Coalesce('delivered_date', Case(*[When(pk=pk, then=Value(date)) for pk, date in dates.items()]))
+                Order.objects.filter(pk__in=list(dates)).exclude(stage__in=self.FINAL_STAGES).update(**changes)
+        return tracked, len(changed_shipments), len(events)
+
+    def run(self, limit=None, seconds=None):
+        """
+        Refresh due shipments in batches until none are due, ``limit``
+        shipments were claimed or ``seconds`` have passed.
+
+        Returns:
+            dict with claimed, tracked, changed and events counts
+        """
+        started = time.monotonic()
+        totals = {'claimed': 0, 'tracked': 0, 'changed': 0, 'events': 0}
+        while limit is None or totals['claimed'] < limit:
+            if seconds is not None and time.monotonic() - started >= seconds:
+                break
+            size = self.BATCH_SIZE if limit is None else min(self.BATCH_SIZE, limit - totals['claimed'])
+            shipments = self.claim(size)
+            if not shipments:
+                break
+            tracked, changed, events = self.apply(shipments, self.fetch(shipments))
+            totals['claimed'] += len(shipments)
+            totals['tracked'] += tracked
+            totals['changed'] += changed
+            totals['events'] += events
+        return totals
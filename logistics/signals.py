@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Carrier, CarrierZone, PincodeRule, ShippingRule, ShippingSettings
+from .services import ServiceabilityMatrix, ShippingRuleEngine
+
+
+@receiver(post_save, sender=ShippingRule)
+@receiver(post_delete, sender=ShippingRule)
+@receiver(post_save, sender=Carrier)
+@receiver(post_delete, sender=Carrier)
+@receiver(post_save, sender=ShippingSettings)
+def invalidate_shipping_rules(sender, instance, **kwargs):
+    transaction.on_commit(ShippingRuleEngine.invalidate)
+
+
+@receiver(post_save, sender=PincodeRule)
+@receiver(post_delete, sender=PincodeRule)
+@receiver(post_save, sender=CarrierZone)
+@receiver(post_delete, sender=CarrierZone)
+@receiver(post_save, sender=Carrier)
+@receiver(post_delete, sender=Carrier)
+def invalidate_serviceability(sender, instance, **kwargs):
+    transaction.on_commit(ServiceabilityMatrix.invalidate)
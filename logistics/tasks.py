@@ -0,0 +1,39 @@
+from celery import shared_task
+
+
+@shared_task(ignore_result=True)
+def write_carrier_api_logs_task(entries):
+    """Write a batch of carrier API log rows queued by CarrierAPILogBuffer in 'celery' mode."""
+    from logistics.services import CarrierAPILogBuffer
+
+    CarrierAPILogBuffer.write(entries)
+
+
+@shared_task
+def refresh_serviceability_task():
+    """Re-download the carriers' bulk pincode lists and rebuild the serviceability matrix."""
+    from logistics.services import ServiceabilityMatrix
+
+    summary = ServiceabilityMatrix.refresh()
+    return ", ".join(f"{code}: {count if count is not None else 'no bulk list'}" for code, count in summary.items())
+
+
+@shared_task
+def refresh_tracking_task(limit=None, seconds=240):
+    """Poll the carriers for shipments that are due; schedule every few minutes, on as many workers as needed."""
+    from logistics.services import TrackingRefreshService
+
+    totals = TrackingRefreshService().run(limit=limit, seconds=seconds)
+    return f"Tracked {totals['tracked']} of {totals['claimed']} shipments, {totals['changed']} changed status, {totals['events']} new events"
+
+
+@shared_task
+def bulk_allocate_task(order_ids, user_id=None):
+    """Book AWBs for ``order_ids`` (queued by the bulk allocate view when there are too many to book in the request)."""
+    from accounts.models import User
+    from logistics.services import ShipmentAllocationService
+    from master.models import Order
+
+    user = User.objects.filter(pk=user_id).first() if user_id else None
+    results = ShipmentAllocationService().bulk_allocate(Order.objects.filter(pk__in=order_ids, is_active=True), user=user)
+    return f"Booked {results['success_count']} of {results['total']} orders"
@@ -1,3 +1,389 @@
+import os
+import time
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from logistics.courier_apis import CarrierSessions, CircuitBreaker, CircuitOpenError, MockCourierAPI
+from logistics.models import Carrier, CarrierAPILog, CarrierPincodeList, CarrierZone, Shipment, ShippingRule, ShippingSettings
+from logistics.services import (
+    CarrierAPILogBuffer, CompiledRuleSet, ServiceabilityMatrix, ShipmentAllocationService, ShippingRuleEngine, TrackingRefreshService, api_logs,
+)
+from logistics.tasks import bulk_allocate_task
+from master.models import Order
+from master.tests import MasterTestCase
+
+
+class CircuitBreakerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.carrier = Carrier.objects.create(name='Test Courier', code='test-courier')
+
+    def setUp(self):
+        CircuitBreaker._breakers.clear()
+        self.api = MockCourierAPI(self.carrier, None)
+        self.session = mock.Mock()
+        for patcher in (mock.patch.object(CarrierSessions, 'get', return_value=self.session), mock.patch.object(api_logs, 'mode', 'sync')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def breaker(self):
+        return CircuitBreaker.for_carrier(self.carrier)
+
+    def test_failures_open_the_breaker(self):
+        self.session.request.side_effect = requests.exceptions.ConnectionError('down')
+        breaker = self.breaker()
+
+        for _ in range(breaker.failure_threshold):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.api.make_request('POST', 'https://carrier.test/book')
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.api.make_request('POST', 'https://carrier.test/book')
+
+    def test_half_open_trial_that_raises_reopens_the_breaker(self):
+        breaker = self.breaker()
+        breaker.state, breaker.opened_at = CircuitBreaker.OPEN, 0
+        self.session.request.side_effect = ValueError('bad url')
+
+        with self.assertRaises(ValueError):
+            self.api.make_request('POST', 'https://carrier.test/book')
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_successful_half_open_trial_closes_the_breaker(self):
+        breaker = self.breaker()
+        breaker.state, breaker.opened_at = CircuitBreaker.OPEN, 0
+        self.session.request.return_value = mock.Mock(status_code=200, json=lambda: {})
+
+        self.api.make_request('POST', 'https://carrier.test/book')
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_success_from_before_the_breaker_opened_is_ignored(self):
+        breaker = self.breaker()
+        breaker.state, breaker.opened_at = CircuitBreaker.OPEN, time.monotonic()
+
+        breaker.record(True, 0.1)
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_calls_can_raise_their_own_slow_call_limit(self):
+        breaker = self.breaker()
+        self.session.request.return_value = mock.Mock(status_code=200, json=lambda: {})
+        breaker.failures = breaker.failure_threshold - 1
+
+        with mock.patch('logistics.courier_apis.time.time', side_effect=[0, breaker.slow_call_seconds + 50]):
+            self.api.make_request('GET', 'https://carrier.test/pincodes', timeout=120, slow_call_seconds=120)
+
+        self.assertEqual((breaker.state, breaker.failures), (CircuitBreaker.CLOSED, 0))
+
+        breaker.record(True, breaker.slow_call_seconds + 50)
+        self.assertEqual(breaker.failures, 1)
+
+
+    def test_only_read_only_calls_are_retried(self):
+        self.session.request.side_effect = requests.exceptions.ConnectionError('reset')
+
+        with mock.patch.object(self.api, 'backoff'), self.settings(COURIER_HTTP_RETRIES=2):
+            for method, log_type, calls in (('PUT', 'other', 1), ('DELETE', 'cancel', 1), ('GET', 'other', 3), ('POST', 'track', 3)):
+                self.session.request.reset_mock()
+                self.breaker().reset()
+                with self.assertRaises(requests.exceptions.ConnectionError):
+                    self.api.make_request(method, 'https://carrier.test/orders', log_type=log_type)
+                self.assertEqual(self.session.request.call_count, calls, method)
+
+
+class CarrierAPILogBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.carrier = Carrier.objects.create(name='Test Courier', code='test-courier')
+
+    def entry(self, is_success):
+        return dict(carrier=self.carrier, log_type='track', request_url='https://carrier.test/track', request_method='GET',
+                    request_headers={}, request_body={}, response_status=200 if is_success else 500, response_body={},
+                    response_time_ms=10, is_success=is_success)
+
+    def test_flush_writes_rows_and_counters_in_one_batch(self):
+        buffer = CarrierAPILogBuffer(mode='buffer')
+        # Claim the process so add() does not start the writer thread
+        buffer.pid = os.getpid()
+        for is_success in (True, True, False):
+            buffer.add(**self.entry(is_success))
+
+        with self.assertNumQueries(4):  # savepoint, INSERT, UPDATE, release
+            buffer.flush()
+
+        self.carrier.refresh_from_db()
+        self.assertEqual(CarrierAPILog.objects.filter(carrier=self.carrier).count(), 3)
+        self.assertEqual((self.carrier.total_api_calls, self.carrier.successful_api_calls, self.carrier.failed_api_calls), (3, 2, 1))
+        self.assertIsNotNone(self.carrier.last_api_check)
+
+
+class LogisticsTestCase(MasterTestCase):
+    """MasterTestCase plus a carrier and a helper for booked orders."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.carrier = Carrier.objects.create(name='Test Courier', code='test-courier')
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(api_logs, 'mode', 'sync')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def booked_order(self, phone_no='9000000001', status='in_transit', hours_ago=3):
+        order = self.quick_order([{'product_id': self.apple.pk, 'price': '100', 'qty': 1}], phone_no=phone_no)
+        awb = f'AWB{order.pk}'
+        Order.objects.filter(pk=order.pk).update(stage='In_transit', tracking_id=awb)
+        shipment = Shipment.objects.create(order=order, carrier=self.carrier, tracking_number=awb, awb_number=awb, status=status)
+        Shipment.objects.filter(pk=shipment.pk).update(created=timezone.now() - timedelta(hours=hours_ago))
+        return Shipment.objects.get(pk=shipment.pk)
+
+
+class TrackingRefreshServiceTests(LogisticsTestCase):
+    def loaded(self, shipment):
+        return list(Shipment.objects.filter(pk=shipment.pk).select_related('carrier', 'order'))
+
+    def delivered(self, shipment):
+        return {shipment.pk: {'success': True, 'status': 'Delivered', 'events': []}}
+
+    def test_claim_stamps_the_poll_time_not_updated(self):
+        shipment = self.booked_order()
+        service = TrackingRefreshService()
+
+        self.assertEqual([s.pk for s in service.claim(10)], [shipment.pk])
+
+        shipment.refresh_from_db()
+        self.assertIsNotNone(shipment.tracking_checked_at)
+        self.assertFalse(service.due().exists())
+        # Editing the shipment does not push its next poll back
+        Shipment.objects.filter(pk=shipment.pk).update(tracking_checked_at=timezone.now() - timedelta(hours=3))
+        shipment.refresh_from_db()
+        shipment.save()
+        self.assertTrue(service.due().exists())
+
+    def test_new_shipments_wait_for_their_first_interval(self):
+        self.booked_order(hours_ago=1)
+
+        self.assertFalse(TrackingRefreshService().due().exists())
+
+    def test_delivery_settles_the_order(self):
+        shipment = self.booked_order()
+        service = TrackingRefreshService()
+        shipments = self.loaded(shipment)
+
+        service.apply(shipments, self.delivered(shipment))
+
+        order = Order.objects.get(pk=shipment.order_id)
+        self.assertEqual(order.stage, 'Delivered')
+        self.assertIsNotNone(order.delivered_date)
+        self.assertEqual(order.last_tracking_status, 'Delivered')
+
+    def test_stage_changed_since_loading_is_kept(self):
+        shipment = self.booked_order()
+        service = TrackingRefreshService()
+        shipments = self.loaded(shipment)
+        Order.objects.filter(pk=shipment.order_id).update(stage='Cancelled')
+
+        service.apply(shipments, self.delivered(shipment))
+
+        order = Order.objects.get(pk=shipment.order_id)
+        self.assertEqual(order.stage, 'Cancelled')
+        self.assertIsNone(order.delivered_date)
+
+
+class ShipmentAllocationTests(LogisticsTestCase):
+    def setUp(self):
+        super().setUp()
+        shipping_settings = ShippingSettings.get_settings()
+        shipping_settings.primary_carrier = self.carrier
+        shipping_settings.save()
+
+    def order(self, phone_no, **fields):
+        order = self.quick_order([{'product_id': self.apple.pk, 'price': '100', 'qty': 1}], phone_no=phone_no)
+        if fields:
+            Order.objects.filter(pk=order.pk).update(**fields)
+        return Order.objects.get(pk=order.pk)
+
+    def booking(self, awb):
+        return {'success': True, 'awb_number': awb, 'tracking_number': awb, 'label_url': None, 'message': 'Booked', 'raw_response': {}}
+
+    def test_bulk_allocate_skips_orders_booked_through_courier_partner(self):
+        pending = self.order('9000000001')
+        legacy = self.order('9000000002', stage='Shipped', tracking_id='LEGACY1')
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('logistics:bulk_allocate'))
+
+        self.assertEqual(response.json()['success_count'], 1)
+        self.assertEqual(list(Shipment.objects.values_list('order_id', flat=True)), [pending.pk])
+        legacy.refresh_from_db()
+        self.assertEqual((legacy.stage, legacy.tracking_id), ('Shipped', 'LEGACY1'))
+
+    def test_allocate_books_a_tracked_order_only_when_forced(self):
+        legacy = self.order('9000000002', stage='Packed', tracking_id='LEGACY1')
+        service = ShipmentAllocationService()
+
+        order, success, error = service.allocate([legacy], carrier=self.carrier)[0]
+        self.assertFalse(success)
+        self.assertIn('LEGACY1', error)
+
+        order, success, shipment = service.allocate([legacy], carrier=self.carrier, force=True)[0]
+        self.assertTrue(success)
+
+    def test_conflicting_awb_fails_only_its_own_order(self):
+        first, second = self.order('9000000001'), self.order('9000000002')
+        Shipment.objects.create(order=first, carrier=self.carrier, tracking_number='DUP1', status='cancelled')
+
+        with mock.patch('logistics.courier_apis.MockCourierAPI.create_shipment', side_effect=[self.booking('DUP1'), self.booking('NEW1')]):
+            outcomes = {order.pk: (success, result) for order, success, result in ShipmentAllocationService(max_workers=1).allocate([first, second], carrier=self.carrier)}
+
+        self.assertEqual(sum(success for success, result in outcomes.values()), 1)
+        failed = [result for success, result in outcomes.values() if not success]
+        self.assertIn('DUP1', failed[0])
+        self.assertTrue(Shipment.objects.filter(tracking_number='NEW1').exists())
+
+    def test_each_carrier_is_saved_when_its_bookings_are_back(self):
+        other = Carrier.objects.create(name='Other Courier', code='other-courier')
+        first, second = self.order('9000000001'), self.order('9000000002')
+        service = ShipmentAllocationService()
+        plan = [(first, self.carrier, None, 'manual', None), (second, other, None, 'manual', None)]
+
+        with mock.patch.object(service, 'plan', return_value=plan), mock.patch.object(service, 'save_bookings', wraps=service.save_bookings) as save:
+            service.allocate([first, second])
+
+        self.assertEqual(save.call_count, 2)
+        self.assertEqual(Shipment.objects.count(), 2)
+
+    def test_large_bulk_allocation_goes_to_celery(self):
+        self.order('9000000001')
+        self.order('9000000002')
+        self.client.force_login(self.user)
+
+        with mock.patch.object(ShipmentAllocationService, 'BATCH_SIZE', 1), mock.patch.object(bulk_allocate_task, 'delay', return_value=mock.Mock(id='task')) as delay:
+            response = self.client.post(reverse('logistics:bulk_allocate'))
+
+        self.assertTrue(response.json()['queued'])
+        self.assertEqual(len(delay.call_args.args[0]), 2)
+        self.assertFalse(Shipment.objects.exists())
+
+
+class ShippingRuleEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.primary = Carrier.objects.create(name='Primary', code='primary')
+        cls.other = Carrier.objects.create(name='Other', code='other')
+        shipping_settings = ShippingSettings.get_settings()
+        shipping_settings.primary_carrier = cls.primary
+        shipping_settings.save()
+
+    def setUp(self):
+        ShippingRuleEngine._compiled = None
+
+    def rule(self, field, operator, value, priority=0, carrier=None):
+        return ShippingRule.objects.create(
+            name=f'{field} {operator} {value}', rule_type='zone', priority=priority, condition_field=field,
+            condition_operator=operator, condition_value=value, assigned_carrier=carrier or self.other,
+        )
+
+    def test_compiled_rules_match_like_evaluate(self):
+        rules = [
+            self.rule('state', 'equals', 'Kerala', 9),
+            self.rule('state', 'in_list', ['Goa', 'Kerala'], 8),
+            self.rule('total_amount', 'greater_than', 1000, 7),
+            self.rule('total_amount', 'less_than', 'abc', 6),
+            self.rule('city', 'contains', 'pur', 5),
+            self.rule('pincode', 'starts_with', '68', 4),
+            self.rule('channel', 'not_in_list', ['Swiggy'], 3),
+            self.rule('payment_type', 'not_equals', 'cod', 2),
+        ]
+        compiled = CompiledRuleSet(rules, self.primary)
+        orders = [
+            {'state': state, 'city': city, 'pincode': pincode, 'total_amount': amount, 'channel': channel, 'payment_type': payment}
+            for state in ('Kerala', 'Goa', 'Delhi')
+            for city, pincode in (('Jaipur', '302001'), ('Kochi', '682001'))
+            for amount in (500.0, 1500.0)
+            for channel, payment in (('Swiggy', 'cod'), ('WhatsApp', 'prepaid'))
+        ]
+
+        for order_data in orders:
+            # ShippingRule.evaluate raises on the unparsable operand; the compiled rule never matches instead
+            expected = next((rule for rule in rules if rule.condition_value != 'abc' and rule.evaluate(order_data)), None)
+            self.assertEqual(compiled.match(order_data), expected, order_data)
+
+    def test_changes_from_other_processes_are_picked_up(self):
+        rule = self.rule('state', 'equals', 'Kerala')
+        self.assertEqual(ShippingRuleEngine.get_rules().match({'state': 'Kerala'}), rule)
+
+        # No signal fires for a queryset update, as for a change saved by another process
+        ShippingRule.objects.filter(pk=rule.pk).update(is_enabled=False)
+        self.assertEqual(ShippingRuleEngine.get_rules().match({'state': 'Kerala'}), rule)
+        ShippingRuleEngine._checked_at = 0
+
+        self.assertIsNone(ShippingRuleEngine.get_rules().match({'state': 'Kerala'}))
+
+    def test_carrier_status_changes_count(self):
+        ShippingRuleEngine.get_rules()
+        version = ShippingRuleEngine._version()
+
+        Carrier.objects.filter(pk=self.other.pk).update(status='inactive')
+
+        self.assertNotEqual(ShippingRuleEngine._version(), version)
+
+
+class ServiceabilityMatrixTests(LogisticsTestCase):
+    def setUp(self):
+        super().setUp()
+        ServiceabilityMatrix._matrix = None
+
+    def test_zones_and_downloads(self):
+        other = Carrier.objects.create(name='Other Courier', code='other-courier', supports_cod=False)
+        CarrierZone.objects.create(carrier=other, zone_name='Chennai', zone_code='CHN', pincodes=['60', '110001-110005'])
+
+        self.assertTrue(ServiceabilityMatrix.serves(other, '600042'))
+        self.assertTrue(ServiceabilityMatrix.serves(other, '110005'))
+        self.assertFalse(ServiceabilityMatrix.serves(other, '600042', is_cod=True))
+        self.assertIsNone(ServiceabilityMatrix.serves(other, '110006'))
+
+    def test_downloads_are_stored_in_the_database(self):
+        with mock.patch('logistics.courier_apis.MockCourierAPI.get_serviceable_pincodes', return_value=[('600001', True, True, 3)]):
+            summary = ServiceabilityMatrix.refresh()
+
+        self.assertEqual(summary[self.carrier.code], 1)
+        self.assertEqual(CarrierPincodeList.objects.get(carrier=self.carrier).pincode_count, 1)
+        # A process that never ran the refresh, with an empty cache
+        ServiceabilityMatrix._matrix = None
+        cache.clear()
+        self.assertEqual(ServiceabilityMatrix.lookup(self.carrier, '600001')['delivery_days'], 3)
+        # The download is authoritative: everything else is not served
+        self.assertFalse(ServiceabilityMatrix.serves(self.carrier, '600002'))
+
+    def test_single_booking_checks_unknown_pincodes_with_the_carrier(self):
+        order = self.quick_order([{'product_id': self.apple.pk, 'price': '100', 'qty': 1}])
+        answer = {'serviceable': False, 'cod_available': False, 'prepaid_available': False, 'delivery_days': None, 'message': 'Not serviceable'}
+
+        with mock.patch('logistics.courier_apis.MockCourierAPI.check_serviceability', return_value=answer) as check:
+            success, error = ShipmentAllocationService().create_shipment(order, carrier=self.carrier)
+
+        self.assertFalse(success)
+        self.assertEqual(check.call_count, 1)
+        self.assertFalse(Shipment.objects.exists())
+
+    def test_bulk_booking_does_not_call_the_carrier_for_unknown_pincodes(self):
+        order = self.quick_order([{'product_id': self.apple.pk, 'price': '100', 'qty': 1}])
+
+        with mock.patch('logistics.courier_apis.MockCourierAPI.check_serviceability') as check:
+            outcomes = ShipmentAllocationService().allocate([order], carrier=self.carrier)
 
-# Create your tests here.
+        self.assertTrue(outcomes[0][1])
+        check.assert_not_called()
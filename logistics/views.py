@@ -477,45 +477,19 @@ def allocate_orders(request):
         if carrier_id:
             carrier = Carrier.objects.filter(pk=carrier_id, status='active').first()
         
-        results = []
+        orders = Order.objects.filter(pk__in=order_ids, is_active=True)
+        found = {str(pk) for pk in orders.values_list('pk', flat=True)}
+        results = service.bulk_allocate(orders, user=request.user, carrier=carrier)
         for order_id in order_ids:
-            try:
-                order = Order.objects.get(pk=order_id, is_active=True)
-                success, result = service.create_shipment(order, carrier=carrier, user=request.user)
-                
-                if success:
-                    results.append({
-                        'order_id': str(order_id),
-                        'success': True,
-                        'awb': result.awb_number,
-                        'carrier': result.carrier.name
-                    })
-                else:
-                    results.append({
-                        'order_id': str(order_id),
-                        'success': False,
-                        'error': result
-                    })
-            except Order.DoesNotExist:
-                results.append({
+            if str(order_id) not in found:
+                results['results'].append({
                     'order_id': str(order_id),
                     'success': False,
                     'error': 'Order not found'
                 })
-            except Exception as e:
-                results.append({
-                    'order_id': str(order_id),
-                    'success': False,
-                    'error': str(e)
-                })
-        
-        success_count = sum(1 for r in results if r['success'])
-        return JsonResponse({
-            'success': True,
-            'total': len(order_ids),
-            'success_count': success_count,
-            'results': results
-        })
+        results['total'] = len(order_ids)
+        results['failed_count'] = len(order_ids) - results['success_count']
+        return JsonResponse(results)
         
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
@@ -526,17 +500,26 @@ def allocate_orders(request):
 @login_required
 @require_POST
 def bulk_allocate(request):
-    """Bulk allocate carriers to all pending orders."""
+    """Bulk allocate carriers to all open orders that are not booked yet."""
     from .services import ShipmentAllocationService
+    from .tasks import bulk_allocate_task
     
     try:
-        # Get all orders without active shipments
-        orders = Order.objects.filter(is_active=True).exclude(
-            shipments__status__in=['manifested', 'picked_up', 'in_transit', 'out_for_delivery', 'delivered']
-        )[:50]  # Limit to 50 at a time
+        # Open orders with no tracking id (so none booked through courier_partner either) and no active shipment
+        orders = ShipmentAllocationService.unbooked(Order.objects.filter(is_active=True)).exclude(
+            stage__in=['Delivered', 'Cancelled', 'Returned']
+        ).exclude(
+            shipments__status__in=ShipmentAllocationService.ACTIVE_STATUSES
+        )
+        order_ids = list(orders.values_list('pk', flat=True))
+        
+        # More than one booking batch is left to a Celery worker
+        if len(order_ids) > ShipmentAllocationService.BATCH_SIZE:
+            result = bulk_allocate_task.delay(order_ids, request.user.pk)
+            return JsonResponse({'success': True, 'queued': True, 'task_id': result.id, 'total': len(order_ids)})
         
         service = ShipmentAllocationService()
-        results = service.bulk_allocate(orders, user=request.user)
+        results = service.bulk_allocate(Order.objects.filter(pk__in=order_ids), user=request.user)
         
         return JsonResponse(results)
         
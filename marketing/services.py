@@ -1,10 +1,17 @@
 import re
+import threading
+import time
 import uuid
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
 from django.utils import timezone
 from django.db.models import Sum, Count, Avg, F, Q, Min, Max
 from datetime import timedelta
 from decimal import Decimal
 
+from core.functions import data_version
 from master.models import Customer, Order
 from .models import (
     Lead, LeadActivity, WhatsAppProvider, WhatsAppTemplate,
@@ -13,6 +20,135 @@ from .models import (
 )
 
 
+PincodeInfo = namedtuple('PincodeInfo', ['pincode', 'state', 'district', 'city', 'tier'])
+
+
+class PincodeDirectory:
+    """
+    In-process copy of PincodeMaster for per-row location lookups.
+
+    The table is compiled into a sorted ``array`` of numeric pincodes and a
+    parallel array of indexes into a list of distinct (state, district, city,
+    tier) locations, so ~150k pincodes take a couple of MB and a lookup is a
+    binary search. Each process reads the table's row count and latest
+    ``updated`` at most every ``CHECK_INTERVAL`` seconds and rebuilds when
+    they have moved; the PincodeMaster signals (see marketing.signals) make
+    the saving process check straight away.
+    """
+
+    CHECK_INTERVAL = 60
+    TIERS = ('tier_1', 'tier_2', 'tier_3', 'tier_4')
+
+    _lock = threading.Lock()
+    _index = None  # (version, pincodes, location ids, locations, other pincodes)
+    _checked_at = 0
+
+    @staticmethod
+    def normalize(pincode):
+        return str(pincode).strip() if pincode is not None else ''
+
+    @classmethod
+    def tier_for(cls, city, state):
+        """City tier code, with the same rules as SegmentationService profiles."""
+        from segmentation.services import SegmentationService
+
+        city = (city or '').lower()
+        if city in SegmentationService.TIER_1_CITIES:
+            return 0
+        if city in SegmentationService.TIER_2_CITIES:
+            return 1
+        return 2 if state else 3
+
+    @classmethod
+    def build(cls, version=None):
+        location_ids = {}
+        locations = []
+        entries = []
+        others = {}
+        rows = PincodeMaster.objects.values_list('pincode', 'state', 'district', 'city').order_by('pincode')
+        for pincode, state, district, city in rows.iterator(chunk_size=5000):
+            pincode = cls.normalize(pincode)
+            location = (state, district, city)
+            location_id = location_ids.get(location)
+            if location_id is None:
+                location_id = location_ids[location] = len(locations)
+                locations.append((state, district, city, cls.tier_for(city or district, state)))
+            # Only canonical numbers fit the int array; anything else ("0123", "PIN1") is kept aside
+            if pincode.isdigit() and str(int(pincode)) == pincode and int(pincode) < 2 ** 32:
+                entries.append((int(pincode), location_id))
+            else:
+                others[pincode] = location_id
+        entries.sort()
+        pincodes = array('I', (pincode for pincode, location_id in entries))
+        ids = array('I', (location_id for pincode, location_id in entries))
+        return version, pincodes, ids, locations, others
+
+    @staticmethod
+    def _version():
+        return data_version(PincodeMaster.objects.all())
+
+    @classmethod
+    def invalidate(cls):
+        # This process checks the version on its next lookup without waiting for CHECK_INTERVAL
+        cls._checked_at = 0
+
+    @classmethod
+    def get_index(cls):
+        index = cls._index
+        if index is not None and time.monotonic() - cls._checked_at < cls.CHECK_INTERVAL:
+            return index
+        version = cls._version()
+        if index is None or index[0] != version:
+            with cls._lock:
+                index = cls._index
+                if index is None or index[0] != version:
+                    index = cls._index = cls.build(version)
+        cls._checked_at = time.monotonic()
+        return index
+
+    @classmethod
+    def _location_id(cls, index, pincode):
+        version, pincodes, ids, locations, others = index
+        if pincode.isdigit() and str(int(pincode)) == pincode:
+            number = int(pincode)
+            position = bisect_left(pincodes, number)
+            if position < len(pincodes) and pincodes[position] == number:
+                return ids[position]
+            return None
+        return others.get(pincode)
+
+    @classmethod
+    def lookup(cls, pincode):
+        """PincodeInfo for ``pincode``, or None if it is not in PincodeMaster."""
+        pincode = cls.normalize(pincode)
+        if not pincode:
+            return None
+        index = cls.get_index()
+        location_id = cls._location_id(index, pincode)
+        if location_id is None:
+            return None
+        state, district, city, tier = index[3][location_id]
+        return PincodeInfo(pincode, state, district, city, cls.TIERS[tier])
+
+    @classmethod
+    def lookup_many(cls, pincodes):
+        """
+        Resolve a batch of pincodes against one index snapshot.
+
+        Returns:
+            dict of normalized pincode -> PincodeInfo, for the pincodes found
+        """
+        index = cls.get_index()
+        locations = index[3]
+        found = {}
+        for pincode in {cls.normalize(pincode) for pincode in pincodes}:
+            location_id = cls._location_id(index, pincode) if pincode else None
+            if location_id is not None:
+                state, district, city, tier = locations[location_id]
+                found[pincode] = PincodeInfo(pincode, state, district, city, cls.TIERS[tier])
+        return found
+
+
 class LeadService:
     """Service for lead management, Google Contacts sync, and Shopify abandoned checkout."""
     
@@ -54,8 +190,10 @@ class LeadService:
         if not lead.pincode:
             lead.location_status = 'unknown'
             return lead
-        
-        pincode_data = PincodeMaster.objects.filter(pincode=lead.pincode).first()
+        return LeadService._apply_location(lead, PincodeDirectory.lookup(lead.pincode))
+    
+    @staticmethod
+    def _apply_location(lead, pincode_data):
         if pincode_data:
             lead.state = pincode_data.state
             lead.district = pincode_data.district
@@ -70,6 +208,36 @@ class LeadService:
         
         return lead
     
+    @staticmethod
+    def enrich_locations(leads):
+        """Enrich a batch of leads with one directory lookup; returns the leads (unsaved)."""
+        leads = list(leads)
+        locations = PincodeDirectory.lookup_many(lead.pincode for lead in leads if lead.pincode)
+        for lead in leads:
+            if not lead.pincode:
+                lead.location_status = 'unknown'
+            else:
+                LeadService._apply_location(lead, locations.get(PincodeDirectory.normalize(lead.pincode)))
+        return leads
+    
+    @staticmethod
+    def enrich_unknown_locations(leads=None, batch_size=2000):
+        """Re-enrich active leads (of ``leads``, all by default) with a pincode whose location is still unknown. Returns the number enriched."""
+        leads = (Lead.objects.all() if leads is None else leads).filter(is_active=True, location_status='unknown').exclude(
+            Q(pincode__isnull=True) | Q(pincode='')
+        ).order_by('pk')
+        enriched = 0
+        last_pk = None
+        while True:
+            batch = leads.filter(pk__gt=last_pk) if last_pk else leads
+            batch = list(batch[:batch_size])
+            if not batch:
+                return enriched
+            last_pk = batch[-1].pk
+            changed = [lead for lead in LeadService.enrich_locations(batch) if lead.location_status == 'enriched']
+            Lead.objects.bulk_update(changed, ['state', 'district', 'city', 'location_status'])
+            enriched += len(changed)
+    
     @staticmethod
     def find_existing_lead(phone=None, email=None, source_ref_id=None, lead_source=None):
         """Find existing lead by phone, email, or source reference."""
@@ -128,8 +296,28 @@ class LeadService:
         return customer, order, bool(customer or order)
     
     @staticmethod
-    def sync_google_contact(contact_data, config):
-        """Sync a Google contact to Lead (not Customer)."""
+    def sync_google_contacts(contacts, config):
+        """
+        Sync a batch of Google contacts; new leads get their location in one
+        enrich_unknown_locations pass at the end.
+
+        Returns:
+            dict of sync status ('created', 'updated', 'no_identity') -> count
+        """
+        counts = {}
+        created = []
+        for contact_data in contacts:
+            lead, status = LeadService.sync_google_contact(contact_data, config, enrich=False)
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'created':
+                created.append(lead.pk)
+        if created:
+            LeadService.enrich_unknown_locations(Lead.objects.filter(pk__in=created))
+        return counts
+    
+    @staticmethod
+    def sync_google_contact(contact_data, config, enrich=True):
+        """Sync a Google contact to Lead (not Customer); ``enrich=False`` leaves the location to the caller."""
         phone = contact_data.get('phone')
         email = contact_data.get('email')
         
@@ -182,8 +370,9 @@ class LeadService:
         )
         
         # Enrich location
-        lead = LeadService.enrich_location_from_pincode(lead)
-        lead.save()
+        if enrich:
+            lead = LeadService.enrich_location_from_pincode(lead)
+            lead.save()
         
         LeadActivity.objects.create(
             lead=lead,
@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import PincodeMaster
+from .services import PincodeDirectory
+
+
+@receiver(post_save, sender=PincodeMaster)
+@receiver(post_delete, sender=PincodeMaster)
+def invalidate_pincode_directory(sender, instance, **kwargs):
+    transaction.on_commit(PincodeDirectory.invalidate)
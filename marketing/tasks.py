@@ -0,0 +1,10 @@
+from celery import shared_task
+
+
+@shared_task
+def enrich_lead_locations_task():
+    """Fill state, district and city of leads whose pincode was not in PincodeMaster when they were synced."""
+    from marketing.services import LeadService
+
+    enriched = LeadService.enrich_unknown_locations()
+    return f"Enriched {enriched} leads"
@@ -1,3 +1,68 @@
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from marketing.models import Lead, PincodeMaster
+from marketing.services import LeadService, PincodeDirectory
+
+
+class PincodeDirectoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        PincodeMaster.objects.bulk_create([
+            PincodeMaster(pincode='600001', city='Chennai', district='Chennai', state='Tamil Nadu'),
+            PincodeMaster(pincode='110001', city='New Delhi', district='Central Delhi', state='Delhi'),
+            PincodeMaster(pincode='0123', city='', district='Test', state='Test State'),
+        ])
+
+    def setUp(self):
+        PincodeDirectory._index = None
+
+    def test_lookup(self):
+        self.assertEqual(PincodeDirectory.lookup(' 600001 ').city, 'Chennai')
+        self.assertEqual(PincodeDirectory.lookup('0123').district, 'Test')
+        self.assertIsNone(PincodeDirectory.lookup('123'))
+        self.assertIsNone(PincodeDirectory.lookup('999999'))
+        self.assertEqual(set(PincodeDirectory.lookup_many(['600001', '110001', '999999', None])), {'600001', '110001'})
+
+    def test_changes_from_other_processes_are_picked_up(self):
+        self.assertIsNone(PincodeDirectory.lookup('560001'))
+
+        # bulk_create sends no signals, like a change made by another process
+        PincodeMaster.objects.bulk_create([PincodeMaster(pincode='560001', city='Bengaluru', district='Bengaluru', state='Karnataka')])
+        self.assertIsNone(PincodeDirectory.lookup('560001'))
+        PincodeDirectory._checked_at = 0
+
+        self.assertEqual(PincodeDirectory.lookup('560001').state, 'Karnataka')
+
+
+class LeadSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        PincodeMaster.objects.create(pincode='600001', city='Chennai', district='Chennai', state='Tamil Nadu')
+
+    def setUp(self):
+        PincodeDirectory._index = None
+
+    def contact(self, i, pincode):
+        return {'phone': f'98400000{i:02d}', 'name': f'Contact {i}', 'pincode': pincode, 'resource_name': f'people/{i}'}
+
+    def test_synced_contacts_are_enriched_in_one_pass(self):
+        contacts = [self.contact(1, '600001'), self.contact(2, '600001'), self.contact(3, '999999'), {'name': 'No identity'}]
+
+        with mock.patch.object(LeadService, 'match_lead'), mock.patch.object(LeadService, 'enrich_location_from_pincode') as per_lead:
+            counts = LeadService.sync_google_contacts(contacts, None)
+
+        per_lead.assert_not_called()
+        self.assertEqual(counts, {'created': 3, 'no_identity': 1})
+        self.assertEqual(Lead.objects.filter(location_status='enriched', state='Tamil Nadu').count(), 2)
+        self.assertEqual(Lead.objects.get(pincode='999999').location_status, 'unknown')
+
+    def test_unknown_locations_are_filled_once_the_pincode_is_known(self):
+        with mock.patch.object(LeadService, 'match_lead'):
+            LeadService.sync_google_contacts([self.contact(1, '560001')], None)
+        with self.captureOnCommitCallbacks(execute=True):
+            PincodeMaster.objects.create(pincode='560001', city='Bengaluru', district='Bengaluru', state='Karnataka')
+
+        self.assertEqual(LeadService.enrich_unknown_locations(), 1)
+        self.assertEqual(Lead.objects.get().state, 'Karnataka')
@@ -408,15 +408,9 @@ def sync_google_leads(request):
         # Generate mock contacts and sync to Leads
         mock_contacts = MockGoogleContactsService._generate_mock_contacts(15)
         
-        created = 0
-        updated = 0
-        
-        for contact_data in mock_contacts:
-            lead, status = LeadService.sync_google_contact(contact_data, config)
-            if status == 'created':
-                created += 1
-            elif status == 'updated':
-                updated += 1
+        counts = LeadService.sync_google_contacts(mock_contacts, config)
+        created = counts.get('created', 0)
+        updated = counts.get('updated', 0)
         
         return JsonResponse({
             'success': True,
@@ -1,10 +1,12 @@
 from django.contrib import admin
 
 from core.base import BaseAdmin
+from .forms import OrderAdminForm
 from .models import (
     Account, Channel, Customer, Order, Product, ProductPrice, 
     CourierPartner, Vendor, Purchase, PurchaseItem, PostOrder,
-    OrderItem, OrderTrackingHistory, PincodeRuleLegacy
+    OrderItem, OrderTrackingHistory, PincodeRuleLegacy, OrderNumberSequence, ProductStock, OrderHourlyStat,
+    AccountLedger, AccountDailyBalance
 )
 # Register your models here.
 
@@ -21,9 +23,13 @@ class ProductAdmin(BaseAdmin):
     search_fields =("product_name",'product_code')
     list_display = ("id", "__str__", 'price', 'opning_stock', 'get_stock', 'is_hide')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('stock_ledger')
+
 
 @admin.register(Order)
 class OrderAdmin(BaseAdmin):
+    form = OrderAdminForm
     list_filter = ("channel",'customer','is_active', 'stage', 'courier_partner')
     autocomplete_fields =("customer", "courier_partner")
     search_fields = ('order_no', 'tracking_id', 'name', 'phone')
@@ -108,3 +114,34 @@ class PincodeRuleLegacyAdmin(admin.ModelAdmin):
     list_display = ('id', 'courier', 'pincode', 'cscrcd', 'priority')
     list_filter = ('courier',)
     search_fields = ('pincode',)
+
+
+@admin.register(OrderNumberSequence)
+class OrderNumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ('id', 'prefix', 'last_value', 'updated')
+    search_fields = ('prefix',)
+
+
+@admin.register(ProductStock)
+class ProductStockAdmin(admin.ModelAdmin):
+    list_display = ('product', 'quantity', 'updated')
+    search_fields = ('product__product_name', 'product__product_code')
+
+
+@admin.register(OrderHourlyStat)
+class OrderHourlyStatAdmin(admin.ModelAdmin):
+    list_display = ('business_date', 'hour', 'channel', 'account', 'order_count', 'total_amount', 'cod_charge')
+    list_filter = ('business_date', 'channel')
+
+
+@admin.register(AccountLedger)
+class AccountLedgerAdmin(admin.ModelAdmin):
+    list_display = ('account', 'total_income', 'business_date', 'today_income', 'updated')
+    search_fields = ('account__name', 'account__code')
+
+
+@admin.register(AccountDailyBalance)
+class AccountDailyBalanceAdmin(admin.ModelAdmin):
+    list_display = ('account', 'business_date', 'income', 'closing_balance')
+    list_filter = ('business_date',)
+    search_fields = ('account__name', 'account__code')
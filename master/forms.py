@@ -1,6 +1,7 @@
 from django import forms
 
 from accounts.models import User
+from channels_config.services import UTRRegistry
 from .models import Account, Channel, Customer, Order, OrderItem
 
 
@@ -28,12 +29,25 @@ class CustomerForm(forms.ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         utr = cleaned_data.get("utr")
-        if not self.instance.pk and utr:
-            if Order.objects.filter(utr=utr).exists():
+        if utr:
+            if UTRRegistry.exists(utr, exclude_order=self.instance if self.instance.pk else None):
                 raise forms.ValidationError("UTR Already Exist.")
         return cleaned_data
 
 
+class OrderAdminForm(forms.ModelForm):
+    class Meta:
+        model = Order
+        fields = "__all__"
+
+    def clean_utr(self):
+        # Checked here because the registry raises DuplicateUTR from post_save, after the row is written
+        utr = self.cleaned_data.get("utr")
+        if utr and UTRRegistry.exists(utr, exclude_order=self.instance if self.instance.pk else None):
+            raise forms.ValidationError("UTR Already Exist.")
+        return utr
+
+
 class OrderItemForm(forms.ModelForm):
     image = forms.FileField(label='Image', required=False)
     class Meta:
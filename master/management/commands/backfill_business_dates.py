@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from master.models import Order
+
+
+class Command(BaseCommand):
+    help = "Fill Order.business_date from the creation time (8 PM IST cutoff)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recompute every order, not only those without a business date.")
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if not options["all"]:
+            orders = orders.filter(business_date__isnull=True)
+        updated = orders.refresh_business_dates()
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} orders."))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from master.services import OrderImporter
+
+
+class Command(BaseCommand):
+    help = "Import orders from a CSV or XLSX file (see master.services.OrderImporter for the columns)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True, help="Username recorded as creator and default order_by")
+        parser.add_argument("--chunk-size", type=int, default=OrderImporter.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options["user"]).first()
+        if user is None:
+            raise CommandError(f"User '{options['user']}' not found")
+
+        started = time.monotonic()
+        importer = OrderImporter(user, chunk_size=options["chunk_size"])
+        with open(options["path"], "rb") as fileobj:
+            result = importer.run(OrderImporter.read_rows(fileobj, options["path"]))
+        elapsed = time.monotonic() - started
+
+        for error in result["errors"][:100]:
+            self.stdout.write(f"Row {error['row']} {error['order_ref']}: {error['error']}")
+        if len(result["errors"]) > 100:
+            self.stdout.write(f"... and {len(result['errors']) - 100} more")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result['orders']} orders ({result['items']} items, {result['customers']} new customers) "
+                f"from {result['rows']} rows in {elapsed:.1f}s; {len(result['errors'])} errors."
+            )
+        )
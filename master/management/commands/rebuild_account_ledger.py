@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from master.services import AccountLedgerService
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or verify) the per-account income ledger from the orders table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Only report accounts whose ledger differs from the orders")
+
+    def handle(self, *args, **options):
+        mismatches = AccountLedgerService.rebuild_all(verify_only=options["verify"])
+        for account_id, current, expected in mismatches[:50]:
+            self.stdout.write(f"Account {account_id}: ledger {current}, orders {expected}")
+        if len(mismatches) > 50:
+            self.stdout.write(f"... and {len(mismatches) - 50} more")
+
+        if options["verify"]:
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} accounts differ from the orders.")
+            self.stdout.write(self.style.SUCCESS("Account ledger matches the orders."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(mismatches)} ledger rows."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from master.models import Order
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized item totals (items_amount, items_quantity) of every order."
+
+    def handle(self, *args, **options):
+        updated = Order.objects.all().refresh_item_totals()
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} orders."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from master.services import OrderSearchService
+
+
+class Command(BaseCommand):
+    help = "Rebuild the order search tokens."
+
+    def handle(self, *args, **options):
+        indexed = OrderSearchService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} orders."))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from master.models import Order
+from master.services import OrderStatService
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly order rollup used by the dashboard from the orders table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Only rebuild the last N days")
+        parser.add_argument("--start", help="First business date to rebuild (YYYY-MM-DD)")
+        parser.add_argument("--end", help="Last business date to rebuild (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        start = parse_date(options["start"]) if options["start"] else None
+        end = parse_date(options["end"]) if options["end"] else None
+        if options["days"]:
+            start = Order.current_business_date() - timedelta(days=options["days"] - 1)
+        rows = OrderStatService.rebuild(start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} hourly rows."))
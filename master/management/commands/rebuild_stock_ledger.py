@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from master.services import StockLedgerService
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or verify) the per-product stock ledger from purchase and order item history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Only report products whose ledger differs from history")
+
+    def handle(self, *args, **options):
+        mismatches = StockLedgerService.rebuild_all(verify_only=options["verify"])
+        for product_id, current, expected in mismatches[:50]:
+            self.stdout.write(f"Product {product_id}: ledger {current}, history {expected}")
+        if len(mismatches) > 50:
+            self.stdout.write(f"... and {len(mismatches) - 50} more")
+
+        if options["verify"]:
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} products differ from history.")
+            self.stdout.write(self.style.SUCCESS("Stock ledger matches history."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(mismatches)} ledger rows."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from channels_config.services import UTRRegistry
+
+
+class Command(BaseCommand):
+    help = "Sync the UTR registry (UTRRecord) with the UTRs of active orders."
+
+    def handle(self, *args, **options):
+        created, removed, conflicts = UTRRegistry.rebuild()
+        for utr, order_ids in conflicts[:50]:
+            self.stdout.write(f"UTR {utr} is used by orders {', '.join(map(str, order_ids))}; kept on order {order_ids[0]}")
+        if len(conflicts) > 50:
+            self.stdout.write(f"... and {len(conflicts) - 50} more")
+        self.stdout.write(self.style.SUCCESS(f"Registered {created} UTRs, removed {removed} stale records, {len(conflicts)} duplicates."))
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from accounts.models import User
+from master.models import Account, Channel, Customer, Order, OrderNumberSequence
+from master.services import OrderNumberAllocator
+
+
+class Command(BaseCommand):
+    help = "Save orders from parallel workers and check that order numbers stay unique and gapless."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=16, help="Number of parallel threads")
+        parser.add_argument("--orders", type=int, default=500, help="Total number of orders to save")
+        parser.add_argument("--prefix", default="STRESS", help="Channel prefix used for the test orders")
+        parser.add_argument("--keep", action="store_true", help="Keep the test orders instead of deleting them")
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        user = User.objects.filter(is_superuser=True).first() or User.objects.first()
+        if not user:
+            raise CommandError("At least one user is required to own the test orders.")
+
+        channel, _ = Channel.objects.get_or_create(prefix=prefix, defaults={"channel_type": "Promo"})
+        account, _ = Account.objects.get_or_create(code=f"{prefix}-ACCOUNT", defaults={"name": f"{prefix} Account", "opening_balance": 0})
+        customer, _ = Customer.objects.get_or_create(
+            phone_no="0000000000",
+            customer_name=f"{prefix} Customer",
+            defaults={"pincode": "000000", "address": "-", "city": "-", "state": "-", "country": "India"},
+        )
+        start = OrderNumberAllocator.seed_value(prefix)
+
+        def save_order(index):
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(channel=channel, customer=customer, account=account, order_by=user, total_amount=index)
+                return order.order_no, None
+            except Exception as e:
+                return None, str(e)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            results = list(pool.map(save_order, range(options["orders"])))
+
+        order_nos = [order_no for order_no, error in results if order_no]
+        errors = [error for order_no, error in results if error]
+        numbers = sorted(OrderNumberAllocator.parse_number(order_no) for order_no in order_nos)
+        duplicates = len(numbers) - len(set(numbers))
+        gapless = numbers == list(range(start + 1, start + len(numbers) + 1))
+
+        self.stdout.write(f"Saved {len(order_nos)} orders with {options['workers']} workers on {connection.vendor}")
+        self.stdout.write(f"Failed saves: {len(errors)}")
+        for error in sorted(set(errors))[:5]:
+            self.stdout.write(f"  {error}")
+        self.stdout.write(f"Duplicate numbers: {duplicates}")
+        self.stdout.write(f"Gapless: {gapless}")
+
+        if not options["keep"]:
+            Order.objects.filter(channel=channel).delete()
+            Channel.objects.filter(pk=channel.pk).delete()
+            Account.objects.filter(pk=account.pk).delete()
+            Customer.objects.filter(pk=customer.pk).delete()
+            OrderNumberSequence.objects.filter(prefix=prefix).delete()
+
+        if duplicates:
+            raise CommandError("Duplicate order numbers were allocated.")
+        if errors:
+            raise CommandError("Some orders could not be saved.")
+        self.stdout.write(self.style.SUCCESS("Order numbers are unique."))
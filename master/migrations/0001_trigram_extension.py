@@ -0,0 +1,8 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """pg_trgm for the OrderSearchToken trigram index; a no-op on other databases."""
+
+    operations = [TrigramExtension()]
@@ -1,11 +1,16 @@
 import datetime
 from decimal import Decimal
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
-from django.db.models import Sum
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Concat, TruncDate
 from django.urls import reverse_lazy
+from django.utils import timezone
 from core.base import BaseModel
 from accounts.models import User
 from core.choices import MONTH_CHOICES, YEAR_CHOICES
+from core.functions import DecimalText, GroupConcat
 
 # Create your models here.
 
@@ -68,17 +73,64 @@ class Account(BaseModel):
     def get_orders(self):
         return Order.objects.filter(account=self,is_active=True)
     
+    def get_ledger(self):
+        """Running totals row; built from history the first time it is needed."""
+        try:
+            return self.ledger
+        except AccountLedger.DoesNotExist:
+            from master.services import AccountLedgerService
+            self.ledger = AccountLedgerService.rebuild_account(self.pk)
+            return self.ledger
+
     def get_balance(self):
-        return Decimal(self.opening_balance + self.get_total_incomes())
+        return Decimal(self.opening_balance + self.get_ledger().total_income)
     
     def get_today_orders(self):
-        data = (Order.objects.filter(account=self,is_active=True,created__date=today).aggregate(total=models.Sum('total_amount'))['total'] or 0)
-        return Decimal(data)
+        return Decimal(self.get_ledger().get_today_income())
     
     def get_opening(self):
         return self.get_balance()-self.get_today_orders()
 
 
+class AccountLedger(models.Model):
+    """Running order totals per account, kept current by master.signals."""
+    account = models.OneToOneField(Account, on_delete=models.CASCADE, primary_key=True, related_name='ledger')
+    total_income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    business_date = models.DateField()
+    today_income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Account Ledger"
+        verbose_name_plural = "Account Ledgers"
+
+    def __str__(self):
+        return f"{self.account}: {self.total_income}"
+
+    def get_today_income(self):
+        # The row still holds an earlier day until the first order of today is written
+        if self.business_date != Order.current_business_date():
+            return 0
+        return self.today_income
+
+
+class AccountDailyBalance(models.Model):
+    """Closing balance of an account at the end of a day (see master.tasks.close_account_day_task)."""
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    business_date = models.DateField(db_index=True)
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    closing_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Account Daily Balance"
+        verbose_name_plural = "Account Daily Balances"
+        unique_together = ("account", "business_date")
+        ordering = ["-business_date"]
+
+    def __str__(self):
+        return f"{self.account} {self.business_date}: {self.closing_balance}"
+
+
 class Channel(BaseModel):
     channel_type = models.CharField(max_length=100,choices=[("WhatsApp","WhatsApp"),("WhatsApp_COD","WhatsApp COD"),("Swiggy","Swiggy"),("Kumar","Kumar"),("Wholesale","Wholesale"),("Promo","Promo"),("Return_or_Replace","RETURN/REPLACE"),("Counter","Counter")],default="WhatsApp")
     prefix = models.CharField(max_length=100,unique = True)
@@ -121,7 +173,17 @@ class Product(BaseModel):
         return f'{self.product_name.upper()}-{self.size.upper()}'
     
     def get_stock(self):
-        """Calculate current stock from opening + purchases - sales."""
+        """Current stock: opening + purchases - sales, read from the stock ledger."""
+        opening = self.opning_stock or 0
+        try:
+            movement = self.stock_ledger.quantity
+        except ProductStock.DoesNotExist:
+            from master.services import StockLedgerService
+            movement = StockLedgerService.rebuild_product(self.pk)
+        return opening + movement
+
+    def get_stock_from_history(self):
+        """Recalculate stock from the full purchase and sales history."""
         opening = self.opning_stock or 0
 
         purchase_data = PurchaseItem.objects.filter(item=self).aggregate(total_purchased=Sum('quantity'))
@@ -160,6 +222,21 @@ class Product(BaseModel):
     def get_orders(self):
         return OrderItem.objects.filter(product=self).select_related('order')
 
+
+class ProductStock(models.Model):
+    """Purchased minus sold quantity per product, kept current by master.signals."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stock_ledger')
+    quantity = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Product Stock"
+        verbose_name_plural = "Product Stock"
+
+    def __str__(self):
+        return f"{self.product}: {self.quantity}"
+
+
 class ProductPrice(BaseModel):
     product = models.ForeignKey(Product,on_delete=models.CASCADE)
     channel = models.ForeignKey(Channel,on_delete=models.CASCADE)
@@ -294,15 +371,70 @@ ORDER_STATUS = (
 )
 
 
+class OrderQuerySet(models.QuerySet):
+    @staticmethod
+    def _item_total(expression, output_field):
+        items = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+        return Coalesce(Subquery(items.annotate(total=Sum(expression)).values("total")), Value(0), output_field=output_field)
+
+    def refresh_item_totals(self):
+        """Recompute the denormalized items_amount and items_quantity with one UPDATE."""
+        return self.update(
+            items_amount=self._item_total("amount", models.DecimalField(max_digits=12, decimal_places=2)),
+            items_quantity=self._item_total("quantity", models.IntegerField()),
+        )
+
+    def with_amounts(self):
+        """
+        Annotate item totals computed in SQL, which the Order money helpers use
+        instead of querying the items of each order:
+
+        amount_total (sum of item amounts), actual_total (list price x quantity),
+        quantity_total and products_desc ("2x T-Shirt (Rs500.00), ...").
+        """
+        total = self._item_total
+        items = OrderItem.objects.filter(order=OuterRef("pk")).order_by().values("order")
+        line_desc = Concat(
+            Cast("quantity", models.CharField()), Value("x "), "product__product_name", Value(" (Rs"), DecimalText("product__price"), Value(")"),
+            output_field=models.CharField(),
+        )
+        return self.annotate(
+            amount_total=total("amount", models.DecimalField(max_digits=12, decimal_places=2)),
+            actual_total=total(F("product__price") * F("quantity"), models.DecimalField(max_digits=12, decimal_places=2)),
+            quantity_total=total("quantity", models.IntegerField()),
+            products_desc=Coalesce(Subquery(items.annotate(desc=GroupConcat(line_desc)).values("desc")), Value("")),
+        )
+
+    def for_business_day(self, day=None):
+        """Orders of one business day, the current one by default."""
+        return self.filter(business_date=day or Order.current_business_date())
+
+    def for_business_range(self, start, end):
+        """Orders of the business days ``start`` to ``end``, both included."""
+        return self.filter(business_date__gte=start, business_date__lte=end)
+
+    def refresh_business_dates(self):
+        """Recompute business_date from created with one UPDATE."""
+        shifted = ExpressionWrapper(F("created") + Order.business_day_offset(), output_field=models.DateTimeField())
+        return self.update(business_date=TruncDate(shifted, tzinfo=timezone.get_current_timezone()))
+
+
 class Order(BaseModel):
     channel = models.ForeignKey(Channel,on_delete=models.CASCADE)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
-    utr = models.CharField(max_length=20, null=True, blank=True)
+    utr = models.CharField(max_length=20, null=True, blank=True, db_index=True)
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
     cod_charge = models.DecimalField(max_digits=10, decimal_places=2,default=0)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     order_no = models.CharField(max_length=20, null=True, blank=True,unique=True)
     order_by = models.ForeignKey(User, on_delete=models.CASCADE,related_name="order_by")
+    # Sent by the quick entry form so a double submit returns the first order
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+    # Sum of the item amounts and quantities, kept in sync by master.signals
+    items_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    items_quantity = models.PositiveIntegerField(default=0, editable=False)
+    # Reporting day: orders after the cutoff hour (8 PM IST) count towards the next day
+    business_date = models.DateField(null=True, blank=True, db_index=True, editable=False)
     
     # Stage and shipping fields (from original ZIP)
     stage = models.CharField(max_length=100, default="Pending", choices=ORDER_STATUS)
@@ -329,6 +461,8 @@ class Order(BaseModel):
     shipped_date = models.DateTimeField(null=True, blank=True)
     delivered_date = models.DateTimeField(null=True, blank=True)
 
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         if self.utr:
             return f'{self.customer.customer_name}-{self.utr}'
@@ -339,7 +473,32 @@ class Order(BaseModel):
         verbose_name = "Order"
         verbose_name_plural = "Orders"
         ordering = ["-created"]
+        indexes = [models.Index(fields=["-created", "-id"])]
+
+
+    @staticmethod
+    def business_day_cutoff():
+        """Local hour from which orders belong to the next business day."""
+        return getattr(settings, "BUSINESS_DAY_CUTOFF_HOUR", 20)
 
+    @classmethod
+    def business_day_offset(cls):
+        return datetime.timedelta(hours=24 - cls.business_day_cutoff())
+
+    @classmethod
+    def business_date_for(cls, moment):
+        """Business day of an aware datetime."""
+        return (timezone.localtime(moment) + cls.business_day_offset()).date()
+
+    @classmethod
+    def current_business_date(cls):
+        return cls.business_date_for(timezone.now())
+
+    @classmethod
+    def business_day_range(cls, day):
+        """(start, end) aware datetimes of business day ``day``; end is exclusive."""
+        start = timezone.make_aware(datetime.datetime.combine(day, datetime.time()) - cls.business_day_offset())
+        return start, start + datetime.timedelta(days=1)
 
     @staticmethod
     def get_list_url():
@@ -366,33 +525,48 @@ class Order(BaseModel):
         else:
             return self.customer.alternate_phone_no or ''
     
+    def _prefetched_items(self):
+        """Items from prefetch_related("orderitem_set") or None if they were not prefetched."""
+        return getattr(self, "_prefetched_objects_cache", {}).get("orderitem_set")
+
     def get_total_amount(self):
-        return sum([item.amount for item in self.orderitem_set.all()])
+        if hasattr(self, "amount_total"):
+            return self.amount_total
+        items = self._prefetched_items()
+        if items is not None:
+            return sum(item.amount for item in items)
+        return self.items_amount
+
+    def get_total_quantity(self):
+        if hasattr(self, "quantity_total"):
+            return self.quantity_total
+        items = self._prefetched_items()
+        if items is not None:
+            return sum(item.quantity for item in items)
+        return self.items_quantity
     
     def get_total_actual_amount(self):
-        total = 0
-        for item in self.orderitem_set.select_related("product"):
-            try:
-                total += item.product.price * item.quantity
-            except Exception:
-                total += 0
-        return total
+        """Items at the current product list price."""
+        if hasattr(self, "actual_total"):
+            return self.actual_total
+        items = self._prefetched_items()
+        if items is not None:
+            return sum(item.product.price * item.quantity for item in items)
+        total = self.orderitem_set.aggregate(total=Sum(F("product__price") * F("quantity"), output_field=models.DecimalField(max_digits=12, decimal_places=2)))["total"]
+        return total or 0
     
     def get_shipping_amount(self):
-        return sum([item.product.price * item.quantity for item in self.orderitem_set.all()])
+        return self.get_total_actual_amount()
     
     def get_shipping_cod_amount(self):
         return self.get_shipping_amount() + self.cod_charge
     
     def save(self, *args, **kwargs):
         if not self.order_no :
-            if Order.objects.filter(is_active=True).exists():
-                max_order_number = Order.objects.first().order_no
-                current_number = int(max_order_number.split("-EB")[1])
-                order_no = f"{self.channel.prefix}-EB{str(current_number + 1).zfill(4)}"
-            else:
-                order_no = f"{self.channel.prefix}-EB{str(1).zfill(4)}"
-            self.order_no = order_no
+            from master.services import OrderNumberAllocator
+            self.order_no = OrderNumberAllocator.next_order_no(self.channel.prefix)
+        if self.business_date is None:
+            self.business_date = self.business_date_for(self.created or timezone.now())
         super().save(*args, **kwargs)
     
     def get_stage_badge(self):
@@ -406,10 +580,15 @@ class Order(BaseModel):
         return stage_badge_colors.get(self.stage, "")
     
     def get_products_desc(self):
-        """Example output: '2x T-Shirt (Rs500), 1x Jeans (Rs1200)'"""
+        """Example output: '2x T-Shirt (Rs500.00), 1x Jeans (Rs1200.00)'"""
+        if hasattr(self, "products_desc"):
+            return self.products_desc
+        items = self._prefetched_items()
+        if items is None:
+            items = self.orderitem_set.select_related("product").order_by("pk")
         return ", ".join(
             f"{item.quantity}x {item.product.product_name} (Rs{item.product.price})"
-            for item in self.get_items()
+            for item in items
         )
     
     @property
@@ -465,6 +644,61 @@ class OrderTrackingHistory(models.Model):
         return f"{self.order.order_no} - {self.status} at {self.timestamp}"
 
 
+class OrderNumberSequence(models.Model):
+    """Last order number handed out per channel prefix (see master.services.OrderNumberAllocator)."""
+    prefix = models.CharField(max_length=100, unique=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Order Number Sequence"
+        verbose_name_plural = "Order Number Sequences"
+
+    def __str__(self):
+        return f"{self.prefix}: {self.last_value}"
+
+
+class OrderHourlyStat(models.Model):
+    """Active order totals per business date, local hour, channel and account (see master.services.OrderStatService)."""
+    business_date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    order_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cod_charge = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Order Hourly Stat"
+        verbose_name_plural = "Order Hourly Stats"
+        unique_together = ("business_date", "hour", "channel", "account")
+        indexes = [models.Index(fields=["business_date", "channel"])]
+
+    def __str__(self):
+        return f"{self.business_date} {self.hour:02d}:00 {self.channel}"
+
+
+class OrderSearchToken(models.Model):
+    """Normalized search terms of an order (see master.services.OrderSearchService)."""
+    KIND_CHOICES = (("phone", "Phone"), ("order_no", "Order No"), ("utr", "UTR"), ("pincode", "Pincode"), ("name", "Name"))
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="search_tokens")
+    token = models.CharField(max_length=100)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+
+    class Meta:
+        verbose_name = "Order Search Token"
+        verbose_name_plural = "Order Search Tokens"
+        # Prefix searches are range scans on (token, order)
+        indexes = [models.Index(fields=["token", "order"])]
+        if "postgresql" in settings.DATABASES["default"]["ENGINE"]:
+            # Substring searches; master/migrations/0001_trigram_extension.py installs pg_trgm first
+            indexes.append(GinIndex(fields=["token"], name="master_ordersearchtoken_token_trgm", opclasses=["gin_trgm_ops"]))
+
+    def __str__(self):
+        return f"{self.kind}: {self.token}"
+
+
 # =============================================================================
 # VENDOR & PURCHASE MODELS (from original ZIP)
 # =============================================================================
@@ -0,0 +1,1373 @@
+import csv
+import hashlib
+import io
+import json
+import re
+import threading
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from accounts.models import User
+from channels_config.services import DuplicateUTR, UTRRegistry
+
+from .models import (
+    Account,
+    AccountDailyBalance,
+    AccountLedger,
+    Channel,
+    Customer,
+    Order,
+    OrderHourlyStat,
+    OrderItem,
+    OrderNumberSequence,
+    OrderSearchToken,
+    Product,
+    ProductPrice,
+    ProductStock,
+    PurchaseItem,
+)
+
+
+class OrderNumberAllocator:
+    """
+    Allocates order numbers from a per-prefix counter row.
+
+    Numbers are handed out with a single atomic ``UPDATE`` on
+    ``OrderNumberSequence``, so concurrent inserts never read the same value
+    and a rolled back transaction gives its number back (gapless). The key is
+    the plain prefix string, which works for both ``Channel.prefix`` and
+    ``DynamicChannel.prefix``.
+
+    Setting ``ORDER_NUMBER_BLOCK_SIZE`` above 1 makes each worker process
+    reserve that many numbers at once and hand them out locally. This trades
+    gaplessness (unused numbers are lost when the process exits) for fewer
+    writes to the counter row.
+    """
+
+    _blocks = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def format_order_no(prefix, number):
+        return f"{prefix}-EB{str(number).zfill(4)}"
+
+    @staticmethod
+    def parse_number(order_no):
+        """Return the numeric part of an order number or None."""
+        try:
+            return int(order_no.rsplit("-EB", 1)[1])
+        except (AttributeError, IndexError, ValueError):
+            return None
+
+    @classmethod
+    def seed_value(cls, prefix):
+        """Highest number already used by orders with this prefix."""
+        order_nos = Order.objects.filter(order_no__startswith=f"{prefix}-EB").values_list("order_no", flat=True)
+        numbers = (cls.parse_number(order_no) for order_no in order_nos.iterator())
+        return max((n for n in numbers if n is not None), default=0)
+
+    @classmethod
+    def _create_sequence(cls, prefix):
+        try:
+            with transaction.atomic():
+                OrderNumberSequence.objects.create(prefix=prefix, last_value=cls.seed_value(prefix))
+        except IntegrityError:
+            # Another worker created the row first
+            pass
+
+    @staticmethod
+    def _supports_update_returning():
+        if connection.vendor == "postgresql":
+            return True
+        return connection.vendor == "sqlite" and connection.features.can_return_columns_from_insert
+
+    @classmethod
+    def _increment(cls, prefix, count):
+        """Bump the counter by ``count`` and return the new value, or None if the row is missing."""
+        if cls._supports_update_returning():
+            table = connection.ops.quote_name(OrderNumberSequence._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET last_value = last_value + %s, updated = %s WHERE prefix = %s RETURNING last_value",
+                    [count, timezone.now(), prefix],
+                )
+                row = cursor.fetchone()
+            return row[0] if row else None
+
+        if not OrderNumberSequence.objects.filter(prefix=prefix).update(last_value=F("last_value") + count, updated=timezone.now()):
+            return None
+        return OrderNumberSequence.objects.filter(prefix=prefix).values_list("last_value", flat=True).get()
+
+    @classmethod
+    def reserve(cls, prefix, count=1):
+        """
+        Reserve ``count`` consecutive numbers for a prefix.
+
+        The reservation joins the caller's transaction: if it rolls back, the
+        numbers are released again.
+
+        Returns:
+            range of reserved numbers
+        """
+        with transaction.atomic(savepoint=False):
+            last_value = cls._increment(prefix, count)
+            if last_value is None:
+                cls._create_sequence(prefix)
+                last_value = cls._increment(prefix, count)
+        return range(last_value - count + 1, last_value + 1)
+
+    @classmethod
+    def reserve_order_nos(cls, prefix, count):
+        """Reserve ``count`` formatted order numbers in one round-trip."""
+        return [cls.format_order_no(prefix, number) for number in cls.reserve(prefix, count)]
+
+    @classmethod
+    def _next_from_block(cls, prefix, block_size):
+        with cls._lock:
+            block = cls._blocks.get(prefix)
+            if block and block[0] <= block[1]:
+                number = block[0]
+                block[0] += 1
+                return number
+
+        numbers = cls.reserve(prefix, block_size)
+
+        def publish_block():
+            # Only hand out the rest of the block once the reservation is committed
+            with cls._lock:
+                cls._blocks[prefix] = [numbers[1], numbers[-1]]
+
+        if len(numbers) > 1:
+            transaction.on_commit(publish_block)
+        return numbers[0]
+
+    @classmethod
+    def next_order_no(cls, prefix):
+        """Return the next order number for a channel prefix."""
+        block_size = getattr(settings, "ORDER_NUMBER_BLOCK_SIZE", 1)
+        if block_size > 1:
+            number = cls._next_from_block(prefix, block_size)
+        else:
+            number = cls.reserve(prefix)[0]
+        return cls.format_order_no(prefix, number)
+
+    @classmethod
+    def reset_local_blocks(cls):
+        """Drop numbers reserved by this process (e.g. after a fork)."""
+        with cls._lock:
+            cls._blocks.clear()
+
+
+class StockLedgerService:
+    """
+    Maintains ProductStock, the purchased minus sold quantity per product.
+
+    Deltas are applied with ``F()`` updates inside the caller's transaction, so
+    the counter commits or rolls back together with the item write.
+    """
+
+    @staticmethod
+    def compute_movement(product_id):
+        """Purchased minus sold quantity for one product, from the full history."""
+        purchased = PurchaseItem.objects.filter(item_id=product_id).aggregate(total=Sum("quantity"))["total"] or 0
+        sold = OrderItem.objects.filter(product_id=product_id).aggregate(total=Sum("quantity"))["total"] or 0
+        return purchased - sold
+
+    @classmethod
+    def apply(cls, deltas):
+        """
+        Apply stock deltas.
+
+        Args:
+            deltas: dict of product id -> quantity change (purchases positive, sales negative)
+        """
+        deltas = {product_id: delta for product_id, delta in deltas.items() if product_id and delta}
+        if not deltas:
+            return
+        with transaction.atomic(savepoint=False):
+            # One UPDATE for all products, so the cost does not grow with the number of lines
+            change = Case(*[When(product_id=product_id, then=Value(delta)) for product_id, delta in sorted(deltas.items())], output_field=IntegerField())
+            updated = ProductStock.objects.filter(product_id__in=deltas).update(quantity=F("quantity") + change)
+            if updated == len(deltas):
+                return
+            existing = set(ProductStock.objects.filter(product_id__in=deltas).values_list("product_id", flat=True))
+            for product_id, delta in sorted(deltas.items()):
+                if product_id in existing:
+                    continue
+                # First movement for this product: seed the row from history, which already includes this write
+                try:
+                    with transaction.atomic():
+                        ProductStock.objects.create(product_id=product_id, quantity=cls.compute_movement(product_id))
+                except IntegrityError:
+                    ProductStock.objects.filter(product_id=product_id).update(quantity=F("quantity") + delta)
+
+    @staticmethod
+    def item_deltas(items, sign):
+        """Sum item quantities per product, e.g. for rows saved with bulk_create."""
+        deltas = defaultdict(int)
+        for product_id, quantity in items:
+            if product_id:
+                deltas[product_id] += sign * int(quantity or 0)
+        return dict(deltas)
+
+    @classmethod
+    def apply_order_items(cls, order_items):
+        cls.apply(cls.item_deltas(((item.product_id, item.quantity) for item in order_items), -1))
+
+    @classmethod
+    def apply_purchase_items(cls, purchase_items):
+        cls.apply(cls.item_deltas(((item.item_id, item.quantity) for item in purchase_items), 1))
+
+    @classmethod
+    def rebuild_product(cls, product_id):
+        """Recompute one product's ledger row from history and return its quantity."""
+        quantity = cls.compute_movement(product_id)
+        ProductStock.objects.update_or_create(product_id=product_id, defaults={"quantity": quantity})
+        return quantity
+
+    @staticmethod
+    def get_stock_map(products):
+        """Current stock for many products with a single ledger query."""
+        ledger = dict(ProductStock.objects.filter(product__in=products).values_list("product_id", "quantity"))
+        return {product.pk: (product.opning_stock or 0) + ledger.get(product.pk, 0) for product in products}
+
+    @staticmethod
+    def rebuild_all(verify_only=False):
+        """
+        Compare every ledger row with the purchase and sales history.
+
+        Args:
+            verify_only: only report differences instead of fixing them
+
+        Returns:
+            list of (product_id, ledger quantity or None, expected quantity)
+        """
+        purchased = dict(PurchaseItem.objects.filter(item__isnull=False).values("item").annotate(total=Sum("quantity")).values_list("item", "total"))
+        sold = dict(OrderItem.objects.values("product").annotate(total=Sum("quantity")).values_list("product", "total"))
+        ledger = dict(ProductStock.objects.values_list("product_id", "quantity"))
+
+        mismatches = []
+        for product_id in Product.objects.values_list("pk", flat=True).iterator():
+            expected = (purchased.get(product_id) or 0) - (sold.get(product_id) or 0)
+            if ledger.get(product_id) != expected:
+                mismatches.append((product_id, ledger.get(product_id), expected))
+
+        if not verify_only and mismatches:
+            with transaction.atomic():
+                to_create = [ProductStock(product_id=product_id, quantity=expected) for product_id, current, expected in mismatches if current is None]
+                ProductStock.objects.bulk_create(to_create, batch_size=1000)
+                for product_id, current, expected in mismatches:
+                    if current is not None:
+                        ProductStock.objects.filter(product_id=product_id).update(quantity=expected)
+        return mismatches
+
+
+class ChannelCounterService:
+    """
+    Order totals and today's counts per channel, from one grouped query.
+
+    Counts for the unfiltered order list are cached for ``CACHE_TTL`` seconds
+    and dropped whenever an order is created (see master.signals). Channels
+    configured through ``DynamicChannel`` are matched to orders by prefix and
+    reported under their code.
+    """
+
+    CACHE_KEY = "master:channel_counters"
+    CACHE_TTL = 30
+
+    @staticmethod
+    def compute(queryset=None):
+        """
+        Count orders per channel in a single GROUP BY pass.
+
+        Returns:
+            dict of key -> {'label', 'total', 'today'}, keyed by lowercase
+            channel type and by dynamic channel code
+        """
+        from core.feature_flags import is_dynamic_channels_enabled
+
+        if queryset is None:
+            queryset = Order.objects.filter(is_active=True)
+        today = Order.current_business_date()
+        rows = (
+            queryset.order_by()
+            .values("channel__channel_type", "channel__prefix")
+            .annotate(total=Count("id"), today=Count("id", filter=Q(business_date=today)))
+        )
+
+        counters = {}
+        by_prefix = {}
+        for row in rows:
+            channel_type = row["channel__channel_type"] or ""
+            counter = counters.setdefault(channel_type.lower(), {"label": channel_type, "total": 0, "today": 0})
+            counter["total"] += row["total"]
+            counter["today"] += row["today"]
+            by_prefix[row["channel__prefix"]] = (row["total"], row["today"])
+
+        if is_dynamic_channels_enabled():
+            from channels_config.models import DynamicChannel
+
+            for code, name, prefix in DynamicChannel.objects.filter(is_active=True).values_list("code", "name", "prefix"):
+                total, today_count = by_prefix.get(prefix, (0, 0))
+                counters.setdefault(code.lower(), {"label": name, "total": total, "today": today_count})
+        return counters
+
+    @classmethod
+    def get_counters(cls, queryset=None):
+        """Counters for ``queryset``; the default (all active orders) is served from cache."""
+        if queryset is not None:
+            return cls.compute(queryset)
+        key = f"{cls.CACHE_KEY}:{Order.current_business_date().isoformat()}"
+        counters = cache.get(key)
+        if counters is None:
+            counters = cls.compute()
+            cache.set(key, counters, cls.CACHE_TTL)
+        return counters
+
+    @classmethod
+    def invalidate(cls):
+        cache.delete(f"{cls.CACHE_KEY}:{Order.current_business_date().isoformat()}")
+
+    @classmethod
+    def get_context(cls, queryset=None):
+        """Template context in the ``<channel>_count`` / ``<channel>_count_today`` form."""
+        counters = cls.get_counters(queryset)
+        context = {}
+        # Keep the hard-coded channel cards at zero when a channel has no orders yet
+        for channel_type, _label in Channel._meta.get_field("channel_type").choices:
+            context[f"{channel_type.lower()}_count"] = 0
+            context[f"{channel_type.lower()}_count_today"] = 0
+        for key, counter in counters.items():
+            context[f"{key}_count"] = counter["total"]
+            context[f"{key}_count_today"] = counter["today"]
+        context["channel_counters"] = counters
+        return context
+
+
+class OrderStatService:
+    """
+    Maintains OrderHourlyStat, the per hour order rollup behind the dashboard.
+
+    Order signals (see master.signals) move an order's count and amounts
+    between buckets as it is created, edited or deactivated. Queryset
+    ``update()`` calls bypass the signals; run ``rebuild_order_stats`` for the
+    affected days afterwards.
+    """
+
+    CHANNELS = ["WhatsApp", "WhatsApp_COD", "Swiggy", "Kumar", "Wholesale", "Promo", "Counter", "Return_or_Replace"]
+    # Dashboard hour slots: 1 AM - 8 AM, then one slot per hour until 11 PM
+    TIME_SLOTS = [(1, 8)] + [(h, h + 1) for h in range(8, 23)]
+    # Account left out of the dashboard's total sale
+    EXCLUDED_SALE_ACCOUNT = 15
+
+    @staticmethod
+    def bucket(created, channel_id, account_id):
+        return Order.business_date_for(created), timezone.localtime(created).hour, channel_id, account_id
+
+    @classmethod
+    def order_values(cls, order):
+        """(bucket, (count, total, cod)) for an active order, None otherwise."""
+        created, channel_id, account_id, total_amount, cod_charge, is_active = order
+        if not is_active or not created:
+            return None
+        return cls.bucket(created, channel_id, account_id), (1, total_amount or 0, cod_charge or 0)
+
+    @staticmethod
+    def snapshot(order):
+        return order.created, order.channel_id, order.account_id, order.total_amount, order.cod_charge, order.is_active
+
+    @classmethod
+    def changes(cls, previous, current):
+        """Bucket deltas for an order moving from the ``previous`` to the ``current`` snapshot."""
+        deltas = defaultdict(lambda: [0, 0, 0])
+        for snapshot, sign in ((previous, -1), (current, 1)):
+            values = cls.order_values(snapshot) if snapshot else None
+            if values:
+                key, measures = values
+                for i, value in enumerate(measures):
+                    deltas[key][i] += sign * value
+        return {key: delta for key, delta in deltas.items() if any(delta)}
+
+    @staticmethod
+    def apply(deltas):
+        """
+        Apply rollup deltas.
+
+        Args:
+            deltas: dict of (business_date, hour, channel_id, account_id) -> [count, total, cod]
+        """
+        with transaction.atomic(savepoint=False):
+            for key, (count, total_amount, cod_charge) in sorted(deltas.items(), key=lambda item: item[0]):
+                business_date, hour, channel_id, account_id = key
+                lookup = {"business_date": business_date, "hour": hour, "channel_id": channel_id, "account_id": account_id}
+                changes = {"order_count": F("order_count") + count, "total_amount": F("total_amount") + total_amount, "cod_charge": F("cod_charge") + cod_charge}
+                if OrderHourlyStat.objects.filter(**lookup).update(**changes):
+                    continue
+                try:
+                    with transaction.atomic():
+                        OrderHourlyStat.objects.create(order_count=count, total_amount=total_amount, cod_charge=cod_charge, **lookup)
+                except IntegrityError:
+                    OrderHourlyStat.objects.filter(**lookup).update(**changes)
+
+    @classmethod
+    def rebuild(cls, start=None, end=None):
+        """
+        Recompute the rollup from orders, optionally limited to a range of business days.
+
+        Returns:
+            number of rollup rows written
+        """
+        orders = Order.objects.filter(is_active=True)
+        stats = OrderHourlyStat.objects.all()
+        if start:
+            orders = orders.filter(created__gte=Order.business_day_range(start)[0])
+            stats = stats.filter(business_date__gte=start)
+        if end:
+            orders = orders.filter(created__lt=Order.business_day_range(end)[1])
+            stats = stats.filter(business_date__lte=end)
+
+        rows = (
+            orders.order_by()
+            .annotate(slot=TruncHour("created", tzinfo=timezone.get_current_timezone()))
+            .values("slot", "channel_id", "account_id")
+            .annotate(order_count=Count("id"), total=Sum("total_amount"), cod=Sum("cod_charge"))
+        )
+        objs = [
+            OrderHourlyStat(
+                business_date=Order.business_date_for(row["slot"]),
+                hour=row["slot"].hour,
+                channel_id=row["channel_id"],
+                account_id=row["account_id"],
+                order_count=row["order_count"],
+                total_amount=row["total"] or 0,
+                cod_charge=row["cod"] or 0,
+            )
+            for row in rows.iterator()
+        ]
+        with transaction.atomic():
+            stats.delete()
+            OrderHourlyStat.objects.bulk_create(objs, batch_size=1000)
+        return len(objs)
+
+    @classmethod
+    def get_dashboard(cls, today=None, days=12):
+        """
+        Context for core.views.HomeView, read from the rollup.
+
+        Day figures follow the business day ``today`` (the current one by
+        default). The hourly charts stay on calendar days: rollup hours from
+        the cutoff onwards belong to the calendar day before their business
+        day.
+        """
+        today = today or Order.current_business_date()
+        date_range = [today - timedelta(days=i) for i in range(days)]
+        calendar_today = min(today, timezone.localdate())
+        calendar_yesterday = calendar_today - timedelta(days=1)
+        cutoff = Order.business_day_cutoff()
+
+        order_counts = {channel: defaultdict(int) for channel in cls.CHANNELS}
+        revenue = defaultdict(int)
+        today_orders = defaultdict(int)
+        hourly = {calendar_today: defaultdict(int), calendar_yesterday: defaultdict(int)}
+        total_sale = cod_charges = orders = 0
+
+        rows = OrderHourlyStat.objects.filter(business_date__gte=min(date_range[-1], calendar_yesterday), business_date__lte=today).values_list(
+            "business_date", "hour", "channel__channel_type", "account_id", "order_count", "total_amount", "cod_charge"
+        )
+        for day, hour, channel_type, account_id, count, total_amount, cod_charge in rows:
+            calendar_date = day - timedelta(days=1) if hour >= cutoff else day
+            if calendar_date in hourly:
+                hourly[calendar_date][hour] += count
+            if channel_type in order_counts:
+                order_counts[channel_type][day] += count
+            if day != today:
+                continue
+            revenue[channel_type] += total_amount
+            today_orders[channel_type] += count
+            orders += count
+            cod_charges += cod_charge
+            if account_id != cls.EXCLUDED_SALE_ACCOUNT:
+                total_sale += total_amount
+
+        totals = {
+            row["channel__channel_type"]: row
+            for row in OrderHourlyStat.objects.values("channel__channel_type").annotate(
+                total=Sum("order_count"),
+                today=Sum("order_count", filter=Q(business_date=today)),
+            )
+        }
+
+        context = {f"{channel}_data": [order_counts[channel][date] for date in date_range[::-1]] for channel in cls.CHANNELS}
+        context.update(
+            {
+                "total_sale": total_sale + cod_charges,
+                "orders": orders,
+                "revenue_by_channel": [int(revenue[channel]) for channel in cls.CHANNELS],
+                "order_by_channels": [today_orders[channel] for channel in cls.CHANNELS],
+                "yesterday_order_counts": [sum(hourly[calendar_yesterday][h] for h in range(start, end)) for start, end in cls.TIME_SLOTS],
+                "today_order_counts": [sum(hourly[calendar_today][h] for h in range(start, end)) for start, end in cls.TIME_SLOTS],
+            }
+        )
+        for channel in cls.CHANNELS:
+            context[f"{channel.lower()}_count"] = (totals.get(channel) or {}).get("total") or 0
+            context[f"{channel.lower()}_count_today"] = (totals.get(channel) or {}).get("today") or 0
+        return context
+
+
+class OrderReportService:
+    """
+    Per user, channel, account and city breakdowns for a filtered order queryset.
+
+    Order counts and amounts come from one ``GROUP BY`` over (order_by,
+    channel type, account); distinct customers and top cities take one query
+    each. Results are cached per report and filter parameters, and every
+    order write bumps a version number so stale reports are never served.
+    """
+
+    CACHE_KEY = "master:order_report"
+    VERSION_KEY = "master:order_report:version"
+    CACHE_TTL = 300
+    # Account left out of the total sale, as on the dashboard
+    EXCLUDED_SALE_ACCOUNT = OrderStatService.EXCLUDED_SALE_ACCOUNT
+
+    @staticmethod
+    def aggregate(queryset, top_cities=10):
+        rows = (
+            queryset.order_by()
+            .values("order_by_id", "channel_id", "channel__channel_type", "account_id")
+            .annotate(orders=Count("id"), total=Sum("total_amount"), cod=Sum("cod_charge"))
+        )
+        by_user, by_channel, by_account = defaultdict(int), defaultdict(int), defaultdict(int)
+        channel_ids = set()
+        total_order = total_sale = 0
+        for row in rows:
+            by_user[row["order_by_id"]] += row["orders"]
+            by_channel[row["channel__channel_type"]] += row["orders"]
+            by_account[row["account_id"]] += row["orders"]
+            channel_ids.add(row["channel_id"])
+            total_order += row["orders"]
+            if row["account_id"] != OrderReportService.EXCLUDED_SALE_ACCOUNT:
+                total_sale += (row["total"] or 0) + (row["cod"] or 0)
+
+        cities = (
+            queryset.order_by()
+            .values("customer__city")
+            .annotate(count=Count("customer", distinct=True))
+            .order_by("-count")[:top_cities]
+        )
+        return {
+            "total_order": total_order,
+            "total_sale": total_sale,
+            "total_channel": len(channel_ids),
+            "total_account": len(by_account),
+            "total_order_by": len(by_user),
+            "total_customer": queryset.order_by().values("customer").distinct().count(),
+            "by_user": dict(by_user),
+            "by_channel": dict(by_channel),
+            "by_account": dict(by_account),
+            "top_cities": [(city["customer__city"], city["count"]) for city in cities],
+        }
+
+    @classmethod
+    def _version(cls):
+        return cache.get_or_set(cls.VERSION_KEY, 1, None)
+
+    @classmethod
+    def invalidate(cls):
+        try:
+            cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            cache.set(cls.VERSION_KEY, 1, None)
+
+    @classmethod
+    def get_report(cls, queryset, params=None, scope="orders"):
+        """
+        Cached ``aggregate`` result.
+
+        Args:
+            queryset: filtered Order queryset
+            params: the request parameters ``queryset`` was built from (e.g. request.GET)
+            scope: name of the report, so different base querysets never share an entry
+        """
+        items = sorted((key, tuple(params.getlist(key)) if hasattr(params, "getlist") else value) for key, value in (params or {}).items())
+        digest = hashlib.md5(repr(items).encode()).hexdigest()
+        key = f"{cls.CACHE_KEY}:{cls._version()}:{scope}:{digest}"
+        report = cache.get(key)
+        if report is None:
+            report = cls.aggregate(queryset)
+            cache.set(key, report, cls.CACHE_TTL)
+        return report
+
+
+class AccountLedgerService:
+    """
+    Maintains AccountLedger, the running order income per account.
+
+    ``total_income`` covers every order of the account, like the original
+    balance calculation; ``today_income`` covers the active orders of the
+    current business day (see ``Order.business_date``). The
+    first write on a new day recomputes the row from history, which moves
+    ``business_date`` forward and resets today's figure.
+    """
+
+    @staticmethod
+    def compute(account_id, day=None):
+        """(total income, active income on ``day``) for one account, from the orders table."""
+        day = day or Order.current_business_date()
+        orders = Order.objects.filter(account_id=account_id)
+        totals = orders.aggregate(total=Sum("total_amount"), today=Sum("total_amount", filter=Q(is_active=True, business_date=day)))
+        return totals["total"] or 0, totals["today"] or 0
+
+    @classmethod
+    def rebuild_account(cls, account_id):
+        day = Order.current_business_date()
+        total_income, today_income = cls.compute(account_id, day)
+        ledger, _ = AccountLedger.objects.update_or_create(
+            account_id=account_id, defaults={"total_income": total_income, "business_date": day, "today_income": today_income}
+        )
+        return ledger
+
+    @staticmethod
+    def changes(previous, current):
+        """
+        Ledger deltas for an order moving from the ``previous`` to the ``current`` snapshot.
+
+        Snapshots are the tuples built by ``OrderStatService.snapshot``.
+
+        Returns:
+            dict of account id -> [total income delta, today income delta]
+        """
+        today = Order.current_business_date()
+        deltas = defaultdict(lambda: [0, 0])
+        for snapshot, sign in ((previous, -1), (current, 1)):
+            if not snapshot:
+                continue
+            created, channel_id, account_id, total_amount, cod_charge, is_active = snapshot
+            deltas[account_id][0] += sign * (total_amount or 0)
+            if is_active and created and Order.business_date_for(created) == today:
+                deltas[account_id][1] += sign * (total_amount or 0)
+        return {account_id: delta for account_id, delta in deltas.items() if any(delta)}
+
+    @classmethod
+    def apply(cls, deltas):
+        today = Order.current_business_date()
+        with transaction.atomic(savepoint=False):
+            for account_id, (total_delta, today_delta) in sorted(deltas.items()):
+                updated = AccountLedger.objects.filter(account_id=account_id, business_date=today).update(
+                    total_income=F("total_income") + total_delta, today_income=F("today_income") + today_delta
+                )
+                if not updated:
+                    # Missing row or first write of the day; history already includes this write
+                    cls.rebuild_account(account_id)
+
+    @staticmethod
+    def _history(day):
+        total = dict(Order.objects.order_by().values("account").annotate(total=Sum("total_amount")).values_list("account", "total"))
+        active_today = (
+            Order.objects.for_business_day(day).filter(is_active=True).order_by().values("account").annotate(total=Sum("total_amount")).values_list("account", "total")
+        )
+        return total, dict(active_today)
+
+    @classmethod
+    def rebuild_all(cls, verify_only=False):
+        """
+        Compare every ledger row with the orders table.
+
+        Returns:
+            list of (account_id, ledger (total, today) or None, expected (total, today))
+        """
+        day = Order.current_business_date()
+        total, active_today = cls._history(day)
+        ledger = {row.pk: (row.total_income, row.get_today_income()) for row in AccountLedger.objects.all()}
+
+        mismatches = []
+        for account_id in Account.objects.values_list("pk", flat=True):
+            expected = (total.get(account_id) or 0, active_today.get(account_id) or 0)
+            if ledger.get(account_id) != expected:
+                mismatches.append((account_id, ledger.get(account_id), expected))
+
+        if not verify_only:
+            with transaction.atomic():
+                for account_id, current, (total_income, today_income) in mismatches:
+                    AccountLedger.objects.update_or_create(
+                        account_id=account_id, defaults={"total_income": total_income, "business_date": day, "today_income": today_income}
+                    )
+        return mismatches
+
+    @staticmethod
+    def close_day(day):
+        """
+        Store every account's closing balance for ``day``.
+
+        Returns:
+            number of accounts closed
+        """
+        total = dict(Order.objects.filter(business_date__lte=day).order_by().values("account").annotate(total=Sum("total_amount")).values_list("account", "total"))
+        income = dict(
+            Order.objects.for_business_day(day).filter(is_active=True).order_by().values("account").annotate(total=Sum("total_amount")).values_list("account", "total")
+        )
+        balances = [
+            AccountDailyBalance(account_id=account_id, business_date=day, income=income.get(account_id) or 0, closing_balance=opening_balance + (total.get(account_id) or 0))
+            for account_id, opening_balance in Account.objects.values_list("pk", "opening_balance")
+        ]
+        with transaction.atomic():
+            AccountDailyBalance.objects.filter(business_date=day).delete()
+            AccountDailyBalance.objects.bulk_create(balances, batch_size=1000)
+        return len(balances)
+
+
+class OrderBuilder:
+    """
+    Set-based write path for quick entry orders.
+
+    Products are loaded with one query and checked in memory against the
+    cached channel prices, items are inserted with one ``bulk_create`` and
+    the stock ledger is updated with one statement, so the cost of an order
+    does not grow with its number of lines. The Order signals add one
+    statement each (order number, hourly rollup, account ledger, search
+    tokens), so a repeat customer's order runs eleven statements: channel,
+    products, customer lookup and update, those four, the order, its items
+    and the stock. A UTR adds its check and registry row, an idempotency
+    key its lookup and a savepoint, and a product's first sale creates its
+    stock row. Errors are raised as ``ValueError`` and roll the whole order
+    back.
+    """
+
+    @staticmethod
+    def parse_items(items):
+        """Validate raw ``{product_id, price, qty}`` lines into (product_id, price, qty) tuples."""
+        lines = []
+        for index, item in enumerate(items, start=1):
+            try:
+                product_id = int(item["product_id"])
+                price = Decimal(str(item["price"]))
+                quantity = int(item["qty"])
+            except (KeyError, TypeError, ValueError, InvalidOperation):
+                raise ValueError(f"Line {index}: invalid product, price or quantity")
+            if quantity <= 0 or price < 0:
+                raise ValueError(f"Line {index}: quantity must be positive and price not negative")
+            lines.append((product_id, price, quantity))
+        if not lines:
+            raise ValueError("At least one item is required")
+        return lines
+
+    @staticmethod
+    def channel_price_map(channel, products):
+        """Price per product id for a channel, falling back to the product price (as Product.get_price)."""
+        channel_prices = CatalogService.get_snapshot()["data"]["prices"].get(channel.channel_type, {})
+        return {product.pk: CatalogService.to_price(channel_prices.get(str(product.pk), product.price)) for product in products}
+
+    @staticmethod
+    def upsert_customer(phone_no, data, user):
+        customer, created = Customer.objects.get_or_create(phone_no=phone_no, defaults={**data, "creator": user})
+        if not created:
+            # Repeat customers keep their first address; the latest one goes to the secondary fields
+            customer.name_2 = data.get("customer_name")
+            customer.pincode_2 = data.get("pincode")
+            customer.city_2 = data.get("city")
+            customer.state_2 = data.get("state")
+            customer.address_2 = data.get("address")
+            customer.country_2 = data.get("country")
+            customer.save(update_fields=["name_2", "pincode_2", "city_2", "state_2", "address_2", "country_2", "updated"])
+        return customer
+
+    @classmethod
+    def create_quick_order(cls, user, channel_id, customer_data, items, account_id, order_by_id, utr=None, cod_charge=0, idempotency_key=None):
+        """
+        Create an order with its items.
+
+        Args:
+            customer_data: dict with phone_no, customer_name, alternate_phone_no, pincode, city, state, address, country
+            items: list of {product_id, price, qty} dicts
+            idempotency_key: client generated key; a repeated key returns the order created first
+
+        Returns:
+            (order, created, price_overrides) where price_overrides lists the
+            product ids sold at a price other than the channel price
+        """
+        with transaction.atomic():
+            if idempotency_key:
+                existing = Order.objects.filter(idempotency_key=idempotency_key).first()
+                if existing:
+                    return existing, False, []
+
+            channel = Channel.objects.filter(pk=channel_id).first()
+            if not channel:
+                raise ValueError("Channel not found")
+            # Checked again by the UTRRecord unique index when the order is saved
+            if utr and UTRRegistry.exists(utr):
+                raise DuplicateUTR("UTR already exists")
+
+            lines = cls.parse_items(items)
+            products = Product.objects.in_bulk({product_id for product_id, price, quantity in lines})
+            missing = sorted({product_id for product_id, price, quantity in lines} - set(products))
+            if missing:
+                raise ValueError(f"Products not found: {', '.join(map(str, missing))}")
+
+            prices = cls.channel_price_map(channel, products.values())
+            price_overrides = sorted({product_id for product_id, price, quantity in lines if price != prices[product_id]})
+            if price_overrides and getattr(settings, "QUICK_ORDER_ENFORCE_CHANNEL_PRICES", False):
+                names = ", ".join(str(products[product_id]) for product_id in price_overrides)
+                raise ValueError(f"Price differs from the channel price for: {names}")
+
+            customer_data = dict(customer_data)
+            customer = cls.upsert_customer(customer_data.pop("phone_no"), customer_data, user)
+
+            cod_charge = Decimal(cod_charge or 0)
+            order = Order(
+                channel=channel,
+                customer=customer,
+                account_id=account_id,
+                order_by_id=order_by_id,
+                utr=utr or None,
+                cod_charge=cod_charge,
+                total_amount=sum(price * quantity for product_id, price, quantity in lines) + cod_charge,
+                items_amount=sum(price * quantity for product_id, price, quantity in lines),
+                items_quantity=sum(quantity for product_id, price, quantity in lines),
+                creator=user,
+                idempotency_key=idempotency_key or None,
+            )
+            try:
+                # Only a key can collide, so only then is the insert worth a savepoint
+                with transaction.atomic() if idempotency_key else nullcontext():
+                    order.save()
+            except IntegrityError:
+                # A concurrent submit with the same key won the race
+                existing = Order.objects.filter(idempotency_key=idempotency_key).first() if idempotency_key else None
+                if existing:
+                    return existing, False, []
+                raise
+
+            order_items = OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order, product_id=product_id, price=price, quantity=quantity, amount=price * quantity, creator=user)
+                    for product_id, price, quantity in lines
+                ]
+            )
+            # bulk_create skips the item signals
+            StockLedgerService.apply_order_items(order_items)
+        return order, True, price_overrides
+
+
+class CatalogService:
+    """
+    Cached snapshot of the active products and the channel x product price matrix.
+
+    The snapshot is stored under a version number that Product and
+    ProductPrice signals bump (see master.signals), so readers never run
+    catalog queries between edits. ``CACHE_TTL`` bounds how long a worker
+    can serve an old snapshot when the cache is not shared between processes.
+    """
+
+    CACHE_KEY = "master:catalog"
+    VERSION_KEY = "master:catalog:version"
+    CACHE_TTL = 600
+
+    @staticmethod
+    def to_price(value):
+        """Exact two-place Decimal for a snapshot price (stored as a float for the JSON payload)."""
+        return Decimal(str(value)).quantize(Decimal("0.01"))
+
+    @staticmethod
+    def build():
+        products = [
+            {"id": product.pk, "name": str(product), "code": product.product_code or "", "price": float(product.price), "size": product.size}
+            for product in Product.objects.filter(is_active=True).only("product_name", "product_code", "price", "size")
+        ]
+        prices = defaultdict(dict)
+        rows = ProductPrice.objects.filter(is_active=True, product__is_active=True).values_list("channel__channel_type", "product_id", "price").order_by("pk")
+        for channel_type, product_id, price in rows:
+            prices[channel_type][str(product_id)] = float(price)
+        return {"products": products, "prices": dict(prices)}
+
+    @classmethod
+    def _version(cls):
+        return cache.get_or_set(cls.VERSION_KEY, 1, None)
+
+    @classmethod
+    def invalidate(cls):
+        try:
+            cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            cache.set(cls.VERSION_KEY, 1, None)
+
+    @classmethod
+    def get_snapshot(cls):
+        """
+        Returns:
+            dict with ``data`` (products and prices), its ``json`` encoding and an ``etag``
+        """
+        key = f"{cls.CACHE_KEY}:{cls._version()}"
+        snapshot = cache.get(key)
+        if snapshot is None:
+            data = cls.build()
+            encoded = json.dumps(data, separators=(",", ":"))
+            snapshot = {"data": data, "json": encoded, "etag": hashlib.md5(encoded.encode()).hexdigest()}
+            cache.set(key, snapshot, cls.CACHE_TTL)
+        return snapshot
+
+    @classmethod
+    def search(cls, query="", channel_type=None, limit=10):
+        """Products whose name or code contains ``query``, priced for ``channel_type``."""
+        data = cls.get_snapshot()["data"]
+        prices = data["prices"].get(channel_type, {}) if channel_type else {}
+        query = query.lower()
+        results = []
+        for product in data["products"]:
+            if query and query not in product["name"].lower() and query not in product["code"].lower():
+                continue
+            results.append({**product, "price": prices.get(str(product["id"]), product["price"])})
+            if query and len(results) >= limit:
+                break
+        return results
+
+
+class OrderSearchService:
+    """
+    Order search over OrderSearchToken rows instead of ``icontains`` scans.
+
+    Each order is indexed as normalized tokens: the last 10 digits of its
+    phone numbers, its order number (whole, without prefix and as a plain
+    number), UTR, pincodes and the words of the customer name. A search
+    term matches tokens equal to it, then tokens it is a prefix of (a range
+    scan on the (token, order) index). ``search`` also matches terms of 3+
+    characters inside tokens, which PostgreSQL serves from the pg_trgm
+    index on OrderSearchToken, and ranks exact phone/order number first,
+    then exact UTR and pincode, then prefix and substring matches, newest
+    first within a rank, from at most ``MAX_CANDIDATES`` orders per term.
+    ``filter_queryset`` has no limit, so it only uses the prefix range.
+    """
+
+    MAX_CANDIDATES = 2000
+    EXACT_RANKS = {"phone": 0, "order_no": 0, "utr": 1, "pincode": 1, "name": 2}
+    PREFIX_RANKS = {"phone": 3, "order_no": 3, "utr": 4, "pincode": 4, "name": 4}
+    CONTAINS_RANK = 5
+
+    @staticmethod
+    def normalize_phone(phone):
+        digits = re.sub(r"\D", "", phone or "")
+        return digits[-10:]
+
+    @classmethod
+    def tokens(cls, order):
+        """Set of (token, kind) for an order; uses ``order.customer``."""
+        customer = order.customer
+        tokens = set()
+        for phone in (customer.phone_no, customer.alternate_phone_no, order.phone, order.mobile):
+            phone = cls.normalize_phone(phone)
+            if phone:
+                tokens.add((phone, "phone"))
+        if order.order_no:
+            order_no = order.order_no.lower()
+            tokens.update({(order_no, "order_no"), (order_no.split("-", 1)[-1], "order_no")})
+            number = OrderNumberAllocator.parse_number(order.order_no)
+            if number is not None:
+                tokens.add((str(number), "order_no"))
+        if order.utr:
+            tokens.add((UTRRegistry.normalize(order.utr).lower(), "utr"))
+        for pincode in (customer.pincode, order.pincode):
+            if pincode and pincode.strip():
+                tokens.add((pincode.strip(), "pincode"))
+        for name in (customer.customer_name, order.name):
+            tokens.update((word, "name") for word in re.findall(r"\w+", (name or "").lower()))
+        return {(token[:100], kind) for token, kind in tokens if token}
+
+    @classmethod
+    def index_orders(cls, orders, replace=True):
+        """Write the tokens of ``orders``; unless they are new, only the tokens that changed are deleted or added."""
+        wanted = {(order.pk, token, kind) for order in orders if order.pk for token, kind in cls.tokens(order)}
+        stale = []
+        if replace:
+            stored = OrderSearchToken.objects.filter(order__in={order.pk for order in orders if order.pk}).values_list("pk", "order_id", "token", "kind")
+            for pk, order_id, token, kind in stored:
+                if (order_id, token, kind) in wanted:
+                    wanted.discard((order_id, token, kind))
+                else:
+                    stale.append(pk)
+        if not stale and not wanted:
+            return
+        with transaction.atomic(savepoint=False):
+            if stale:
+                OrderSearchToken.objects.filter(pk__in=stale).delete()
+            OrderSearchToken.objects.bulk_create(
+                [OrderSearchToken(order_id=order_id, token=token, kind=kind) for order_id, token, kind in wanted], batch_size=1000
+            )
+
+    @classmethod
+    def rebuild(cls, chunk_size=2000):
+        """Re-index every order. Returns the number of orders indexed."""
+        OrderSearchToken.objects.all().delete()
+        indexed, last_pk = 0, 0
+        while True:
+            orders = list(Order.objects.filter(pk__gt=last_pk).select_related("customer").order_by("pk")[:chunk_size])
+            if not orders:
+                return indexed
+            cls.index_orders(orders, replace=False)
+            indexed += len(orders)
+            last_pk = orders[-1].pk
+
+    @classmethod
+    def terms(cls, query):
+        """Search terms: a phone-like query is one phone term, otherwise whitespace separated words."""
+        query = (query or "").strip().lower()
+        if re.fullmatch(r"[\d\s+()-]{6,}", query):
+            return [cls.normalize_phone(query)]
+        # Longest term first: it is the most selective one to collect candidates with
+        return sorted({term for term in query.split() if term}, key=len, reverse=True)
+
+    @staticmethod
+    def _prefix_range(term):
+        """Q for the tokens starting with ``term``, a range scan on the (token, order) index."""
+        return Q(token__gte=term, token__lt=term + "\uffff")
+
+    @classmethod
+    def _term_ranks(cls, term, order_ids=None):
+        tokens = OrderSearchToken.objects.all()
+        if order_ids is not None:
+            tokens = tokens.filter(order_id__in=order_ids)
+        ranks = {}
+        # Exact matches first, so a common prefix can't crowd them out of the candidates; newest orders first
+        for order_id, kind in tokens.filter(token=term).order_by("-order_id").values_list("order_id", "kind")[: cls.MAX_CANDIDATES]:
+            ranks[order_id] = min(cls.EXACT_RANKS[kind], ranks.get(order_id, cls.EXACT_RANKS[kind]))
+        if len(ranks) < cls.MAX_CANDIDATES:
+            # Backwards index scan, so a common prefix yields its newest orders
+            prefix = tokens.filter(token__gt=term, token__lt=term + "\uffff").exclude(order_id__in=list(ranks))
+            for order_id, kind in prefix.order_by("-token", "-order_id").values_list("order_id", "kind")[: cls.MAX_CANDIDATES - len(ranks)]:
+                ranks[order_id] = min(cls.PREFIX_RANKS[kind], ranks.get(order_id, cls.PREFIX_RANKS[kind]))
+        if len(term) >= 3 and len(ranks) < cls.MAX_CANDIDATES:
+            contains = tokens.filter(token__contains=term).exclude(order_id__in=list(ranks))
+            for order_id in contains.order_by("-order_id").values_list("order_id", flat=True)[: cls.MAX_CANDIDATES - len(ranks)]:
+                ranks.setdefault(order_id, cls.CONTAINS_RANK)
+        return ranks
+
+    @classmethod
+    def match_ranks(cls, query):
+        """dict of order id -> rank (lower is better) for orders matching every term of ``query``."""
+        ranks = None
+        for term in cls.terms(query):
+            term_ranks = cls._term_ranks(term, None if ranks is None else list(ranks))
+            ranks = term_ranks if ranks is None else {order_id: ranks[order_id] + rank for order_id, rank in term_ranks.items()}
+            if not ranks:
+                break
+        return ranks or {}
+
+    @classmethod
+    def match_ids(cls, query):
+        return list(cls.match_ranks(query))
+
+    @classmethod
+    def filter_queryset(cls, queryset, query):
+        """``queryset`` narrowed to the orders with a token starting with every term of ``query``, without the candidate limit."""
+        terms = cls.terms(query)
+        if not terms:
+            return queryset.none()
+        for term in terms:
+            queryset = queryset.filter(pk__in=OrderSearchToken.objects.filter(cls._prefix_range(term)).values("order_id"))
+        return queryset
+
+    @classmethod
+    def search(cls, query, limit=20):
+        """Active orders matching ``query``, best match first."""
+        ranks = cls.match_ranks(query)
+        best = sorted(ranks, key=lambda order_id: (ranks[order_id], -order_id))[: limit * 2]
+        orders = Order.objects.filter(pk__in=best, is_active=True).select_related("customer", "channel")
+        return sorted(orders, key=lambda order: (ranks[order.pk], -order.pk))[:limit]
+
+
+class OrderImporter:
+    """
+    Bulk order import from CSV or XLSX files.
+
+    Rows are streamed and grouped into orders: consecutive rows sharing an
+    ``order_ref`` are the lines of one order, a row without one is an order
+    of its own. Orders are written in chunks; each chunk looks its customers
+    up with one query, reserves its order numbers in one block per prefix and
+    inserts customers, orders, items and UTR records with ``bulk_create``.
+    The stock, rollup and ledger updates that ``bulk_create`` skips are
+    applied once per chunk.
+
+    A row that fails validation is reported and skipped. If a chunk fails in
+    the database its orders are retried one by one, so only the offending
+    orders are reported and the rest of the file is still imported.
+    """
+
+    CHUNK_SIZE = 500
+    COLUMNS = (
+        "order_ref", "channel", "phone_no", "customer_name", "alternate_phone_no", "address", "city", "state",
+        "pincode", "country", "account", "order_by", "utr", "cod_charge", "product", "quantity", "price",
+    )
+    CUSTOMER_FIELDS = ("customer_name", "alternate_phone_no", "address", "city", "state", "pincode", "country")
+
+    def __init__(self, user, chunk_size=None):
+        self.user = user
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        channels = list(Channel.objects.filter(is_active=True).order_by("pk"))
+        self.channels = {}
+        for channel in channels:
+            self.channels.setdefault(channel.channel_type.lower(), channel)
+        # Prefixes win over channel types, which can repeat
+        self.channels.update({channel.prefix.lower(): channel for channel in channels})
+        self.accounts = {}
+        for account_id, code in Account.objects.filter(is_active=True).values_list("pk", "code"):
+            self.accounts[code.lower()] = self.accounts[str(account_id)] = account_id
+        self.products = {}
+        for product_id, code, price in Product.objects.filter(is_active=True).values_list("pk", "product_code", "price"):
+            self.products[str(product_id)] = (product_id, price)
+            if code:
+                self.products[code.lower()] = (product_id, price)
+        self.prices = CatalogService.get_snapshot()["data"]["prices"]
+        self.users = {}
+        self.seen_utrs = set()
+        self.errors = []
+        self.stats = {"rows": 0, "orders": 0, "items": 0, "customers": 0}
+
+    @staticmethod
+    def _cell(value):
+        if value is None:
+            return ""
+        if isinstance(value, float) and value.is_integer():
+            # XLSX stores phone numbers and quantities as floats
+            value = int(value)
+        return str(value).strip()
+
+    @classmethod
+    def read_rows(cls, fileobj, filename):
+        """Yield (row number, {column: value}) from an uploaded or opened binary file."""
+        if filename.lower().endswith(".xlsx"):
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(fileobj, read_only=True, data_only=True)
+            rows = workbook.active.iter_rows(values_only=True)
+        else:
+            rows = csv.reader(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""))
+        header = [cls._cell(cell).lower().replace(" ", "_") for cell in next(rows, [])]
+        for number, row in enumerate(rows, start=2):
+            values = [cls._cell(cell) for cell in row]
+            if any(values):
+                yield number, dict(zip(header, values))
+
+    @staticmethod
+    def group_orders(rows):
+        """Group consecutive rows with the same ``order_ref`` into [(row number, row), ...] lists."""
+        group, group_ref = [], None
+        for number, row in rows:
+            ref = row.get("order_ref", "")
+            if group and (not ref or ref != group_ref):
+                yield group
+                group = []
+            group.append((number, row))
+            group_ref = ref
+        if group:
+            yield group
+
+    def error(self, rows, message):
+        number, row = rows[0]
+        self.errors.append({"row": number, "order_ref": row.get("order_ref", ""), "error": message})
+
+    def _load_users(self, groups):
+        usernames = {row.get("order_by", "") for rows in groups for number, row in rows} - set(self.users) - {""}
+        if usernames:
+            self.users.update({username: pk for pk, username in User.objects.filter(username__in=usernames).values_list("pk", "username")})
+
+    def parse_order(self, rows):
+        """Validated order dict for a group of rows, or None after reporting the error."""
+        number, head = rows[0]
+        channel = self.channels.get(head.get("channel", "").lower())
+        if channel is None:
+            return self.error(rows, f"Unknown channel '{head.get('channel', '')}'")
+        account_id = self.accounts.get(head.get("account", "").lower())
+        if account_id is None:
+            return self.error(rows, f"Unknown account '{head.get('account', '')}'")
+        phone_no = head.get("phone_no", "")
+        if not phone_no:
+            return self.error(rows, "Phone number is required")
+        order_by_id = self.users.get(head["order_by"]) if head.get("order_by") else self.user.pk
+        if order_by_id is None:
+            return self.error(rows, f"Unknown user '{head['order_by']}'")
+        try:
+            cod_charge = Decimal(head.get("cod_charge") or 0)
+        except InvalidOperation:
+            return self.error(rows, "Invalid COD charge")
+
+        utr = UTRRegistry.normalize(head.get("utr"))
+        if utr and utr in self.seen_utrs:
+            return self.error(rows, f"UTR {utr} is repeated in the file")
+
+        channel_prices = self.prices.get(channel.channel_type, {})
+        lines = []
+        for number, row in rows:
+            product = self.products.get(row.get("product", "").lower())
+            if product is None:
+                return self.error([(number, row)], f"Unknown product '{row.get('product', '')}'")
+            product_id, product_price = product
+            try:
+                quantity = int(row.get("quantity") or 1)
+                price = Decimal(row["price"]) if row.get("price") else CatalogService.to_price(channel_prices.get(str(product_id), product_price))
+            except (ValueError, InvalidOperation):
+                return self.error([(number, row)], "Invalid price or quantity")
+            if quantity <= 0 or price < 0:
+                return self.error([(number, row)], "Quantity must be positive and price not negative")
+            lines.append((product_id, price, quantity))
+
+        if utr:
+            self.seen_utrs.add(utr)
+        return {
+            "rows": rows,
+            "channel": channel,
+            "account_id": account_id,
+            "order_by_id": order_by_id,
+            "phone_no": phone_no,
+            "customer": {field: head.get(field, "") for field in self.CUSTOMER_FIELDS},
+            "utr": utr,
+            "cod_charge": cod_charge,
+            "lines": lines,
+        }
+
+    def write_chunk(self, orders):
+        """Insert a chunk of parsed orders in one transaction. Returns the number of orders created."""
+        with transaction.atomic():
+            registered = UTRRegistry.lookup_many(order["utr"] for order in orders if order["utr"])
+            valid = []
+            for order in orders:
+                if order["utr"] in registered:
+                    self.error(order["rows"], f"UTR {order['utr']} already exists")
+                else:
+                    valid.append(order)
+
+            phones = {order["phone_no"] for order in valid}
+            customers = {}
+            for customer in Customer.objects.filter(phone_no__in=phones).order_by("pk"):
+                customers.setdefault(customer.phone_no, customer)
+            orders, valid, new_customers, repeat_customers = valid, [], {}, {}
+            for order in orders:
+                phone_no, data = order["phone_no"], order["customer"]
+                if phone_no in customers:
+                    # Repeat customers keep their first address; the latest one goes to the secondary fields
+                    customer = customers[phone_no]
+                    customer.name_2, customer.pincode_2, customer.city_2 = data["customer_name"] or None, data["pincode"] or None, data["city"] or None
+                    customer.state_2, customer.address_2, customer.country_2 = data["state"] or None, data["address"] or None, data["country"] or None
+                    repeat_customers[phone_no] = customer
+                elif phone_no not in new_customers:
+                    if not data["customer_name"]:
+                        self.error(order["rows"], "Customer name is required for a new customer")
+                        continue
+                    new_customers[phone_no] = Customer(phone_no=phone_no, creator=self.user, **{**data, "country": data["country"] or "India"})
+                valid.append(order)
+
+            Customer.objects.bulk_create(new_customers.values())
+            if any(customer.pk is None for customer in new_customers.values()):
+                new_customers = {
+                    customer.phone_no: customer for customer in Customer.objects.filter(phone_no__in=new_customers).order_by("-pk")
+                }
+            customers.update(new_customers)
+            Customer.objects.bulk_update(repeat_customers.values(), ["name_2", "pincode_2", "city_2", "state_2", "address_2", "country_2"])
+
+            order_nos = defaultdict(list)
+            for order in valid:
+                order_nos[order["channel"].prefix].append(order)
+            for prefix, prefix_orders in order_nos.items():
+                for order, order_no in zip(prefix_orders, OrderNumberAllocator.reserve_order_nos(prefix, len(prefix_orders))):
+                    order["order_no"] = order_no
+
+            business_date = Order.current_business_date()
+            records = Order.objects.bulk_create(
+                [
+                    Order(
+                        channel=order["channel"],
+                        customer=customers[order["phone_no"]],
+                        account_id=order["account_id"],
+                        order_by_id=order["order_by_id"],
+                        utr=order["utr"] or None,
+                        cod_charge=order["cod_charge"],
+                        total_amount=sum(price * quantity for product_id, price, quantity in order["lines"]) + order["cod_charge"],
+                        items_amount=sum(price * quantity for product_id, price, quantity in order["lines"]),
+                        items_quantity=sum(quantity for product_id, price, quantity in order["lines"]),
+                        order_no=order["order_no"],
+                        business_date=business_date,
+                        creator=self.user,
+                    )
+                    for order in valid
+                ]
+            )
+            if any(record.pk is None for record in records):
+                by_no = Order.objects.in_bulk([record.order_no for record in records], field_name="order_no")
+                records = [by_no[record.order_no] for record in records]
+
+            items = OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=record, product_id=product_id, price=price, quantity=quantity, amount=price * quantity, creator=self.user)
+                    for record, order in zip(records, valid)
+                    for product_id, price, quantity in order["lines"]
+                ]
+            )
+            UTRRegistry.register_many(records)
+            OrderSearchService.index_orders(records, replace=False)
+
+            # bulk_create skips the master.signals handlers
+            StockLedgerService.apply_order_items(items)
+            stat_deltas, ledger_deltas = {}, {}
+            for record in records:
+                snapshot = OrderStatService.snapshot(record)
+                self._merge(stat_deltas, OrderStatService.changes(None, snapshot))
+                self._merge(ledger_deltas, AccountLedgerService.changes(None, snapshot))
+            OrderStatService.apply(stat_deltas)
+            AccountLedgerService.apply(ledger_deltas)
+
+        self.stats["orders"] += len(records)
+        self.stats["items"] += len(items)
+        self.stats["customers"] += len(new_customers)
+        return len(records)
+
+    @staticmethod
+    def _merge(totals, deltas):
+        for key, values in deltas.items():
+            current = totals.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                current[i] += value
+
+    def flush(self, groups):
+        self._load_users(groups)
+        orders = [order for order in map(self.parse_order, groups) if order]
+        if not orders:
+            return
+        error_count = len(self.errors)
+        try:
+            self.write_chunk(orders)
+        except Exception:
+            # Isolate the orders the database rejected
+            del self.errors[error_count:]
+            for order in orders:
+                try:
+                    self.write_chunk([order])
+                except Exception as e:
+                    self.error(order["rows"], str(e))
+
+    def run(self, rows):
+        """
+        Import ``(row number, row)`` pairs, e.g. from ``read_rows``.
+
+        Returns:
+            dict with rows, orders, items and customers counts and the list of row errors
+        """
+        groups = []
+        for group in self.group_orders(rows):
+            self.stats["rows"] += len(group)
+            groups.append(group)
+            if len(groups) >= self.chunk_size:
+                self.flush(groups)
+                groups = []
+        if groups:
+            self.flush(groups)
+        if self.stats["orders"]:
+            ChannelCounterService.invalidate()
+            OrderReportService.invalidate()
+        return {**self.stats, "errors": self.errors}
@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from channels_config.services import UTRRegistry
+
+from .models import Account, Channel, Customer, Order, OrderItem, Product, ProductPrice, PurchaseItem
+from .services import AccountLedgerService, CatalogService, ChannelCounterService, OrderReportService, OrderSearchService, OrderStatService, StockLedgerService
+
+# Customer fields that go into the order search tokens
+CUSTOMER_SEARCH_FIELDS = {"phone_no", "alternate_phone_no", "pincode", "customer_name"}
+
+# Stock effect of each item model: (product field, sign)
+STOCK_ITEM_MODELS = {OrderItem: ("product_id", -1), PurchaseItem: ("item_id", 1)}
+
+
+def _deleted_with(origin, *models):
+    """True if the delete cascades from one of ``models``, whose ledger rows go with it."""
+    model = getattr(origin, "model", type(origin))
+    return model in models
+
+
+def _stock_key(sender, instance):
+    product_field, sign = STOCK_ITEM_MODELS[sender]
+    return getattr(instance, product_field), sign * int(instance.quantity or 0)
+
+
+@receiver(pre_save, sender=OrderItem)
+@receiver(pre_save, sender=PurchaseItem)
+def remember_stock_item(sender, instance, **kwargs):
+    """Keep the stored product/quantity so an update can be applied as a delta."""
+    instance._stock_previous = None
+    if instance.pk and not instance._state.adding:
+        product_field, sign = STOCK_ITEM_MODELS[sender]
+        previous = sender.objects.filter(pk=instance.pk).values_list(product_field, "quantity").first()
+        if previous:
+            instance._stock_previous = (previous[0], sign * int(previous[1] or 0))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_save, sender=PurchaseItem)
+def update_stock_on_save(sender, instance, **kwargs):
+    deltas = {}
+    product_id, quantity = _stock_key(sender, instance)
+    deltas[product_id] = quantity
+    previous = getattr(instance, "_stock_previous", None)
+    if previous:
+        deltas[previous[0]] = deltas.get(previous[0], 0) - previous[1]
+    StockLedgerService.apply(deltas)
+
+
+@receiver(post_save, sender=OrderItem)
+def update_order_item_totals(sender, instance, **kwargs):
+    Order.objects.filter(pk=instance.order_id).refresh_item_totals()
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_order_item_totals_on_delete(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Order):
+        return
+    Order.objects.filter(pk=instance.order_id).refresh_item_totals()
+
+
+@receiver(post_delete, sender=OrderItem)
+@receiver(post_delete, sender=PurchaseItem)
+def update_stock_on_delete(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Product):
+        return
+    product_id, quantity = _stock_key(sender, instance)
+    StockLedgerService.apply({product_id: -quantity})
+
+
+@receiver(post_save, sender=Order)
+def invalidate_channel_counters(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(ChannelCounterService.invalidate)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_stats(sender, instance, **kwargs):
+    """Keep the stored bucket, amounts and UTR so an edit moves the order between rollup rows."""
+    instance._stats_previous = instance._utr_previous = None
+    if instance.pk and not instance._state.adding:
+        previous = sender.objects.filter(pk=instance.pk).values_list("created", "channel_id", "account_id", "total_amount", "cod_charge", "is_active", "utr").first()
+        if previous:
+            instance._stats_previous, instance._utr_previous = previous[:6], (previous[6] or None, previous[5])
+
+
+@receiver(post_save, sender=Order)
+def update_order_stats_on_save(sender, instance, **kwargs):
+    previous, current = getattr(instance, "_stats_previous", None), OrderStatService.snapshot(instance)
+    OrderStatService.apply(OrderStatService.changes(previous, current))
+    AccountLedgerService.apply(AccountLedgerService.changes(previous, current))
+    transaction.on_commit(OrderReportService.invalidate)
+
+
+@receiver(post_save, sender=Order)
+def sync_utr_registry(sender, instance, created, **kwargs):
+    if (instance.utr or None, instance.is_active) != (getattr(instance, "_utr_previous", None) or (None, True)):
+        UTRRegistry.sync(instance)
+
+
+@receiver(post_save, sender=Order)
+def index_order_search(sender, instance, created, **kwargs):
+    OrderSearchService.index_orders([instance], replace=not created)
+
+
+@receiver(pre_save, sender=Customer)
+def remember_customer_search_fields(sender, instance, update_fields=None, **kwargs):
+    """Keep the stored search fields so only a change to them re-indexes the customer's orders."""
+    instance._search_previous = None
+    if instance.pk and not instance._state.adding and not (update_fields and not set(update_fields) & CUSTOMER_SEARCH_FIELDS):
+        instance._search_previous = sender.objects.filter(pk=instance.pk).values(*CUSTOMER_SEARCH_FIELDS).first()
+
+
+@receiver(post_save, sender=Customer)
+def reindex_customer_orders(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_search_previous", None)
+    if created or previous is None or all(previous[field] == getattr(instance, field) for field in CUSTOMER_SEARCH_FIELDS):
+        return
+    OrderSearchService.index_orders(Order.objects.filter(customer=instance).select_related("customer"))
+
+
+@receiver(post_delete, sender=Order)
+def update_order_stats_on_delete(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Account, Channel):
+        return
+    previous = OrderStatService.snapshot(instance)
+    OrderStatService.apply(OrderStatService.changes(previous, None))
+    AccountLedgerService.apply(AccountLedgerService.changes(previous, None))
+    transaction.on_commit(OrderReportService.invalidate)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductPrice)
+@receiver(post_delete, sender=ProductPrice)
+def invalidate_catalog(sender, instance, **kwargs):
+    transaction.on_commit(CatalogService.invalidate)
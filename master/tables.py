@@ -66,8 +66,8 @@ class CustomerTable(BaseTable):
 
 class AccountTable(BaseTable):
     created = None
-    balance = columns.TemplateColumn("""{{ record.get_balance }}""", orderable=True,verbose_name="Total")
-    get_today_orders = columns.TemplateColumn("""{{ record.get_today_orders }}""", orderable=True,verbose_name="Today Orders")
+    balance = columns.TemplateColumn("""{{ record.get_balance }}""", orderable=True,verbose_name="Total", order_by=("ledger__total_income",))
+    get_today_orders = columns.TemplateColumn("""{{ record.get_today_orders }}""", orderable=True,verbose_name="Today Orders", order_by=("ledger__today_income",))
     class Meta:
         model = Account
         fields = ("name", "code",'balance','get_today_orders')
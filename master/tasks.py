@@ -0,0 +1,15 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.utils.dateparse import parse_date
+
+
+@shared_task
+def close_account_day_task(day=None):
+    """Store closing balances for business day ``day`` (YYYY-MM-DD), the last closed one by default."""
+    from master.models import Order
+    from master.services import AccountLedgerService
+
+    day = parse_date(day) if day else Order.current_business_date() - timedelta(days=1)
+    count = AccountLedgerService.close_day(day)
+    return f"Closed {count} accounts for {day}"
@@ -1,3 +1,635 @@
-from django.test import TestCase
+import datetime
+import io
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from channels_config.services import UTRRegistry
+from master.models import (
+    Account,
+    AccountDailyBalance,
+    AccountLedger,
+    Channel,
+    Customer,
+    Order,
+    OrderHourlyStat,
+    OrderItem,
+    OrderNumberSequence,
+    OrderSearchToken,
+    Product,
+    ProductPrice,
+    ProductStock,
+    Purchase,
+    PurchaseItem,
+)
+from master.services import (
+    AccountLedgerService,
+    CatalogService,
+    ChannelCounterService,
+    OrderBuilder,
+    OrderImporter,
+    OrderNumberAllocator,
+    OrderReportService,
+    OrderSearchService,
+    OrderStatService,
+    StockLedgerService,
+)
+
+
+class MasterTestCase(TestCase):
+    """Channel, account, user and two products shared by the master tests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        cls.channel = Channel.objects.create(channel_type="WhatsApp", prefix="WA")
+        cls.cod_channel = Channel.objects.create(channel_type="WhatsApp_COD", prefix="WC")
+        cls.account = Account.objects.create(name="Bank", code="B1", opening_balance=0)
+        cls.apple = Product.objects.create(product_name="Apple", product_code="AP", size="1kg", price=100, opning_stock=50)
+        cls.mango = Product.objects.create(product_name="Mango", product_code="MG", size="1kg", price=200, opning_stock=50)
+
+    def setUp(self):
+        # Versions and snapshots live in the cache, which outlives test transactions
+        cache.clear()
+
+    def customer_data(self, phone_no="9000000001", **extra):
+        return {
+            "phone_no": phone_no,
+            "customer_name": "Test Customer",
+            "alternate_phone_no": "",
+            "pincode": "600001",
+            "city": "Chennai",
+            "state": "Tamil Nadu",
+            "address": "1, Test Street",
+            "country": "India",
+            **extra,
+        }
+
+    def quick_order(self, items, phone_no="9000000001", channel=None, **kwargs):
+        order, created, overrides = OrderBuilder.create_quick_order(
+            self.user, (channel or self.channel).pk, self.customer_data(phone_no), items, self.account.pk, self.user.pk, **kwargs
+        )
+        return order
+
+
+class OrderNumberAllocatorTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        OrderNumberAllocator.reset_local_blocks()
+        self.addCleanup(OrderNumberAllocator.reset_local_blocks)
+
+    def test_orders_are_numbered_per_prefix(self):
+        first = self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+        second = self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+        other = self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}], channel=self.cod_channel)
+
+        self.assertEqual([first.order_no, second.order_no, other.order_no], ["WA-EB0001", "WA-EB0002", "WC-EB0001"])
+
+    def test_new_sequence_continues_after_existing_orders(self):
+        order = self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+        Order.objects.filter(pk=order.pk).update(order_no="WA-EB0041")
+        OrderNumberSequence.objects.all().delete()
+
+        self.assertEqual(OrderNumberAllocator.next_order_no("WA"), "WA-EB0042")
+
+    def test_rolled_back_numbers_are_handed_out_again(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertEqual(OrderNumberAllocator.reserve_order_nos("WA", 3), ["WA-EB0001", "WA-EB0002", "WA-EB0003"])
+                raise RuntimeError
+
+        self.assertEqual(OrderNumberAllocator.next_order_no("WA"), "WA-EB0001")
+
+    @override_settings(ORDER_NUMBER_BLOCK_SIZE=5)
+    def test_blocks_are_handed_out_locally_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(OrderNumberAllocator.next_order_no("WA"), "WA-EB0001")
+
+        with self.assertNumQueries(0):
+            self.assertEqual([OrderNumberAllocator.next_order_no("WA") for i in range(4)], ["WA-EB0002", "WA-EB0003", "WA-EB0004", "WA-EB0005"])
+        self.assertEqual(OrderNumberAllocator.next_order_no("WA"), "WA-EB0006")
+        self.assertEqual(OrderNumberSequence.objects.get(prefix="WA").last_value, 10)
+
+
+class StockLedgerTests(MasterTestCase):
+    def assertStock(self, apple, mango):
+        self.assertEqual([Product.objects.get(pk=self.apple.pk).get_stock(), Product.objects.get(pk=self.mango.pk).get_stock()], [apple, mango])
+        self.assertEqual(StockLedgerService.rebuild_all(verify_only=True), [])
+
+    def test_sales_and_purchases_move_the_ledger(self):
+        order = self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 3}])
+        self.assertStock(47, 50)
+
+        purchase = Purchase.objects.create(invoice_number="INV-1", invoice_date=datetime.date(2026, 3, 10))
+        PurchaseItem.objects.create(purchase=purchase, item=self.apple, quantity=10, price=50)
+        self.assertStock(57, 50)
+
+        item = OrderItem.objects.get(order=order)
+        item.product, item.quantity = self.mango, 2
+        item.save()
+        self.assertStock(60, 48)
+
+        # Model.delete() only deactivates; the queryset delete removes the rows
+        Order.objects.filter(pk=order.pk).delete()
+        Purchase.objects.filter(pk=purchase.pk).delete()
+        self.assertStock(50, 50)
+
+    def test_first_movement_seeds_the_row_from_history(self):
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 3}])
+        ProductStock.objects.all().delete()
+
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+
+        self.assertStock(46, 50)
+
+    def test_rebuild_repairs_drift(self):
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 3}])
+        ProductStock.objects.filter(product=self.apple).update(quantity=7)
+
+        self.assertEqual(StockLedgerService.rebuild_all(), [(self.apple.pk, 7, -3), (self.mango.pk, None, 0)])
+        self.assertStock(47, 50)
+
+
+class ChannelCounterServiceTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        line = [{"product_id": self.apple.pk, "price": "100", "qty": 1}]
+        self.old = self.quick_order(line)
+        Order.objects.filter(pk=self.old.pk).update(business_date=datetime.date(2020, 1, 1))
+        self.quick_order(line)
+        self.quick_order(line, channel=self.cod_channel)
+
+    @mock.patch("core.feature_flags.is_dynamic_channels_enabled", return_value=False)
+    def test_counts_per_channel_in_one_query(self, enabled):
+        with self.assertNumQueries(1):
+            counters = ChannelCounterService.get_counters()
+
+        self.assertEqual(counters["whatsapp"], {"label": "WhatsApp", "total": 2, "today": 1})
+        self.assertEqual(counters["whatsapp_cod"], {"label": "WhatsApp_COD", "total": 1, "today": 1})
+
+    def test_unfiltered_counts_are_cached_until_an_order_is_created(self):
+        ChannelCounterService.get_counters()
+        with self.assertNumQueries(0):
+            ChannelCounterService.get_counters()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+
+        self.assertEqual(ChannelCounterService.get_counters()["whatsapp"]["total"], 3)
+
+    def test_filtered_counts_and_context(self):
+        context = ChannelCounterService.get_context(Order.objects.exclude(pk=self.old.pk))
+
+        self.assertEqual((context["whatsapp_count"], context["whatsapp_count_today"], context["whatsapp_cod_count"]), (1, 1, 1))
+
+    @mock.patch("core.feature_flags.is_dynamic_channels_enabled", return_value=True)
+    def test_dynamic_channels_are_matched_by_prefix(self, enabled):
+        from channels_config.models import DynamicChannel
+
+        DynamicChannel.objects.create(name="Shop", code="shop", prefix="WA")
+
+        self.assertEqual(ChannelCounterService.compute()["shop"], {"label": "Shop", "total": 2, "today": 1})
+
+
+class OrderReportServiceTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+        self.quick_order([{"product_id": self.mango.pk, "price": "200", "qty": 2}], phone_no="9000000002")
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}], channel=self.cod_channel, cod_charge=50)
+
+    def test_aggregate(self):
+        with self.assertNumQueries(3):
+            report = OrderReportService.aggregate(Order.objects.all())
+
+        # Total sale adds the COD charges on top of the order totals, as ReportView always has
+        self.assertEqual((report["total_order"], report["total_sale"], report["total_customer"]), (3, Decimal("700"), 2))
+        self.assertEqual(report["by_channel"], {"WhatsApp": 2, "WhatsApp_COD": 1})
+        self.assertEqual((report["by_user"], report["by_account"]), ({self.user.pk: 3}, {self.account.pk: 3}))
+        self.assertEqual(report["top_cities"], [("Chennai", 2)])
+
+    def test_reports_are_cached_per_parameters_until_an_order_changes(self):
+        whatsapp = Order.objects.filter(channel=self.channel)
+        self.assertEqual(OrderReportService.get_report(whatsapp, {"channel": "WA"})["total_order"], 2)
+        with self.assertNumQueries(0):
+            OrderReportService.get_report(whatsapp, {"channel": "WA"})
+        self.assertEqual(OrderReportService.get_report(Order.objects.all(), {})["total_order"], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+
+        self.assertEqual(OrderReportService.get_report(whatsapp, {"channel": "WA"})["total_order"], 3)
+
+
+class AccountLedgerTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cash = Account.objects.create(name="Cash", code="C1", opening_balance=1000)
+
+    def order(self, price, account):
+        return OrderBuilder.create_quick_order(
+            self.user, self.channel.pk, self.customer_data(), [{"product_id": self.apple.pk, "price": price, "qty": 1}], account.pk, self.user.pk
+        )[0]
+
+    def balances(self, account):
+        account = Account.objects.get(pk=account.pk)
+        return account.get_balance(), account.get_today_orders()
+
+    def test_orders_move_the_balances(self):
+        first = self.order("100", self.cash)
+        second = self.order("250", self.cash)
+        self.assertEqual(self.balances(self.cash), (Decimal("1350"), Decimal("350")))
+
+        second.account = self.account
+        second.save()
+        # Deactivated orders still count towards the balance, not towards today's income
+        first.delete()
+
+        self.assertEqual(self.balances(self.cash), (Decimal("1100"), Decimal("0")))
+        self.assertEqual(self.balances(self.account), (Decimal("250"), Decimal("250")))
+        self.assertEqual(AccountLedgerService.rebuild_all(verify_only=True), [])
+
+    def test_first_write_of_the_day_resets_today(self):
+        self.order("100", self.cash)
+        yesterday = Order.current_business_date() - datetime.timedelta(days=1)
+        Order.objects.update(business_date=yesterday)
+        AccountLedger.objects.update(business_date=yesterday)
+        self.assertEqual(self.balances(self.cash), (Decimal("1100"), Decimal("0")))
+
+        self.order("40", self.cash)
+
+        self.assertEqual(self.balances(self.cash), (Decimal("1140"), Decimal("40")))
+        self.assertEqual(AccountLedger.objects.get(account=self.cash).business_date, Order.current_business_date())
+
+    def test_close_day(self):
+        self.order("100", self.cash)
+        today = Order.current_business_date()
+
+        self.assertEqual(AccountLedgerService.close_day(today), 2)
+
+        balance = AccountDailyBalance.objects.get(account=self.cash, business_date=today)
+        self.assertEqual((balance.income, balance.closing_balance), (Decimal("100"), Decimal("1100")))
+
+
+class OrderBuilderTests(MasterTestCase):
+    @override_settings(QUICK_ORDER_ENFORCE_CHANNEL_PRICES=True)
+    def test_order_at_channel_price_is_not_an_override(self):
+        ProductPrice.objects.create(product=self.apple, channel=self.channel, price=Decimal("499.99"))
+
+        order, created, overrides = OrderBuilder.create_quick_order(
+            self.user, self.channel.pk, self.customer_data(), [{"product_id": self.apple.pk, "price": "499.99", "qty": 2}], self.account.pk, self.user.pk
+        )
+
+        self.assertTrue(created)
+        self.assertEqual(overrides, [])
+        self.assertEqual(order.total_amount, Decimal("999.98"))
+        self.assertEqual(OrderItem.objects.get(order=order).price, Decimal("499.99"))
+
+    @override_settings(QUICK_ORDER_ENFORCE_CHANNEL_PRICES=True)
+    def test_order_below_channel_price_is_rejected(self):
+        ProductPrice.objects.create(product=self.apple, channel=self.channel, price=Decimal("499.99"))
+
+        with self.assertRaises(ValueError):
+            self.quick_order([{"product_id": self.apple.pk, "price": "450", "qty": 1}])
+        self.assertFalse(Order.objects.exists())
+
+    def test_channel_price_map_is_exact(self):
+        ProductPrice.objects.create(product=self.apple, channel=self.channel, price=Decimal("499.99"))
+
+        prices = OrderBuilder.channel_price_map(self.channel, [self.apple, self.mango])
+
+        self.assertEqual(prices, {self.apple.pk: Decimal("499.99"), self.mango.pk: Decimal("200.00")})
+
+
+    def test_statements_do_not_grow_with_lines(self):
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}, {"product_id": self.mango.pk, "price": "200", "qty": 1}])
+        products = [Product.objects.create(product_name=f"Product {i}", product_code=f"P{i}", size="1kg", price=10, opning_stock=5) for i in range(8)]
+        self.quick_order([{"product_id": product.pk, "price": "10", "qty": 1} for product in products])
+
+        # Eleven statements (see OrderBuilder), plus the savepoint and release of its atomic block inside the test transaction
+        with self.assertNumQueries(13):
+            self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+        with self.assertNumQueries(13):
+            self.quick_order([{"product_id": product.pk, "price": "10", "qty": 2} for product in products + [self.apple, self.mango]])
+
+
+class OrderItemTotalsTests(MasterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = self.quick_order([{"product_id": self.apple.pk, "price": "90", "qty": 2}, {"product_id": self.mango.pk, "price": "200", "qty": 1}])
+
+    def test_item_writes_keep_the_totals(self):
+        self.assertEqual((self.order.items_amount, self.order.items_quantity), (Decimal("380"), 3))
+
+        item = OrderItem.objects.create(order=self.order, product=self.apple, price=100, quantity=4, amount=400)
+        item.quantity, item.amount = 1, 100
+        item.save()
+        OrderItem.objects.filter(pk=OrderItem.objects.get(order=self.order, product=self.mango).pk).delete()
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.get_total_amount(), order.get_total_quantity()), (Decimal("280"), 3))
+
+    def test_annotated_amounts_need_no_queries_per_order(self):
+        self.quick_order([{"product_id": self.mango.pk, "price": "200", "qty": 3}], phone_no="9000000002")
+        orders = list(Order.objects.with_amounts().order_by("pk"))
+
+        with self.assertNumQueries(0):
+            values = [(o.get_total_amount(), o.get_total_quantity(), o.get_total_actual_amount(), sorted(o.get_products_desc().split(", "))) for o in orders]
+
+        self.assertEqual(values[0], (Decimal("380"), 3, Decimal("400"), ["1x Mango (Rs200.00)", "2x Apple (Rs100.00)"]))
+        self.assertEqual(values[1], (Decimal("600"), 3, Decimal("600"), ["3x Mango (Rs200.00)"]))
+
+    def test_refresh_repairs_drift(self):
+        Order.objects.update(items_amount=0, items_quantity=0)
+
+        self.assertEqual(Order.objects.refresh_item_totals(), 1)
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.items_amount, order.items_quantity), (Decimal("380"), 3))
+
+
+class CatalogServiceTests(MasterTestCase):
+    def test_snapshot_is_cached_until_the_catalog_changes(self):
+        self.assertEqual(CatalogService.get_snapshot()["data"]["prices"], {})
+        with self.assertNumQueries(0):
+            CatalogService.get_snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductPrice.objects.create(product=self.apple, channel=self.channel, price=Decimal("120.50"))
+
+        self.assertEqual(CatalogService.get_snapshot()["data"]["prices"], {"WhatsApp": {str(self.apple.pk): 120.5}})
+
+    def test_search_uses_channel_prices(self):
+        ProductPrice.objects.create(product=self.apple, channel=self.channel, price=Decimal("120.50"))
+
+        self.assertEqual([(p["code"], p["price"]) for p in CatalogService.search("ap", "WhatsApp")], [("AP", 120.5)])
+        self.assertEqual([(p["code"], p["price"]) for p in CatalogService.search("ap", "WhatsApp_COD")], [("AP", 100.0)])
+        self.assertEqual(len(CatalogService.search()), 2)
+
+    def test_catalog_endpoint_revalidates_with_etag(self):
+        self.client.force_login(self.user)
+        url = reverse("master:catalog_snapshot")
+
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertEqual(len(response.json()["products"]), 2)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(product_name="Banana", product_code="BN", size="1kg", price=40)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["products"]), 3)
+
+
+class BusinessDayTests(MasterTestCase):
+    def moment(self, day, hour, minute=0):
+        return timezone.make_aware(datetime.datetime(2026, 3, day, hour, minute))
+
+    def test_cutoff(self):
+        self.assertEqual(Order.business_date_for(self.moment(10, 19, 59)), datetime.date(2026, 3, 10))
+        self.assertEqual(Order.business_date_for(self.moment(10, 20)), datetime.date(2026, 3, 11))
+        self.assertEqual(Order.business_day_range(datetime.date(2026, 3, 11)), (self.moment(10, 20), self.moment(11, 20)))
+        with override_settings(BUSINESS_DAY_CUTOFF_HOUR=18):
+            self.assertEqual(Order.business_date_for(self.moment(10, 19)), datetime.date(2026, 3, 11))
+
+    def test_stored_dates_follow_created(self):
+        orders = []
+        for hour in (9, 19, 20, 23):
+            with mock.patch("django.utils.timezone.now", return_value=self.moment(10, hour, 30)):
+                orders.append(self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}]))
+        stored = [order.business_date for order in orders]
+        self.assertEqual(stored, [datetime.date(2026, 3, 10)] * 2 + [datetime.date(2026, 3, 11)] * 2)
+
+        Order.objects.update(business_date=datetime.date(2000, 1, 1))
+        Order.objects.refresh_business_dates()
+
+        self.assertEqual([order.business_date for order in Order.objects.order_by("pk")], stored)
+        self.assertEqual(Order.objects.for_business_day(datetime.date(2026, 3, 11)).count(), 2)
+        self.assertEqual(Order.objects.for_business_range(datetime.date(2026, 3, 9), datetime.date(2026, 3, 10)).count(), 2)
+
+
+class OrderStatServiceTests(MasterTestCase):
+    def order_at(self, hour):
+        moment = timezone.make_aware(datetime.datetime(2026, 3, 10, hour, 30))
+        with mock.patch("django.utils.timezone.now", return_value=moment):
+            return self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+
+    def stats(self):
+        return sorted(OrderHourlyStat.objects.values_list("business_date", "hour", "order_count", "total_amount"))
+
+    def test_orders_after_the_cutoff_count_towards_the_next_business_day(self):
+        self.order_at(10)
+        self.order_at(21)
+
+        self.assertEqual(self.stats(), [(datetime.date(2026, 3, 10), 10, 1, Decimal("100")), (datetime.date(2026, 3, 11), 21, 1, Decimal("100"))])
+
+    def test_rebuild_matches_the_signal_maintained_rollup(self):
+        self.order_at(10)
+        self.order_at(21)
+        maintained = self.stats()
+
+        OrderStatService.rebuild(start=datetime.date(2026, 3, 10), end=datetime.date(2026, 3, 11))
+
+        self.assertEqual(self.stats(), maintained)
+
+    def test_edits_move_the_order_between_rows(self):
+        order = self.order_at(10)
+        order.channel, order.cod_charge, order.total_amount = self.cod_channel, Decimal("50"), Decimal("150")
+        order.save()
+
+        rows = OrderHourlyStat.objects.filter(order_count__gt=0).values_list("channel", "order_count", "total_amount", "cod_charge")
+        self.assertEqual(list(rows), [(self.cod_channel.pk, 1, Decimal("150"), Decimal("50"))])
+        self.assertEqual(OrderHourlyStat.objects.get(channel=self.channel).total_amount, 0)
+
+    def test_deactivated_and_deleted_orders_leave_the_rollup(self):
+        self.order_at(10)
+        deactivated, deleted = self.order_at(10), self.order_at(10)
+        deactivated.delete()
+        Order.objects.filter(pk=deleted.pk).delete()
+
+        self.assertEqual(self.stats(), [(datetime.date(2026, 3, 10), 10, 1, Decimal("100"))])
+
+    def test_dashboard_counts_the_business_day(self):
+        self.order_at(10)
+        self.order_at(21)
+
+        context = OrderStatService.get_dashboard(datetime.date(2026, 3, 11))
+
+        self.assertEqual(context["orders"], 1)
+        self.assertEqual(context["whatsapp_count_today"], 1)
+        self.assertEqual(context["WhatsApp_data"][-2:], [1, 1])
+
+
+class OrderSearchServiceTests(MasterTestCase):
+    def named_order(self, phone_no, customer_name):
+        order, created, overrides = OrderBuilder.create_quick_order(
+            self.user, self.channel.pk, self.customer_data(phone_no, customer_name=customer_name),
+            [{"product_id": self.apple.pk, "price": "100", "qty": 1}], self.account.pk, self.user.pk,
+        )
+        return order
+
+    def test_exact_matches_are_not_crowded_out_by_prefixes(self):
+        exact = self.named_order("9000000001", "Ram")
+        self.named_order("9000000002", "Ramesh")
+        self.named_order("9000000003", "Ramu")
+
+        with mock.patch.object(OrderSearchService, "MAX_CANDIDATES", 2):
+            self.assertEqual(OrderSearchService.search("ram")[0], exact)
+
+    def test_substrings_match_in_ranked_search_only(self):
+        order = self.named_order("9000123456", "Ram")
+
+        self.assertEqual(OrderSearchService.search("0123"), [order])
+        # The uncapped list filter stays on the indexed prefix range
+        with self.assertNumQueries(1) as queries:
+            self.assertFalse(OrderSearchService.filter_queryset(Order.objects.all(), "0123").exists())
+        self.assertNotIn("LIKE", queries.captured_queries[0]["sql"])
+
+    def test_list_filter_is_not_capped(self):
+        for i in range(3):
+            self.named_order(f"900000000{i}", "Ram")
+
+        with mock.patch.object(OrderSearchService, "MAX_CANDIDATES", 1):
+            self.assertEqual(OrderSearchService.filter_queryset(Order.objects.all(), "ram").count(), 3)
+            self.assertEqual(OrderSearchService.filter_queryset(Order.objects.all(), "ram 9000000001").count(), 1)
+
+    def test_order_save_only_rewrites_changed_tokens(self):
+        order = self.named_order("9000000001", "Ram")
+        phone_token = OrderSearchToken.objects.get(order=order, token="9000000001")
+
+        order.name = "Ravi"
+        order.save()
+
+        self.assertTrue(OrderSearchToken.objects.filter(pk=phone_token.pk).exists())
+        self.assertEqual(OrderSearchService.search("ravi"), [order])
+
+    def test_customer_save_reindexes_only_on_search_field_changes(self):
+        order = self.named_order("9000000001", "Ram")
+        customer = Customer.objects.get(pk=order.customer_id)
+
+        with mock.patch.object(OrderSearchService, "index_orders") as index_orders:
+            customer.save()
+            index_orders.assert_not_called()
+            customer.customer_name = "Ravi"
+            customer.save()
+            index_orders.assert_called_once()
+
+
+class OrderImporterTests(MasterTestCase):
+    HEADER = "order_ref,channel,phone_no,customer_name,address,city,state,pincode,account,utr,cod_charge,product,quantity,price\n"
+
+    def run_import(self, body, **kwargs):
+        rows = OrderImporter.read_rows(io.BytesIO((self.HEADER + body).encode()), "orders.csv")
+        return OrderImporter(self.user, **kwargs).run(rows)
+
+    def test_rows_are_grouped_into_orders_at_exact_channel_prices(self):
+        ProductPrice.objects.create(product=self.apple, channel=self.channel, price=Decimal("499.99"))
+
+        result = self.run_import(
+            "A1,WA,9000000001,Ravi,1 Main St,Chennai,Tamil Nadu,600001,B1,utr1,,AP,2,\n"
+            "A1,WA,9000000001,Ravi,1 Main St,Chennai,Tamil Nadu,600001,B1,utr1,,MG,1,180\n"
+            ",WC,9000000002,Anu,2 Main St,Madurai,Tamil Nadu,625001,B1,,50,ap,1,\n"
+        )
+
+        self.assertEqual((result["rows"], result["orders"], result["items"], result["customers"], result["errors"]), (3, 2, 3, 2, []))
+        order = Order.objects.get(channel=self.channel)
+        self.assertEqual((order.order_no, order.utr, order.total_amount), ("WA-EB0001", "UTR1", Decimal("1179.98")))
+        self.assertEqual(OrderItem.objects.get(order=order, product=self.apple).price, Decimal("499.99"))
+        self.assertEqual(Order.objects.get(channel=self.cod_channel).total_amount, Decimal("150"))
+
+    def test_bulk_writes_keep_the_ledgers_and_indexes(self):
+        self.run_import(",WA,9000000001,Ravi,,,,,B1,UTR1,,AP,2,100\n,WA,9000000002,Anu,,,,,B1,,,MG,1,200\n")
+
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).get_stock(), 48)
+        self.assertEqual(StockLedgerService.rebuild_all(verify_only=True), [])
+        self.assertEqual(AccountLedgerService.rebuild_all(verify_only=True), [])
+        self.assertEqual(Account.objects.get(pk=self.account.pk).get_balance(), Decimal("400"))
+        self.assertEqual(sum(OrderHourlyStat.objects.values_list("order_count", flat=True)), 2)
+        self.assertEqual([order.customer.customer_name for order in OrderSearchService.search("ravi")], ["Ravi"])
+        self.assertTrue(UTRRegistry.exists("utr1"))
+
+    def test_repeat_customers_keep_their_first_address(self):
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}])
+
+        result = self.run_import(",WA,9000000001,New Name,9 New St,Madurai,Tamil Nadu,625001,B1,,,AP,1,100\n")
+
+        customer = Customer.objects.get(phone_no="9000000001")
+        self.assertEqual((result["customers"], customer.customer_name, customer.name_2, customer.city_2), (0, "Test Customer", "New Name", "Madurai"))
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        self.quick_order([{"product_id": self.apple.pk, "price": "100", "qty": 1}], utr="UTR9")
+
+        result = self.run_import(
+            ",XX,9000000001,Ravi,,,,,B1,,,AP,1,100\n"
+            ",WA,9000000002,Ravi,,,,,B1,,,ZZ,1,100\n"
+            ",WA,9000000003,,,,,,B1,,,AP,1,100\n"
+            ",WA,9000000004,Ravi,,,,,B1,UTR5,,AP,1,100\n"
+            ",WA,9000000005,Ravi,,,,,B1,utr5,,AP,1,100\n"
+            ",WA,9000000006,Ravi,,,,,B1,UTR9,,AP,1,100\n"
+            ",WA,9000000007,Ravi,,,,,B1,,,AP,-1,100\n"
+        )
+
+        self.assertEqual([error["row"] for error in result["errors"]], [2, 3, 6, 8, 7, 4])
+        self.assertEqual(result["orders"], 1)
+
+    def test_a_chunk_rejected_by_the_database_is_retried_order_by_order(self):
+        register_many = UTRRegistry.register_many
+
+        def reject_bad(orders):
+            if any(order.utr == "BAD" for order in orders):
+                raise IntegrityError("UNIQUE constraint failed")
+            register_many(orders)
+
+        with mock.patch.object(UTRRegistry, "register_many", side_effect=reject_bad):
+            result = self.run_import(",WA,9000000001,Ravi,,,,,B1,,,AP,1,100\n,WA,9000000002,Anu,,,,,B1,bad,,AP,1,100\n,WA,9000000003,Raj,,,,,B1,,,AP,1,100\n")
+
+        self.assertEqual(result["orders"], 2)
+        self.assertEqual([(error["row"], error["error"]) for error in result["errors"]], [(3, "UNIQUE constraint failed")])
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).get_stock(), 48)
+
+    def test_xlsx_numbers_are_read_as_text(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(["Channel", "Phone No", "Customer Name", "Account", "Product", "Quantity"])
+        workbook.active.append(["WA", 9000000001.0, "Ravi", "B1", "AP", 2.0])
+        upload = io.BytesIO()
+        workbook.save(upload)
+        upload.seek(0)
+
+        result = OrderImporter(self.user).run(OrderImporter.read_rows(upload, "orders.xlsx"))
+
+        self.assertEqual((result["orders"], result["errors"]), (1, []))
+        self.assertEqual(Order.objects.get().customer.phone_no, "9000000001")
+
+
+class ImportOrdersViewTests(MasterTestCase):
+    def upload(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        return SimpleUploadedFile("orders.csv", b"channel,phone_no,customer_name,account,product,quantity\nWA,9000000001,Test,B1,AP,1\n", content_type="text/csv")
+
+    def test_staff_users_cannot_import(self):
+        staff = User.objects.create_user("staff", "staff@example.com", "staff", usertype="Staff")
+        self.client.force_login(staff)
+
+        response = self.client.post(reverse("master:import_orders"), {"file": self.upload()})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Order.objects.exists())
+
+    def test_admins_can_import(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse("master:import_orders"), {"file": self.upload()})
+
+        self.assertEqual(response.json()["orders"], 1)
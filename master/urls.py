@@ -11,8 +11,11 @@ urlpatterns = [
     # Quick Order Entry
     path("orders/quick-entry/", views.QuickOrderEntryView.as_view(), name="quick_order_entry"),
     path("orders/quick-entry/save/", views.quick_order_save, name="quick_order_save"),
+    path("orders/import/", views.import_orders, name="import_orders"),
     path("api/check-utr/", views.check_utr, name="check_utr"),
     path("api/search-products/", views.search_products, name="search_products"),
+    path("api/search-orders/", views.search_orders, name="search_orders"),
+    path("api/catalog/", views.catalog_snapshot, name="catalog_snapshot"),
     path("api/lookup-pincode/", views.lookup_pincode, name="lookup_pincode"),
     
     #account
@@ -1,20 +1,22 @@
 import json
 from datetime import datetime, timedelta
 from decimal import Decimal
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.db import transaction
 from django.db.models import Sum, Count
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse_lazy
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.views import View
 from django.utils.decorators import method_decorator
 from core import mixins
 from master.forms import CustomerForm, DateFilter, OrderItemFormSet
-from master.models import Account, Channel, Customer, Order, OrderItem, Product, ProductPrice
+from master.models import Account, Channel, Customer, Order, Product, ProductPrice
 from master import tables
+from master.services import CatalogService, ChannelCounterService, OrderBuilder, OrderImporter, OrderSearchService
 from accounts.models import User
+from channels_config.services import DuplicateUTR, UTRRegistry
 
 today = datetime.now().date()
 yesterday = today - timedelta(days=1) 
@@ -50,6 +52,10 @@ class AccountListView(mixins.HybridListView):
     table_class = tables.AccountTable
     template_name = 'master/account_list.html'
     filterset_fields = {"name": ["contains", "startswith"], "code": ["contains", "startswith"]}
+
+    def get_queryset(self):
+        # Balance and today's income are read from the ledger row joined here
+        return super().get_queryset().select_related("ledger")
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -303,6 +309,7 @@ class ProductPriceDeleteView(mixins.HybridDeleteView):
 class CustomerListView(mixins.HybridListView):
     model = Customer
     table_class = tables.CustomerTable
+    query_budget = 8
     filterset_fields = {"phone_no": ["exact"], "pincode": ["exact"], "state": ["exact"], "city": ["exact"], "customer_name": ["contains", "startswith"]}
     search_fields = ('customer__pincode','customer__customer_name','customer__phone_no') 
 
@@ -356,7 +363,15 @@ class OrderListView(mixins.HybridListView):
     table_class = tables.OrderTable
     filterset_fields = { "channel__channel_type": ["exact"],'order_by':['exact'], "account": ["exact",]}
     template_name = "order/order_list.html"
+    query_budget = 10
     search_fields = ("order_no",'customer__pincode','utr','customer__customer_name','customer__phone_no') 
+    list_select_related = ("customer", "channel", "account", "order_by")
+    list_prefetch_related = ("orderitem_set__product",)
+    keyset_pagination = True
+
+    def filter_search(self, queryset, query):
+        # Token index instead of the icontains scan over search_fields
+        return OrderSearchService.filter_queryset(queryset, query)
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -460,30 +475,8 @@ class OrderListView(mixins.HybridListView):
             context["is_order"] = True
         else:
             context["is_orders"] = True
-        WhatsApp = qs.filter(channel__channel_type="WhatsApp")
-        cod = qs.filter(channel__channel_type="WhatsApp_COD")
-        swigy = qs.filter(channel__channel_type="Swiggy")
-        kumar = qs.filter(channel__channel_type="Kumar")
-        wholesale = qs.filter(channel__channel_type="Wholesale")
-        promo = qs.filter(channel__channel_type="Promo")
-        counter = qs.filter(channel__channel_type="Counter")
-        replacement = qs.filter(channel__channel_type="Return_or_Replace")
-        context["whatsapp_count"] = WhatsApp.count()
-        context['whatsapp_count_today'] = WhatsApp.filter(created__date=today).count()
-        context["whatsapp_cod_count"] = cod.count()
-        context["whatsapp_cod_count_today"] = cod.filter(created__date=today).count()
-        context["swiggy_count"] = swigy.count()
-        context["swiggy_count_today"] = swigy.filter(created__date=today).count()
-        context["kumar_count"] = kumar.count()
-        context["kumar_count_today"] = kumar.filter(created__date=today).count()
-        context["wholesale_count"] = wholesale.count()
-        context["wholesale_count_today"] = wholesale.filter(created__date=today).count()
-        context["promo_count"] = promo.count()
-        context["promo_count_today"] = promo.filter(created__date=today).count()
-        context["counter_count"] = counter.count()
-        context["counter_count_today"] = counter.filter(created__date=today).count()
-        context["return_or_replace_count"] = replacement.count()
-        context["return_or_replace_count_today"] = replacement.filter(created__date=today).count()
+        # Searches narrow the counters; the plain list shares the cached totals
+        context.update(ChannelCounterService.get_context(qs if self.request.GET.get("q") else None))
         context["form"] = form
         context["date"] = date
         context["date__lte"] = date__lte
@@ -525,8 +518,6 @@ class OrderCreateView(mixins.HybridCreateView):
         context = super().get_context_data(**kwargs)
         type = self.request.GET.get("type")
         
-        qs = Order.objects.filter(is_active=True).order_by("-created")
-        
         type_map = {
             "WhatsApp": "is_whatsapp",
             "Swiggy": "is_swiggy",
@@ -549,30 +540,7 @@ class OrderCreateView(mixins.HybridCreateView):
             OrderItemFormSet(prefix=prefix)
         )
         # Channel-specific counts
-        WhatsApp = qs.filter(channel__channel_type="WhatsApp")
-        cod = qs.filter(channel__channel_type="WhatsApp_COD")
-        swigy = qs.filter(channel__channel_type="Swiggy")
-        kumar = qs.filter(channel__channel_type="Kumar")
-        wholesale = qs.filter(channel__channel_type="Wholesale")
-        promo = qs.filter(channel__channel_type="Promo")
-        counter = qs.filter(channel__channel_type="Counter")
-        replacement = qs.filter(channel__channel_type="Return_or_Replace")
-        context["whatsapp_count"] = WhatsApp.count()
-        context['whatsapp_count_today'] = WhatsApp.filter(created__date=today).count()
-        context["whatsapp_cod_count"] = cod.count()
-        context["whatsapp_cod_count_today"] = cod.filter(created__date=today).count()
-        context["swiggy_count"] = swigy.count()
-        context["swiggy_count_today"] = swigy.filter(created__date=today).count()
-        context["kumar_count"] = kumar.count()
-        context["kumar_count_today"] = kumar.filter(created__date=today).count()
-        context["wholesale_count"] = wholesale.count()
-        context["wholesale_count_today"] = wholesale.filter(created__date=today).count()
-        context["promo_count"] = promo.count()
-        context["promo_count_today"] = promo.filter(created__date=today).count()
-        context["counter_count"] = counter.count()
-        context["counter_count_today"] = counter.filter(created__date=today).count()
-        context["return_or_replace_count"] = replacement.count()
-        context["return_or_replace_count_today"] = replacement.filter(created__date=today).count()
+        context.update(ChannelCounterService.get_context())
         return context
       
 
@@ -682,14 +650,20 @@ class OrderUpdateView(mixins.HybridUpdateView):
         order_item_formset = OrderItemFormSet(self.request.POST, instance=self.object, prefix="Ordersubjects")
 
         if order_item_formset.is_valid():
-            customer = self.object.customer
-            for field, value in form.cleaned_data.items():
-                setattr(customer, field, value)
-            customer.save()
-            customer.save()
-            self.object = form.save()
-            order_item_formset.instance = self.object
-            order_item_formset.save()
+            try:
+                with transaction.atomic():
+                    customer = self.object.customer
+                    for field, value in form.cleaned_data.items():
+                        setattr(customer, field, value)
+                    customer.save()
+                    customer.save()
+                    self.object = form.save()
+                    order_item_formset.instance = self.object
+                    order_item_formset.save()
+            except DuplicateUTR as e:
+                # Another order took the UTR after clean() checked it
+                form.add_error("utr", str(e))
+                return self.render_to_response(self.get_context_data(form=form, order_item_formset=order_item_formset))
             return super().form_valid(form)
 
         return self.render_to_response(self.get_context_data(form=form, order_item_formset=order_item_formset))
@@ -720,74 +694,42 @@ class OrderDeleteView(mixins.HybridDeleteView):
 class QuickOrderEntryView(View):
     """Fast order entry page with channel cards and keyboard-optimized workflow."""
     template_name = 'order/quick_entry.html'
+    query_budget = 12
     
     def get_business_day_range(self):
         """Get the current business day range (IST 8PM - 8PM)."""
-        from datetime import timezone as tz
-        import pytz
-        
-        ist = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist)
-        
-        # Business day cutoff is 8 PM IST
-        cutoff_hour = 20
-        
-        if now.hour >= cutoff_hour:
-            # After 8 PM - business day is tomorrow
-            business_date = now.date() + timedelta(days=1)
-            start = now.replace(hour=cutoff_hour, minute=0, second=0, microsecond=0)
-            end = start + timedelta(days=1)
-        else:
-            # Before 8 PM - business day is today
-            business_date = now.date()
-            start = (now - timedelta(days=1)).replace(hour=cutoff_hour, minute=0, second=0, microsecond=0)
-            end = now.replace(hour=cutoff_hour, minute=0, second=0, microsecond=0)
-        
+        business_date = Order.current_business_date()
+        start, end = Order.business_day_range(business_date)
         return business_date, start, end
     
     def get(self, request):
-        from datetime import date
         channels = Channel.objects.filter(is_active=True).order_by('id')
         accounts = Account.objects.filter(is_active=True)
         users = User.objects.filter(is_active=True)
-        products = Product.objects.filter(is_active=True)
-        
-        # Get today's stats for each channel
-        today = date.today()
         
-        # Calculate business date (IST 8PM-8PM)
-        from datetime import timezone as tz
-        import pytz
-        ist = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist)
-        if now.hour >= 20:
-            business_date = today + timedelta(days=1)
-        else:
-            business_date = today
+        # Today's stats for every channel in one grouped query on the business_date index
+        business_date = Order.current_business_date()
+        stats = {
+            row['channel']: row
+            for row in Order.objects.for_business_day(business_date).filter(is_active=True).order_by()
+            .values('channel').annotate(count=Count('id'), total=Sum('total_amount'))
+        }
         
         channel_data = []
         for channel in channels:
-            orders = Order.objects.filter(
-                channel=channel,
-                is_active=True,
-                created__date=today
-            )
+            row = stats.get(channel.id, {})
             channel_data.append({
                 'id': channel.id,
                 'channel_type': channel.channel_type,
                 'prefix': getattr(channel, 'prefix', ''),
-                'today_count': orders.count(),
-                'today_amount': orders.aggregate(total=Sum('total_amount'))['total'] or 0
+                'today_count': row.get('count', 0),
+                'today_amount': row.get('total') or 0
             })
         
-        # Products JSON for frontend search
-        products_json = json.dumps([{
-            'id': p.id,
-            'name': str(p),
-            'code': p.product_code or '',
-            'price': float(p.price),
-            'size': p.size
-        } for p in products])
+        # Products and channel prices for frontend search, from the cached catalog snapshot
+        catalog = CatalogService.get_snapshot()['data']
+        products_json = json.dumps(catalog['products'])
+        prices_json = json.dumps(catalog['prices'])
         
         # Get carriers if logistics app exists
         carriers = []
@@ -805,6 +747,7 @@ class QuickOrderEntryView(View):
             'users': users,
             'carriers': carriers,
             'products_json': products_json,
+            'prices_json': prices_json,
             'active_channel': active_channel,
             'business_date': business_date,
         }
@@ -817,101 +760,61 @@ class QuickOrderEntryView(View):
 def quick_order_save(request):
     """Save order from quick entry form."""
     try:
-        with transaction.atomic():
-            # Parse form data
-            channel_id = request.POST.get('channel_id')
-            phone_no = request.POST.get('phone_no')
-            customer_name = request.POST.get('customer_name')
-            alternate_phone_no = request.POST.get('alternate_phone_no', '')
-            pincode = request.POST.get('pincode')
-            city = request.POST.get('city')
-            state = request.POST.get('state')
-            address = request.POST.get('address')
-            country = request.POST.get('country', 'India')
-            account_id = request.POST.get('account')
-            order_by_id = request.POST.get('order_by')
-            utr = request.POST.get('utr', '').strip()
-            cod_charge = Decimal(request.POST.get('cod_charge', '0') or '0')
-            items_json = request.POST.get('items_json', '[]')
-            
-            # Validate channel
-            channel = get_object_or_404(Channel, id=channel_id)
-            
-            # Validate UTR uniqueness for WhatsApp channel
-            if channel.channel_type == 'WhatsApp' and utr:
-                if Order.objects.filter(utr=utr, is_active=True).exists():
-                    return JsonResponse({'success': False, 'error': 'UTR already exists'})
-            
-            # Get or create customer
-            customer, created = Customer.objects.get_or_create(
-                phone_no=phone_no,
-                defaults={
-                    'customer_name': customer_name,
-                    'alternate_phone_no': alternate_phone_no,
-                    'pincode': pincode,
-                    'city': city,
-                    'state': state,
-                    'address': address,
-                    'country': country,
-                    'creator': request.user,
-                }
-            )
-            
-            if not created:
-                # Update secondary address fields
-                customer.name_2 = customer_name
-                customer.pincode_2 = pincode
-                customer.city_2 = city
-                customer.state_2 = state
-                customer.address_2 = address
-                customer.country_2 = country
-                customer.save()
-            
-            # Parse items
-            items = json.loads(items_json)
-            if not items:
-                return JsonResponse({'success': False, 'error': 'At least one item is required'})
-            
-            # Calculate total
-            total_amount = Decimal('0')
-            for item in items:
-                total_amount += Decimal(item['price']) * int(item['qty'])
-            total_amount += cod_charge
-            
-            # Create order
-            order = Order.objects.create(
-                channel=channel,
-                customer=customer,
-                account_id=account_id,
-                order_by_id=order_by_id,
-                utr=utr or None,
-                cod_charge=cod_charge,
-                total_amount=total_amount,
-                creator=request.user,
-            )
-            
-            # Create order items
-            for item in items:
-                product = get_object_or_404(Product, id=item['product_id'])
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    price=Decimal(item['price']),
-                    quantity=int(item['qty']),
-                    amount=Decimal(item['price']) * int(item['qty']),
-                    creator=request.user,
-                )
-            
-            return JsonResponse({
-                'success': True,
-                'order_id': order.id,
-                'order_no': order.order_no,
-            })
+        order, created, price_overrides = OrderBuilder.create_quick_order(
+            user=request.user,
+            channel_id=request.POST.get('channel_id'),
+            customer_data={
+                'phone_no': request.POST.get('phone_no'),
+                'customer_name': request.POST.get('customer_name'),
+                'alternate_phone_no': request.POST.get('alternate_phone_no', ''),
+                'pincode': request.POST.get('pincode'),
+                'city': request.POST.get('city'),
+                'state': request.POST.get('state'),
+                'address': request.POST.get('address'),
+                'country': request.POST.get('country', 'India'),
+            },
+            items=json.loads(request.POST.get('items_json', '[]')),
+            account_id=request.POST.get('account'),
+            order_by_id=request.POST.get('order_by'),
+            utr=request.POST.get('utr', '').strip(),
+            cod_charge=Decimal(request.POST.get('cod_charge', '0') or '0'),
+            idempotency_key=request.POST.get('idempotency_key', '').strip() or None,
+        )
+        return JsonResponse({
+            'success': True,
+            'order_id': order.id,
+            'order_no': order.order_no,
+            'duplicate': not created,
+            'price_overrides': price_overrides,
+        })
             
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+@login_required
+@require_http_methods(["POST"])
+def import_orders(request):
+    """Bulk import orders from an uploaded CSV/XLSX file (admins only)."""
+    if not mixins.check_access(request, ["Admin", "Superadmin"]):
+        return JsonResponse({'success': False, 'error': 'Only admins can import orders'}, status=403)
+    
+    upload = request.FILES.get('file')
+    if not upload or not upload.name.lower().endswith(('.csv', '.xlsx')):
+        return JsonResponse({'success': False, 'error': 'Upload a .csv or .xlsx file'}, status=400)
+    
+    result = OrderImporter(request.user).run(OrderImporter.read_rows(upload.file, upload.name))
+    return JsonResponse({
+        'success': True,
+        'orders': result['orders'],
+        'items': result['items'],
+        'customers': result['customers'],
+        'rows': result['rows'],
+        'error_count': len(result['errors']),
+        'errors': result['errors'][:500],
+    })
+
+
 @login_required
 def check_utr(request):
     """Check if UTR already exists."""
@@ -919,8 +822,33 @@ def check_utr(request):
     if not utr:
         return JsonResponse({'exists': False})
     
-    exists = Order.objects.filter(utr=utr, is_active=True).exists()
-    return JsonResponse({'exists': exists})
+    return JsonResponse({'exists': UTRRegistry.exists(utr)})
+
+
+@login_required
+def search_orders(request):
+    """Ranked order search by phone, order number, UTR, pincode or customer name."""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 100)
+    except ValueError:
+        limit = 20
+    if len(query) < 2:
+        return JsonResponse({'orders': []})
+    
+    orders = [{
+        'id': order.pk,
+        'order_no': order.order_no,
+        'customer_name': order.customer.customer_name,
+        'phone_no': order.customer.phone_no,
+        'pincode': order.customer.pincode,
+        'utr': order.utr,
+        'channel': order.channel.channel_type,
+        'total_amount': order.total_amount,
+        'created': order.created,
+        'url': str(order.get_absolute_url()),
+    } for order in OrderSearchService.search(query, limit)]
+    return JsonResponse({'orders': orders})
 
 
 @login_required
@@ -929,31 +857,22 @@ def search_products(request):
     query = request.GET.get('q', '').strip()
     channel_type = request.GET.get('channel', '')
     
-    products = Product.objects.filter(is_active=True)
-    
-    if query:
-        products = products.filter(
-            models.Q(product_name__icontains=query) |
-            models.Q(product_code__icontains=query)
-        )[:10]
-    
-    results = []
-    for p in products:
-        price = p.price
-        if channel_type:
-            price = p.get_price(channel_type)
-        
-        results.append({
-            'id': p.id,
-            'name': str(p),
-            'code': p.product_code or '',
-            'price': float(price),
-            'size': p.size,
-        })
-    
+    results = [
+        {'id': p['id'], 'name': p['name'], 'code': p['code'], 'price': p['price'], 'size': p['size']}
+        for p in CatalogService.search(query, channel_type or None)
+    ]
     return JsonResponse({'products': results})
 
 
+@login_required
+@condition(etag_func=lambda request: CatalogService.get_snapshot()['etag'])
+def catalog_snapshot(request):
+    """Active products and channel prices; clients revalidate with If-None-Match."""
+    response = HttpResponse(CatalogService.get_snapshot()['json'], content_type='application/json')
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @login_required  
 def lookup_pincode(request):
     """Lookup city/state from pincode using external API or local database."""
@@ -963,17 +882,15 @@ def lookup_pincode(request):
         return JsonResponse({'success': False, 'error': 'Invalid pincode'})
     
     # Try local PincodeMaster first
-    try:
-        from marketing.models import PincodeMaster
-        pm = PincodeMaster.objects.filter(pincode=pincode).first()
-        if pm:
-            return JsonResponse({
-                'success': True,
-                'city': pm.district,
-                'state': pm.state,
-            })
-    except:
-        pass
+    from marketing.services import PincodeDirectory
+    location = PincodeDirectory.lookup(pincode)
+    if location:
+        return JsonResponse({
+            'success': True,
+            'city': location.district,
+            'state': location.state,
+            'tier': location.tier,
+        })
     
     # Fallback - let frontend handle external API call
     return JsonResponse({'success': False, 'error': 'Not found locally'})